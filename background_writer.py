@@ -0,0 +1,173 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+#Size of the file buffer new PDF files are written through (PyPDF2 writes each object with many small writes)
+WRITE_BUFFER_SIZE = 8 * 1024 * 1024
+
+def write_pdf_file(writer, output_filename):
+    """
+    Writes a PdfFileWriter to a new PDF file through a buffered temporary file that replaces the PDF file once it is complete,
+    so a failed write never leaves a partial PDF file (the temporary file is removed and the error is raised)
+
+    Parameters
+    ----------
+    writer: PdfFileWriter2
+        The PdfFileWriter to write
+    output_filename: str
+        Name of the new PDF file
+
+    Returns
+    -------
+    int
+        Number of bytes written
+    """
+
+    temp_filename = output_filename + '.part'
+    try:
+        with open(temp_filename, 'wb', buffering=WRITE_BUFFER_SIZE) as new_file:
+            writer.write(new_file)
+            bytes_written = new_file.tell()
+        os.replace(temp_filename, output_filename)
+    except BaseException:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        raise
+    return bytes_written
+
+class BackgroundPdfWriter():
+    """
+    Serializes and writes completed PdfFileWriters to their PDF files in background threads, so the next PDF files are populated
+    while the previous ones are written (e.g. to a network share). Completed writers wait in a bounded queue: submitting a writer
+    blocks while max_pending writers are waiting, which bounds the memory held by writers that are not written yet.
+    The first error of a background write is raised in the submitting thread by the next submit or wait call, and the writers
+    queued until the next wait call are discarded (their PDF files are not written and their callbacks are not called). The callback of each written PDF file is called in the submitting thread (see run_callbacks)
+
+    Attributes
+    ----------
+    metrics: RunMetrics
+        Object the 'write' stage of each PDF file and the 'write_wait' stage (time spent waiting for the writer threads) are recorded in
+    num_threads: int
+        Number of writer threads
+    max_pending: int
+        Maximum number of writers waiting to be written
+    """
+
+    def __init__(self, metrics, num_threads=1, max_pending=2):
+        """
+        Parameters
+        ----------
+        metrics: RunMetrics
+            Object the stage timings are recorded in
+        num_threads: int, optional
+            Number of writer threads (defaults to 1)
+        max_pending: int, optional
+            Maximum number of writers waiting to be written (defaults to 2)
+        """
+
+        self.metrics = metrics
+        self.num_threads = num_threads
+        self.max_pending = max_pending
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._threads = []
+        #The first error of a background write (raised by the next submit or wait call)
+        self._error = None
+        #True from the first failed write until the queued writers are discarded (see wait), the error may already be raised
+        self._failed = False
+        #Callbacks of the PDF files written since they were last run
+        self._completed = deque()
+
+    def _start(self):
+        #Starts the writer threads the first time a writer is submitted
+        while len(self._threads) < self.num_threads:
+            thread = threading.Thread(target=self._write_queued, name=f'pdf-writer-{len(self._threads) + 1}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _write_queued(self):
+        #Writes the queued writers until the stop sentinel (None) is queued
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                writer, output_filename, file_name, on_written = job
+                if self._failed:
+                    #Discard the writers queued after a failed write
+                    continue
+                start_time = time.perf_counter()
+                try:
+                    bytes_written = write_pdf_file(writer, output_filename)
+                except Exception as error:
+                    if not self._failed:
+                        self._error = error
+                    self._failed = True
+                    continue
+                self.metrics.record_stage('write', file_name or output_filename, time.perf_counter() - start_time, bytes_written=bytes_written)
+                if on_written is not None:
+                    self._completed.append(on_written)
+            finally:
+                self._queue.task_done()
+
+    def run_callbacks(self):
+        """
+        Calls the callback of each PDF file written since the callbacks were last run (in the calling thread),
+        then raises the first error of a background write if one occurred
+        """
+
+        while self._completed:
+            self._completed.popleft()()
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def submit(self, writer, output_filename, file_name=None, on_written=None):
+        """
+        Queues a completed PdfFileWriter to be written to a new PDF file (blocks while max_pending writers are waiting).
+        The writer must not be modified after it is submitted
+
+        Parameters
+        ----------
+        writer: PdfFileWriter2
+            The PdfFileWriter to write
+        output_filename: str
+            Name of the new PDF file
+        file_name: str, optional
+            Name the metrics are recorded under (defaults to None - the new PDF file name)
+        on_written: callable, optional
+            Function called without arguments once the PDF file is written (defaults to None)
+        """
+
+        self.run_callbacks()
+        self._start()
+        with self.metrics.stage('write_wait', file_name or output_filename):
+            self._queue.put((writer, output_filename, file_name, on_written))
+
+    def wait(self):
+        """
+        Waits until every submitted writer is written (or discarded after an error), then runs the callbacks of the written
+        PDF files and raises the first error of a background write if one occurred. Writers submitted afterwards are written again
+        """
+
+        if self._threads:
+            with self.metrics.stage('write_wait'):
+                self._queue.join()
+        #Every writer queued after a failed write was discarded
+        self._failed = False
+        self.run_callbacks()
+
+    def close(self):
+        """
+        Waits for the submitted writers (see wait) and stops the writer threads
+        """
+
+        try:
+            self.wait()
+        finally:
+            for thread in self._threads:
+                self._queue.put(None)
+            for thread in self._threads:
+                thread.join()
+            self._threads = []
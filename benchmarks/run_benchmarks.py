@@ -0,0 +1,192 @@
+"""
+Benchmarks the SARF generation process on synthetic P&P files and a synthetic SARF template and saves the results as JSON
+
+Usage (from the main project directory):
+    python -m benchmarks.run_benchmarks [--sizes 10 1000 50000] [--workers 1] [--output benchmark_results.json] [--compare previous_results.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from metrics import peak_rss_mb
+
+#Number of users of each benchmark
+DEFAULT_SIZES = [10, 1000, 50000]
+#Sheet name and header row number of the synthetic P&P files (same as main)
+USER_DATA_SHEETNAME = 'CRM Users'
+USER_DATA_HEADER_ROW_NUM = 2
+
+def benchmark_users(num_users, work_dir, max_workers=1, seed=0):
+    """
+    Generates a synthetic SARF template and P&P file with the number of users, runs each stage of the SARF generation process on them
+    and returns the wall time and peak memory of each stage
+
+    Parameters
+    ----------
+    num_users: int
+        Number of users in the synthetic P&P file
+    work_dir: str
+        Directory the synthetic input files and the generated SARF are written to
+    max_workers: int, optional
+        Number of worker processes used to read the P&P files and generate the SARFs (defaults to 1)
+    seed: int, optional
+        Seed of the synthetic user data (defaults to 0)
+
+    Returns
+    -------
+    dict
+        The benchmark results of the number of users
+    """
+
+    from benchmarks.synthetic_template import write_sarf_template
+    from benchmarks.synthetic_workbook import write_user_workbook
+
+    sarf_template_path = os.path.join(work_dir, 'SARF_Template') + os.sep
+    user_data_path = os.path.join(work_dir, 'P&P_Files') + os.sep
+    os.makedirs(sarf_template_path)
+    os.makedirs(user_data_path)
+
+    start_time = time.perf_counter()
+    write_sarf_template(sarf_template_path + 'SARF_Template.pdf')
+    write_user_workbook(user_data_path + 'Synthetic_P&P.xlsx', num_users, seed=seed)
+    input_seconds = time.perf_counter() - start_time
+
+    stages = {}
+    def run_stage(name, stage_function):
+        start_time = time.perf_counter()
+        result = stage_function()
+        stages[name] = {'seconds': time.perf_counter() - start_time, 'peak_memory_mb': peak_rss_mb()}
+        return result
+
+    from sarf_automator import SarfAutomator
+    automator = run_stage('compile_template', lambda: SarfAutomator(sarf_template_path))
+    run_stage('load_data', lambda: automator.load_data(user_data_path, USER_DATA_SHEETNAME, USER_DATA_HEADER_ROW_NUM, max_workers))
+    new_file_prefix = os.path.join(work_dir, 'CRM_SARF_')
+    run_stage('generate_sarfs', lambda: automator.run(new_file_prefix, True, max_workers))
+    #Check that every populated field of the generated SARF matches the user data
+    sarf_differences = run_stage('verify', lambda: automator.verify_sarfs(new_file_prefix, max_workers))
+
+    #The verification is not part of the SARF generation process
+    total_seconds = sum(stage['seconds'] for name, stage in stages.items() if name != 'verify')
+    output_bytes = sum(os.path.getsize(os.path.join(work_dir, file_name)) for file_name in os.listdir(work_dir) if file_name.endswith('.pdf'))
+    return {
+        'users': num_users,
+        'max_workers': max_workers,
+        'input_generation_seconds': input_seconds,
+        'stages': stages,
+        'total_seconds': total_seconds,
+        'records_per_second': num_users / total_seconds if total_seconds else None,
+        'peak_memory_mb': peak_rss_mb(),
+        'output_bytes': output_bytes,
+        'field_differences': sum(len(differences) for differences in sarf_differences.values()),
+        #Totals of the stages recorded by the SARF automator itself (fill, write, merge, ...)
+        'automator_stages': automator.metrics.summary()['stage_totals']
+    }
+
+def run_isolated(num_users, max_workers=1, seed=0):
+    """
+    Runs benchmark_users in a new Python process (so the peak memory of each size is measured separately) in a temporary directory
+
+    Parameters
+    ----------
+    num_users: int
+        Number of users in the synthetic P&P file
+    max_workers: int, optional
+        Number of worker processes used to read the P&P files and generate the SARFs (defaults to 1)
+    seed: int, optional
+        Seed of the synthetic user data (defaults to 0)
+    """
+
+    work_dir = tempfile.mkdtemp(prefix='sarf_benchmark_')
+    try:
+        result_path = os.path.join(work_dir, 'result.json')
+        project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        subprocess.run([sys.executable, '-m', 'benchmarks.run_benchmarks', '--child', str(num_users), '--workers', str(max_workers), 
+            '--seed', str(seed), '--output', result_path], cwd=project_dir, check=True, stdout=subprocess.DEVNULL)
+        with open(result_path, 'r') as result_file:
+            return json.load(result_file)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def git_commit():
+    #Returns the commit of the code being benchmarked (None if it is not a git repository)
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, 
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_results(results, baseline=None):
+    """
+    Prints a summary of the benchmark results (and the speedup over the baseline results of the same number of users and workers)
+
+    Parameters
+    ----------
+    results: dict
+        The benchmark results
+    baseline: dict, optional
+        Previous benchmark results to compare with (defaults to None)
+    """
+
+    baseline_results = {}
+    if baseline:
+        baseline_results = {(result['users'], result['max_workers']): result for result in baseline['results']}
+
+    for result in results['results']:
+        stage_times = ', '.join(f"{name} {stage['seconds']:.2f}s" for name, stage in result['stages'].items())
+        summary = f"{result['users']:>7} users: {result['records_per_second']:10.1f} records/sec, peak {result['peak_memory_mb'] or 0:.0f} MB ({stage_times})"
+        previous = baseline_results.get((result['users'], result['max_workers']))
+        if previous and previous['records_per_second']:
+            summary += f" - {result['records_per_second'] / previous['records_per_second']:.2f}x baseline"
+        if result.get('field_differences'):
+            summary += f" - {result['field_differences']} FIELD DIFFERENCE(S)"
+        print(summary)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark SARF generation on synthetic P&P files and a synthetic SARF template')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='Number of users of each benchmark')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes used to read the P&P files and generate the SARFs')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic user data')
+    parser.add_argument('--output', default='benchmark_results.json', help='File the JSON results are saved to')
+    parser.add_argument('--compare', help='JSON results of a previous run to compare with')
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child is not None:
+        #Run a single benchmark in this process (see run_isolated)
+        result = benchmark_users(args.child, os.path.dirname(os.path.abspath(args.output)), args.workers, args.seed)
+        with open(args.output, 'w') as result_file:
+            json.dump(result, result_file)
+        return
+
+    results = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'results': []
+    }
+    for num_users in args.sizes:
+        print(f'Benchmarking {num_users} users...')
+        results['results'].append(run_isolated(num_users, args.workers, args.seed))
+
+    with open(args.output, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+    print_results(results, baseline)
+    print(f'Results saved to {args.output}')
+
+if __name__ == "__main__":
+    main()
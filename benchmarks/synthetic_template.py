@@ -0,0 +1,156 @@
+from PyPDF2 import PdfFileWriter
+from PyPDF2.pdf import PageObject
+from PyPDF2.generic import ArrayObject, DecodedStreamObject, DictionaryObject, NameObject, NumberObject, createStringObject
+from sarf_automator import SARF_USER_INFO_PAGE_NUM
+
+#SARF text fields
+TEXT_FIELDS = ['1 Name', '1 Preferred Email', '1 Job Title', '1 Office  Post', '1 Notes', '1 DOS email']
+#SARF dropdown fields and their options
+DROPDOWN_FIELDS = {
+    '1 Employment Type': ['Direct Hire', 'Contractor', 'Locally Employed Staff'],
+    '1 Timezone': ['EST', 'CST', 'PST', 'GMT+3'],
+    '1 Request Type': ['New User', 'Modify User', 'Remove User'],
+    '1 Application Access': ['CRM Only', 'CRM and Other'],
+    '1 Exec Contacts': ['Yes', 'No'],
+    '1 Printing': ['Yes', 'No']
+}
+#SARF checkbox fields (on state is /Yes)
+CHECKBOX_FIELDS = ['1 no email']
+#SARF radio button fields and the on state of each of their buttons
+RADIO_BUTTON_FIELDS = {
+    '1 Existing Okta Account': ['/0', '/1', '/2'],
+    '1 mobile device': ['/Yes', '/No'],
+    '1 mobile app': ['/0', '/No'],
+    '1 CRM User Type': ['/1#20CRM#20User', '/1#20Admin', '/1#20Contacts']
+}
+
+#Default appearance of the text and dropdown fields
+DEFAULT_APPEARANCE = '/Helv 0 Tf 0 g'
+
+def _stream(writer, data):
+    #Adds a stream object with the data to the writer and returns a reference to it
+    stream = DecodedStreamObject()
+    stream.setData(data)
+    return writer._addObject(stream)
+
+def _widget(page_ref, y, entries):
+    #Returns a widget annotation at the row of the page starting at y
+    widget = DictionaryObject({
+        NameObject('/Type'): NameObject('/Annot'),
+        NameObject('/Subtype'): NameObject('/Widget'),
+        NameObject('/Rect'): ArrayObject([NumberObject(200), NumberObject(y), NumberObject(500), NumberObject(y + 16)]),
+        NameObject('/F'): NumberObject(4),
+        NameObject('/P'): page_ref
+    })
+    widget.update(entries)
+    return widget
+
+def write_sarf_template(file_path, num_pages=4, form_page_num=SARF_USER_INFO_PAGE_NUM):
+    """
+    Writes a synthetic SARF template PDF file: a multi-page PDF with an AcroForm of the text, dropdown, checkbox and radio button
+    fields populated by SarfAutomator (same field names, types and states) on the user data page and static text on the other pages
+
+    Parameters
+    ----------
+    file_path: str
+        The file path/name of the new PDF file
+    num_pages: int, optional
+        Number of pages of the template (defaults to 4)
+    form_page_num: int, optional
+        Page number (0 based) of the user data page with the form fields (defaults to SARF_USER_INFO_PAGE_NUM)
+    """
+
+    writer = PdfFileWriter()
+    font = writer._addObject(DictionaryObject({
+        NameObject('/Type'): NameObject('/Font'),
+        NameObject('/Subtype'): NameObject('/Type1'),
+        NameObject('/BaseFont'): NameObject('/Helvetica'),
+        NameObject('/Encoding'): NameObject('/WinAnsiEncoding')
+    }))
+    resources = DictionaryObject({NameObject('/Font'): DictionaryObject({NameObject('/Helv'): font})})
+    blank_appearance = _stream(writer, b'/Tx BMC EMC')
+    on_appearance = _stream(writer, b'q 0 g BT /ZaDb 12 Tf 2 3 Td (4) Tj ET Q')
+    off_appearance = _stream(writer, b'q Q')
+    fields = ArrayObject()
+
+    for pageNum in range(0, num_pages):
+        page = PageObject.createBlankPage(writer, 612, 792)
+        lines = [f'System Access Request Form - page {pageNum + 1} of {num_pages}'] + [f'Section {pageNum + 1}.{i} instructions and terms of use' for i in range(1, 30)]
+        content = ''.join(f'BT /Helv 10 Tf 40 {760 - 24 * i} Td ({line}) Tj ET\n' for i, line in enumerate(lines))
+        page[NameObject('/Contents')] = _stream(writer, content.encode('latin-1'))
+        page[NameObject('/Resources')] = resources
+        writer.addPage(page)
+        if pageNum != form_page_num:
+            continue
+
+        page_ref = writer.getObject(writer._pages)['/Kids'][-1]
+        annotations = ArrayObject()
+        y = 700
+
+        for name in TEXT_FIELDS:
+            field = writer._addObject(_widget(page_ref, y, {
+                NameObject('/FT'): NameObject('/Tx'),
+                NameObject('/T'): createStringObject(name),
+                NameObject('/DA'): createStringObject(DEFAULT_APPEARANCE),
+                NameObject('/AP'): DictionaryObject({NameObject('/N'): blank_appearance})
+            }))
+            annotations.append(field)
+            fields.append(field)
+            y -= 22
+
+        for name, options in DROPDOWN_FIELDS.items():
+            field = writer._addObject(_widget(page_ref, y, {
+                NameObject('/FT'): NameObject('/Ch'),
+                NameObject('/Ff'): NumberObject(131072),
+                NameObject('/T'): createStringObject(name),
+                NameObject('/Opt'): ArrayObject([createStringObject(option) for option in options]),
+                NameObject('/DA'): createStringObject(DEFAULT_APPEARANCE),
+                NameObject('/AP'): DictionaryObject({NameObject('/N'): blank_appearance})
+            }))
+            annotations.append(field)
+            fields.append(field)
+            y -= 22
+
+        for name in CHECKBOX_FIELDS:
+            field = writer._addObject(_widget(page_ref, y, {
+                NameObject('/FT'): NameObject('/Btn'),
+                NameObject('/T'): createStringObject(name),
+                NameObject('/V'): NameObject('/Off'),
+                NameObject('/AS'): NameObject('/Off'),
+                NameObject('/AP'): DictionaryObject({NameObject('/N'): DictionaryObject({NameObject('/Yes'): on_appearance, NameObject('/Off'): off_appearance})})
+            }))
+            annotations.append(field)
+            fields.append(field)
+            y -= 22
+
+        for name, states in RADIO_BUTTON_FIELDS.items():
+            #Radio button fields are a parent field with a widget annotation (kid) for each button
+            parent = DictionaryObject({
+                NameObject('/FT'): NameObject('/Btn'),
+                NameObject('/Ff'): NumberObject(49152),
+                NameObject('/T'): createStringObject(name),
+                NameObject('/V'): NameObject('/Off')
+            })
+            parent_ref = writer._addObject(parent)
+            kids = ArrayObject()
+            for state in states:
+                kid = writer._addObject(_widget(page_ref, y, {
+                    NameObject('/Parent'): parent_ref,
+                    NameObject('/AS'): NameObject('/Off'),
+                    NameObject('/AP'): DictionaryObject({NameObject('/N'): DictionaryObject({NameObject(state): on_appearance, NameObject('/Off'): off_appearance})})
+                }))
+                kids.append(kid)
+                annotations.append(kid)
+                y -= 22
+            parent[NameObject('/Kids')] = kids
+            fields.append(parent_ref)
+
+        page[NameObject('/Annots')] = annotations
+
+    writer._root_object[NameObject('/AcroForm')] = writer._addObject(DictionaryObject({
+        NameObject('/Fields'): fields,
+        NameObject('/DA'): createStringObject(DEFAULT_APPEARANCE),
+        NameObject('/DR'): resources
+    }))
+    with open(file_path, 'wb') as pdf_file:
+        writer.write(pdf_file)
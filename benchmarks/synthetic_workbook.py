@@ -0,0 +1,84 @@
+import random
+import openpyxl
+from sarf_automator import FIELD_MAPPINGS
+from field_mapper import FieldMapper
+
+#Columns of the CRM Users sheet in the order of the P&P file (the columns load_data reads plus the columns only used for filtering)
+USER_DATA_COLUMNS = list(dict.fromkeys(['User Number', 'Last Name', 'First Name'] + FieldMapper(FIELD_MAPPINGS).source_columns + ['User Type']))
+
+#Values to randomly choose from for columns with a fixed set of answers (None is a blank cell)
+COLUMN_CHOICES = {
+    'Middle Name': ['', 'A', 'B', None],
+    'Employment Type': ['Direct Hire', 'Contractor', 'Locally Employed Staff'],
+    'Time Zone': ['EST', 'CST', 'PST', 'GMT+3'],
+    'Do you have an existing Okta account?  ': ['Yes', 'No', "I don't know", None],
+    "Do you have a DoS Email Address? \n(only if @state.gov wasn't already listed in column E)": ['Yes', 'No', None],
+    'Do you have access to a mobile phone in your workplace?': ['Yes', 'No', None],
+    'Do you have the ability to download the Okta Verify moble app to a work or personal phone, and use it at your workplace?': ['Yes', 'No', None],
+    'User Type': ['CRM User', 'CRM Mission/Office Admin', 'CRM Contacts Only User', None],
+    'Executive Contacts ': ['Yes', 'No', None],
+    'Event Printing': ['Yes', 'No', None]
+}
+
+def user_row(user_number, bureau, rnd):
+    """
+    Returns the values of a synthetic user in the order of USER_DATA_COLUMNS
+
+    Parameters
+    ----------
+    user_number: int
+        The User Number of the user
+    bureau: str
+        The Bureau of the user
+    rnd: Random
+        The random number generator used to choose the values
+    """
+
+    values = {
+        'User Number': user_number,
+        'Last Name': f'Last{user_number}',
+        'First Name': f'First{user_number}',
+        'Email Address\n(state.gov preferred)': rnd.choice([f'user{user_number}@state.gov', f'user{user_number}@example.com', None]),
+        'Job Title': rnd.choice(['Officer', 'Specialist', 'Assistant', 'Coordinator']),
+        'Office': f'Office {user_number % 25}',
+        'Bureau': bureau,
+        "DoS Email Address \n(only if @state.gov wasn't already listed in column E)": rnd.choice([None, f'dos{user_number}@state.gov'])
+    }
+    return [values[col] if col in values else rnd.choice(COLUMN_CHOICES.get(col, [f'{col} {user_number}'])) for col in USER_DATA_COLUMNS]
+
+def write_user_workbook(file_path, num_users, bureau='Synthetic Bureau', seed=0, sheet_name='CRM Users', header_row_num=2):
+    """
+    Writes a synthetic P&P Excel file with the layout load_data expects: an instructions sheet and a user data sheet with
+    title rows above the column headers, the Example row, one row per user and a trailing row without a name (which load_data drops)
+
+    Parameters
+    ----------
+    file_path: str
+        The file path/name of the new Excel (.xlsx) file
+    num_users: int
+        Number of users in the user data sheet
+    bureau: str, optional
+        The Bureau of every user, used in the SARF file name (defaults to 'Synthetic Bureau')
+    seed: int, optional
+        Seed of the random values, the same seed always writes the same user data (defaults to 0)
+    sheet_name: str, optional
+        Name of the user data sheet (defaults to 'CRM Users')
+    header_row_num: int, optional
+        Row number (0-based) of the column headers (defaults to 2)
+    """
+
+    rnd = random.Random(seed)
+    workbook = openpyxl.Workbook(write_only=True)
+    workbook.create_sheet('Instructions').append(['Complete one row per user on the CRM Users sheet'])
+
+    sheet = workbook.create_sheet(sheet_name)
+    for i in range(0, header_row_num):
+        sheet.append(['CRM User Provisioning' if i == 0 else None])
+    sheet.append(USER_DATA_COLUMNS)
+    example = dict(zip(USER_DATA_COLUMNS, user_row(0, 'EX', rnd)))
+    example['User Number'] = 'Example'
+    sheet.append([example[col] for col in USER_DATA_COLUMNS])
+    for user_number in range(1, num_users + 1):
+        sheet.append(user_row(user_number, bureau, rnd))
+    sheet.append([num_users + 1] + [None] * (len(USER_DATA_COLUMNS) - 1))
+    workbook.save(file_path)
@@ -0,0 +1,381 @@
+import hashlib
+import importlib
+import json
+import os
+import pickle
+import threading
+from io import BytesIO
+
+#Version of the manifest format (manifests of other versions are ignored, so every output is regenerated once).
+#2: generated appearance streams no longer draw values the form font cannot encode with replacement characters
+MANIFEST_VERSION = 2
+#File extension of the data file of each WorkbookCache format (the key of each entry is saved to a .json file)
+WORKBOOK_CACHE_EXTENSIONS = {'feather': '.feather', 'json': '.data.json'}
+#Classes (module and name) the page store of a PageIndex may contain, no other class or function can be loaded from a page store
+PAGE_STORE_CLASSES = {('pdf_filler', 'PdfPart')}
+
+def content_key(*values):
+    """
+    Returns a SHA-256 hash of the contents of one or more JSON serializable values (dictionary keys are hashed in sorted order)
+
+    Parameters
+    ----------
+    values:
+        The values to hash (e.g. user records, mapping tables, digests of input files)
+    """
+
+    digest = hashlib.sha256()
+    for value in values:
+        digest.update(json.dumps(value, sort_keys=True, default=str).encode('utf-8'))
+        #Separate each value so different splits of the same contents produce different keys
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+class BuildManifest():
+    """
+    A persistent (JSON file) record of the content key of the inputs each output file was last generated from,
+    used to skip regenerating output files whose inputs have not changed. Outputs can be recorded by several threads
+
+    Attributes
+    ----------
+    manifest_path: str
+        The file path/name of the manifest JSON file
+    outputs: dict
+        Dictionary of the output file paths and the content key of the inputs they were generated from
+    """
+
+    def __init__(self, manifest_path):
+        """
+        Parameters
+        ----------
+        manifest_path: str
+            The file path/name of the manifest JSON file (created the first time an output is recorded if it does not exist)
+        """
+
+        self.manifest_path = manifest_path
+        self.outputs = {}
+        #Guards the outputs and the manifest file, outputs are recorded by background writer threads and concurrent jobs (see SarfWatchService)
+        self._lock = threading.Lock()
+
+        if os.path.exists(manifest_path):
+            try:
+                with open(manifest_path, 'r') as manifest_file:
+                    manifest = json.load(manifest_file)
+            except (OSError, ValueError):
+                #An unreadable manifest only means everything is regenerated
+                manifest = {}
+            if isinstance(manifest, dict) and manifest.get('version') == MANIFEST_VERSION:
+                self.outputs = manifest.get('outputs', {})
+
+    def is_current(self, output_path, key):
+        """
+        Returns True if the output file exists and was last generated from inputs with the same content key
+
+        Parameters
+        ----------
+        output_path: str
+            The file path/name of the output file
+        key: str
+            The content key of the inputs of the output file (see content_key)
+        """
+
+        return self.outputs.get(output_path) == key and os.path.exists(output_path)
+
+    def record(self, output_path, key):
+        """
+        Records the content key of the inputs an output file was generated from and saves the manifest
+
+        Parameters
+        ----------
+        output_path: str
+            The file path/name of the output file
+        key: str
+            The content key of the inputs of the output file (see content_key)
+        """
+
+        with self._lock:
+            self.outputs[output_path] = key
+            self.save()
+
+    def save(self):
+        """
+        Writes the manifest to its JSON file (through a temporary file, so an interrupted run never leaves a partial manifest)
+        """
+
+        temp_manifest_path = self.manifest_path + '.tmp'
+        with open(temp_manifest_path, 'w') as manifest_file:
+            json.dump({'version': MANIFEST_VERSION, 'outputs': self.outputs}, manifest_file, indent=2, sort_keys=True)
+        os.replace(temp_manifest_path, self.manifest_path)
+
+class PageStoreUnpickler(pickle.Unpickler):
+    """
+    Unpickler of a page store that only loads the classes in PAGE_STORE_CLASSES (and plain values), so a page store
+    replaced by another pickle file cannot run code when it is loaded
+    """
+
+    def find_class(self, module, name):
+        if (module, name) not in PAGE_STORE_CLASSES:
+            raise pickle.UnpicklingError(f"{module}.{name} is not allowed in a page store")
+        return getattr(importlib.import_module(module), name)
+
+class PageIndex():
+    """
+    A sidecar index of a merged PDF file with one page per record: the unique id, fingerprint (content key) and page number of each record, 
+    and a store of the populated page of each record, so only added or changed records need to be populated again when the PDF file is updated.
+    The index is saved as a JSON file and the pages as a pickle file next to the PDF file. The pickle file is only loaded with the classes 
+    of the populated pages (see PageStoreUnpickler), which is what keeps a replaced pickle file from running code. The SHA-256 hash of 
+    the pickle file saved in the index only detects a page store that is corrupted or does not belong to the index (e.g. an interrupted save), 
+    anyone who can replace the pickle file can also replace the index
+
+    Attributes
+    ----------
+    pdf_filename: str
+        The file path/name of the merged PDF file
+    index_path: str
+        The file path/name of the index JSON file
+    pages_path: str
+        The file path/name of the page store file
+    template_key: str
+        The content key of the PDF template the pages were populated from (the index is discarded if it does not match)
+    records: list
+        List of dictionaries of the id, fingerprint and page number (0 based) of each record in page order
+    pages: dict
+        Dictionary of the record fingerprints and their populated page (e.g. a PdfPart)
+    """
+
+    def __init__(self, pdf_filename, template_key):
+        """
+        Parameters
+        ----------
+        pdf_filename: str
+            The file path/name of the merged PDF file
+        template_key: str
+            The content key of the PDF template the pages are populated from
+        """
+
+        self.pdf_filename = pdf_filename
+        self.index_path = os.path.splitext(pdf_filename)[0] + '.index.json'
+        self.pages_path = os.path.splitext(pdf_filename)[0] + '.pages'
+        self.template_key = template_key
+        self.records = []
+        self.pages = {}
+
+        if os.path.exists(self.index_path) and os.path.exists(self.pages_path):
+            try:
+                with open(self.index_path, 'r') as index_file:
+                    index = json.load(index_file)
+                if index.get('version') == MANIFEST_VERSION and index.get('template_key') == template_key:
+                    with open(self.pages_path, 'rb') as pages_file:
+                        pages_data = pages_file.read()
+                    #Only use the page store the index was saved with (a corruption check, see PageStoreUnpickler for the security check)
+                    if index.get('pages_hash') == hashlib.sha256(pages_data).hexdigest():
+                        self.pages = PageStoreUnpickler(BytesIO(pages_data)).load()
+                        self.records = index['records']
+            except (OSError, ValueError, KeyError, AttributeError, ImportError, pickle.UnpicklingError, EOFError):
+                #An unreadable index only means every page is populated again
+                self.records = []
+                self.pages = {}
+
+    def update(self, record_ids, fingerprints, pages, first_page_num=0):
+        """
+        Replaces the records and pages of the index and saves it
+
+        Parameters
+        ----------
+        record_ids: list
+            List of the unique id of each record (in page order)
+        fingerprints: list
+            List of the fingerprint of each record (in page order)
+        pages: list
+            List of the populated page of each record (in page order)
+        first_page_num: int, optional
+            Page number (0 based) of the first record page in the merged PDF file (defaults to 0)
+        """
+
+        self.records = [{'id': record_id, 'fingerprint': fingerprint, 'page': first_page_num + i} 
+            for i, (record_id, fingerprint) in enumerate(zip(record_ids, fingerprints))]
+        self.pages = dict(zip(fingerprints, pages))
+        self.save()
+
+    def save(self):
+        """
+        Writes the index and page store files (through temporary files, so an interrupted run never leaves a partial index)
+        """
+
+        pages_data = pickle.dumps(self.pages, protocol=pickle.HIGHEST_PROTOCOL)
+        with open(self.pages_path + '.tmp', 'wb') as pages_file:
+            pages_file.write(pages_data)
+        with open(self.index_path + '.tmp', 'w') as index_file:
+            json.dump({'version': MANIFEST_VERSION, 'template_key': self.template_key, 'pages_hash': hashlib.sha256(pages_data).hexdigest(), 
+                'records': self.records}, index_file, indent=2)
+        os.replace(self.pages_path + '.tmp', self.pages_path)
+        os.replace(self.index_path + '.tmp', self.index_path)
+
+class WorkbookCache():
+    """
+    A persistent on-disk cache of the normalized user data of each Excel file, so Excel files that have not changed are not parsed again.
+    Each entry is keyed by the path, size, modification time and content hash of the Excel file, the sheet name, the header row number 
+    and the columns read. An Excel file with a new modification time but the same contents (e.g. copied again) is still a cache hit.
+    The data is stored column by column: as a Feather file if pyarrow is installed, otherwise as a JSON file of the column value lists
+    (neither needs pandas to load, and neither can run code when it is loaded)
+
+    Attributes
+    ----------
+    cache_dir: str
+        The directory of the cache files (a JSON file with the key of each entry and a data file)
+    """
+
+    def __init__(self, cache_dir):
+        """
+        Parameters
+        ----------
+        cache_dir: str
+            The directory of the cache files (created the first time an entry is saved if it does not exist)
+        """
+
+        self.cache_dir = cache_dir
+
+    def _entry_path(self, file_path):
+        #Returns the file path/name (without extension) of the cache entry of an Excel file
+        return os.path.join(self.cache_dir, hashlib.sha256(os.path.abspath(file_path).encode('utf-8')).hexdigest())
+
+    @staticmethod
+    def content_hash(file_path):
+        """
+        Returns a SHA-256 hash of the contents of a file
+
+        Parameters
+        ----------
+        file_path: str
+            The file path/name
+        """
+
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as file:
+            for block in iter(lambda: file.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _read_entry(self, file_path, sheet_name, header_row_num, columns):
+        #Returns the key of the cache entry of an Excel file (None if there is no valid entry for the file, sheet, header row and columns)
+        try:
+            with open(self._entry_path(file_path) + '.json', 'r') as entry_file:
+                entry = json.load(entry_file)
+            stat = os.stat(file_path)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(entry, dict) or entry.get('version') != MANIFEST_VERSION or entry.get('path') != os.path.abspath(file_path) or \
+            entry.get('sheet_name') != sheet_name or entry.get('header_row_num') != header_row_num or entry.get('columns') != list(columns) or \
+            entry.get('format') not in WORKBOOK_CACHE_EXTENSIONS:
+            return None
+
+        if entry.get('size') != stat.st_size or entry.get('mtime_ns') != stat.st_mtime_ns:
+            #The file was modified (or copied), only reuse the entry if the contents are the same
+            if entry.get('size') != stat.st_size or entry.get('content_hash') != self.content_hash(file_path):
+                return None
+            entry['mtime_ns'] = stat.st_mtime_ns
+            self._write_json(self._entry_path(file_path) + '.json', entry)
+        return entry
+
+    def contains(self, file_path, sheet_name, header_row_num, columns):
+        """
+        Returns True if the cache has the normalized user data of an Excel file (unchanged since it was saved)
+
+        Parameters
+        ----------
+        file_path: str
+            The file path/name of the Excel file
+        sheet_name: str
+            Name of the Excel sheet the user data was read from
+        header_row_num: int
+            Row number (0-based) of the column headers the user data was read with
+        columns: list
+            List of the column names read from the Excel file
+        """
+
+        return self._read_entry(file_path, sheet_name, header_row_num, columns) is not None
+
+    def load(self, file_path, sheet_name, header_row_num, columns):
+        """
+        Returns the cached normalized user data of an Excel file as a dictionary of the column names and the list of their values 
+        (None if it is not cached or the Excel file changed, see contains)
+
+        Parameters
+        ----------
+        file_path: str
+            The file path/name of the Excel file
+        sheet_name: str
+            Name of the Excel sheet the user data was read from
+        header_row_num: int
+            Row number (0-based) of the column headers the user data was read with
+        columns: list
+            List of the column names read from the Excel file
+        """
+
+        entry = self._read_entry(file_path, sheet_name, header_row_num, columns)
+        if entry is None:
+            return None
+        data_path = self._entry_path(file_path) + WORKBOOK_CACHE_EXTENSIONS[entry['format']]
+        try:
+            if entry['format'] == 'feather':
+                from pyarrow import feather
+                data = feather.read_table(data_path).to_pydict()
+            else:
+                with open(data_path, 'r', encoding='utf-8') as data_file:
+                    data = json.load(data_file)
+        except (OSError, ValueError, KeyError, AttributeError, ImportError):
+            #An unreadable entry only means the Excel file is parsed again
+            return None
+        #The data must be the list of values of each column read
+        if not isinstance(data, dict) or not all(isinstance(values, list) for values in data.values()):
+            return None
+        return data
+
+    def save(self, file_path, sheet_name, header_row_num, columns, data, content_hash=None):
+        """
+        Saves the normalized user data of an Excel file (through temporary files, so an interrupted run never leaves a partial entry)
+
+        Parameters
+        ----------
+        file_path: str
+            The file path/name of the Excel file
+        sheet_name: str
+            Name of the Excel sheet the user data was read from
+        header_row_num: int
+            Row number (0-based) of the column headers the user data was read with
+        columns: list
+            List of the column names read from the Excel file
+        data: dict
+            Dictionary of the column names and the list of their values of the normalized user data
+        content_hash: str, optional
+            The content hash of the Excel file when it was read (defaults to None - the current contents are hashed)
+        """
+
+        try:
+            import pyarrow
+            from pyarrow import feather
+        except ImportError:
+            pyarrow = None
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entry_path = self._entry_path(file_path)
+        stat = os.stat(file_path)
+        data_format = 'feather' if pyarrow is not None else 'json'
+        data_path = entry_path + WORKBOOK_CACHE_EXTENSIONS[data_format]
+        if data_format == 'feather':
+            feather.write_feather(pyarrow.table(data), data_path + '.tmp')
+        else:
+            with open(data_path + '.tmp', 'w', encoding='utf-8') as data_file:
+                json.dump(data, data_file)
+        os.replace(data_path + '.tmp', data_path)
+
+        self._write_json(entry_path + '.json', {'version': MANIFEST_VERSION, 'path': os.path.abspath(file_path), 'size': stat.st_size, 
+            'mtime_ns': stat.st_mtime_ns, 'content_hash': content_hash or self.content_hash(file_path), 'sheet_name': sheet_name, 
+            'header_row_num': header_row_num, 'columns': list(columns), 'format': data_format})
+
+    @staticmethod
+    def _write_json(json_path, value):
+        #Writes a JSON file through a temporary file
+        with open(json_path + '.tmp', 'w') as json_file:
+            json.dump(value, json_file, indent=2)
+        os.replace(json_path + '.tmp', json_path)
@@ -0,0 +1,219 @@
+def string_columns(user_data, columns):
+    """
+    Returns the columns of the user data with blank values replaced by '' and every value converted to a string
+
+    Parameters
+    ----------
+    user_data: DataFrame
+        The user data
+    columns: list
+        List of column names to convert (duplicate names are only converted once)
+    """
+
+    import pandas as pd
+
+    converted = {}
+    for col in columns:
+        if col in converted:
+            continue
+        values = user_data[col].fillna('')
+        if pd.api.types.is_datetime64_any_dtype(values):
+            #Keep the full str() value of dates (astype(str) drops the time of midnight values)
+            converted[col] = values.map(str)
+        else:
+            converted[col] = values.astype(str)
+    return pd.DataFrame(converted, index=user_data.index)
+
+def string_values(values):
+    """
+    Returns a list of the values with blank values (None) replaced by '' and every other value converted to a string.
+    Values read with read_sheet_columns are converted to the same strings as string_columns
+
+    Parameters
+    ----------
+    values: list
+        List of the values of a column
+    """
+
+    return ['' if value is None else str(value) for value in values]
+
+class FieldMapper():
+    """
+    Maps user data columns to SARF PDF fields with column-wide (vectorized) operations
+
+    Attributes
+    ----------
+    field_mappings: dict
+        Dictionary of the SARF PDF field names and the user data column(s) they are mapped from.
+        List values are concatenated together with each value separated by ', ', dictionary values map the key column
+        by default, but if that value is blank map the value column instead
+    value_override_mappings: dict
+        Dictionary of SARF PDF field names and dictionaries of the (case-insensitive) values to replace and their PDF equivalent values.
+        Replacements are applied in order, so a replaced value can be replaced again by a later entry (e.g. '' -> 'Yes' -> '/0')
+    default_string_mappings: dict
+        Dictionary of SARF PDF field names and the static string value mapped to every record
+    id_column: str
+        Name of the user data column that contains the unique id of each record
+    value_override_tables: dict
+        Dictionary of SARF PDF field names and the final PDF value of each lowercase value (value_override_mappings with their chained replacements resolved)
+    """
+
+    def __init__(self, field_mappings, value_override_mappings=None, default_string_mappings=None, id_column='User Number'):
+        """
+        Parameters
+        ----------
+        field_mappings: dict
+            Dictionary of the SARF PDF field names and the user data column(s) they are mapped from
+        value_override_mappings: dict, optional
+            Dictionary of SARF PDF field names and dictionaries of the values to replace and their PDF equivalent values (defaults to None)
+        default_string_mappings: dict, optional
+            Dictionary of SARF PDF field names and the static string value mapped to every record (defaults to None)
+        id_column: str, optional
+            Name of the user data column that contains the unique id of each record (defaults to 'User Number')
+        """
+
+        self.field_mappings = field_mappings
+        self.value_override_mappings = value_override_mappings or {}
+        self.default_string_mappings = default_string_mappings or {}
+        self.id_column = id_column
+        self.value_override_tables = {field: self._resolve_value_overrides(overrides) for field, overrides in self.value_override_mappings.items()}
+
+    @staticmethod
+    def _resolve_value_overrides(overrides):
+        """
+        Returns the final value of each lowercase override value after applying every override in order
+
+        Parameters
+        ----------
+        overrides: dict
+            Dictionary of the values to replace and their replacement values
+        """
+
+        override_table = {}
+        for value in overrides:
+            lowercase_value = value.lower()
+            if lowercase_value in override_table:
+                continue
+            #A value is first replaced by the first override it matches, then by any later override that matches the replacement
+            cur_value = None
+            for override_value, replacement_value in overrides.items():
+                if cur_value is None:
+                    if override_value.lower() == lowercase_value:
+                        cur_value = replacement_value
+                elif cur_value.lower() == override_value.lower():
+                    cur_value = replacement_value
+            override_table[lowercase_value] = cur_value
+        return override_table
+
+    @property
+    def source_columns(self):
+        """
+        List of the user data columns referenced by the field mappings (including the id column)
+        """
+
+        columns = []
+        for mapping in self.field_mappings.values():
+            if isinstance(mapping, list):
+                columns.extend(mapping)
+            elif isinstance(mapping, dict):
+                for default_field, backup_field in mapping.items():
+                    columns.extend([default_field, backup_field])
+            else:
+                columns.append(mapping)
+        columns.append(self.id_column)
+        return list(dict.fromkeys(columns))
+
+    def map_data(self, user_data):
+        """
+        Returns a new DataFrame of the SARF PDF fields mapped from the user data
+
+        Parameters
+        ----------
+        user_data: DataFrame
+            The user data with all values of the source columns converted to strings (see string_columns)
+        """
+
+        import pandas as pd
+
+        formatted_user_data = {}
+        #Map field mappings
+        for field, mapping in self.field_mappings.items():
+            if isinstance(mapping, list):
+                #Map the value of each column separated by ', '
+                mapped_cols = [user_data[col] for col in mapping]
+                joined_values = mapped_cols[0].str.cat(mapped_cols[1:], sep=', ') if len(mapped_cols) > 1 else mapped_cols[0]
+                formatted_user_data[field] = joined_values.str.strip(' ,')
+            elif isinstance(mapping, dict):
+                #Map the key value by default, but use the value column if the default column is blank
+                default_field = list(mapping.keys())[0]
+                backup_field = mapping[default_field]
+                formatted_user_data[field] = user_data[default_field].where(user_data[default_field] != '', user_data[backup_field])
+            else:
+                formatted_user_data[field] = user_data[mapping]
+        formatted_user_data['id'] = user_data[self.id_column]
+
+        #Update input values with PDF equivalent values to appear correctly in generated PDF file (one case-insensitive map per field)
+        for field, override_table in self.value_override_tables.items():
+            overridden_values = formatted_user_data[field].str.lower().map(override_table)
+            formatted_user_data[field] = overridden_values.where(overridden_values.notna(), formatted_user_data[field])
+
+        #Map static string value to the specified field of all records in the data set
+        for field, value in self.default_string_mappings.items():
+            formatted_user_data[field] = value
+
+        return pd.DataFrame(formatted_user_data, index=user_data.index)
+
+    def map_records(self, user_data):
+        """
+        Returns a list of dictionaries of the SARF PDF fields mapped from each user data record
+
+        Parameters
+        ----------
+        user_data: DataFrame
+            The user data with all values of the source columns converted to strings (see string_columns)
+        """
+
+        formatted_user_data = self.map_data(user_data)
+        #Build the dictionaries from the column value lists (much faster than DataFrame.to_dict for large data sets)
+        fields = list(formatted_user_data.columns)
+        field_values = [formatted_user_data[field].tolist() for field in fields]
+        return [dict(zip(fields, record_values)) for record_values in zip(*field_values)]
+
+    def map_column_records(self, user_data):
+        """
+        Returns a list of dictionaries of the SARF PDF fields mapped from each user data record without pandas (the same records as map_records)
+
+        Parameters
+        ----------
+        user_data: dict
+            Dictionary of the user data column names and the list of their values, with all values of the source columns 
+            converted to strings (see string_values)
+        """
+
+        record_count = len(user_data[self.id_column])
+        formatted_user_data = {}
+        #Map field mappings
+        for field, mapping in self.field_mappings.items():
+            if isinstance(mapping, list):
+                #Map the value of each column separated by ', '
+                formatted_user_data[field] = [', '.join(values).strip(' ,') for values in zip(*[user_data[col] for col in mapping])]
+            elif isinstance(mapping, dict):
+                #Map the key value by default, but use the value column if the default column is blank
+                default_field = list(mapping.keys())[0]
+                backup_field = mapping[default_field]
+                formatted_user_data[field] = [default_value if default_value != '' else backup_value 
+                    for default_value, backup_value in zip(user_data[default_field], user_data[backup_field])]
+            else:
+                formatted_user_data[field] = list(user_data[mapping])
+        formatted_user_data['id'] = list(user_data[self.id_column])
+
+        #Update input values with PDF equivalent values to appear correctly in generated PDF file (one case-insensitive map per field)
+        for field, override_table in self.value_override_tables.items():
+            formatted_user_data[field] = [override_table.get(value.lower(), value) for value in formatted_user_data[field]]
+
+        #Map static string value to the specified field of all records in the data set
+        for field, value in self.default_string_mappings.items():
+            formatted_user_data[field] = [value] * record_count
+
+        fields = list(formatted_user_data)
+        return [dict(zip(fields, record_values)) for record_values in zip(*formatted_user_data.values())]
@@ -0,0 +1,318 @@
+import csv
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+#Columns of the CSV metrics report
+CSV_COLUMNS = ['stage', 'file', 'calls', 'seconds', 'records', 'records_per_second', 'bytes_written', 'peak_rss_mb',
+    'record_mean_ms', 'record_p95_ms', 'record_max_ms']
+
+def peak_rss_mb():
+    """
+    Returns the peak memory (resident set size) of this process in MB (None if it cannot be measured on this platform)
+    """
+
+    try:
+        import resource
+    except ImportError:
+        resource = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        #ru_maxrss is in bytes on macOS and KB everywhere else
+        return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+    try:
+        import psutil
+    except ImportError:
+        return None
+    memory_info = psutil.Process().memory_info()
+    return getattr(memory_info, 'peak_wset', memory_info.rss) / 1024 / 1024
+
+@contextmanager
+def profiled(profile_path=None):
+    """
+    Context manager that profiles the code run inside it with cProfile and dumps the stats to a file (does nothing if no file is specified).
+    The stats can be viewed with the pstats module or a viewer like snakeviz
+
+    Parameters
+    ----------
+    profile_path: str, optional
+        The file path/name of the cProfile stats file (defaults to None - not profiled)
+    """
+
+    if not profile_path:
+        yield
+        return
+
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(profile_path)
+
+class RunMetrics():
+    """
+    Records the wall time, number of calls, number of records, bytes written and peak memory of each stage of a run (per file),
+    the time taken by each record, and prints the live throughput (records/sec) and estimated time remaining
+
+    Attributes
+    ----------
+    started: datetime
+        When the run started
+    stages: dict
+        Dictionary of the (stage name, file name) of each stage and the dictionary of its metrics
+    total_records: int
+        Total number of records expected in the run, used for the estimated time remaining (None if unknown)
+    records_done: int
+        Number of records completed so far (in the whole run)
+    progress_interval: float
+        Minimum number of seconds between progress lines (None does not print progress)
+    """
+
+    def __init__(self, progress_interval=5):
+        """
+        Parameters
+        ----------
+        progress_interval: float, optional
+            Minimum number of seconds between progress lines (defaults to 5, None does not print progress)
+        """
+
+        self.progress_interval = progress_interval
+        self._open_stages = []
+        #Guards the stages dictionary, stages can be recorded by background threads (see record_stage)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Starts a new run: removes the metrics of every stage, the records completed and the progress, and restarts the run time 
+        (e.g. before each Excel file processed by a long-running service, see SarfWatchService.process_workbook)
+        """
+
+        with self._lock:
+            self.stages = {}
+        self.started = datetime.now()
+        self.total_records = None
+        self.records_done = 0
+        self._start_time = time.perf_counter()
+        self._progress_start_time = None
+        self._progress_start_records = 0
+        self._last_progress_time = None
+        #True once the completion line of the expected total records was printed
+        self._progress_finished = False
+
+    def _stage(self, name, file_name):
+        #Returns the metrics of a stage, created the first time the stage is recorded
+        key = (name, file_name)
+        with self._lock:
+            if key not in self.stages:
+                self.stages[key] = {'stage': name, 'file': file_name, 'calls': 0, 'seconds': 0.0, 'records': 0, 'bytes_written': 0,
+                    'peak_rss_mb': None, 'record_seconds': []}
+            return self.stages[key]
+
+    @contextmanager
+    def stage(self, name, file_name=None, records=0):
+        """
+        Context manager that adds the time taken by the code run inside it to a stage. The stage metrics are yielded so
+        the code can add to its 'records' and 'bytes_written' counts
+
+        Parameters
+        ----------
+        name: str
+            Name of the stage (e.g. 'read_workbook', 'fill', 'write')
+        file_name: str, optional
+            Name of the file the stage works on (e.g. the workbook or SARF file name, defaults to None)
+        records: int, optional
+            Number of records processed by the stage (defaults to 0)
+        """
+
+        stage = self._stage(name, file_name)
+        stage['records'] += records
+
+        self._open_stages.append(stage)
+        start_time = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage['seconds'] += time.perf_counter() - start_time
+            stage['calls'] += 1
+            stage['peak_rss_mb'] = peak_rss_mb()
+            self._open_stages.pop()
+
+    def record_stage(self, name, file_name=None, seconds=0.0, records=0, bytes_written=0):
+        """
+        Adds a call that was timed separately to a stage (e.g. by a background thread, which cannot use the stage context manager)
+
+        Parameters
+        ----------
+        name: str
+            Name of the stage (e.g. 'write')
+        file_name: str, optional
+            Name of the file the stage worked on (defaults to None)
+        seconds: float, optional
+            Number of seconds taken (defaults to 0.0)
+        records: int, optional
+            Number of records processed (defaults to 0)
+        bytes_written: int, optional
+            Number of bytes written (defaults to 0)
+        """
+
+        stage = self._stage(name, file_name)
+        with self._lock:
+            stage['seconds'] += seconds
+            stage['calls'] += 1
+            stage['records'] += records
+            stage['bytes_written'] += bytes_written
+            stage['peak_rss_mb'] = peak_rss_mb()
+
+    def record_done(self, seconds):
+        """
+        Records the time taken by a single record in the innermost open stage and counts it as completed
+
+        Parameters
+        ----------
+        seconds: float
+            Number of seconds taken by the record
+        """
+
+        if self._open_stages:
+            self._open_stages[-1]['record_seconds'].append(seconds)
+        self.advance(1)
+
+    def start_progress(self, total_records=None):
+        """
+        Starts measuring the throughput (and estimated time remaining) of the records completed from now on (e.g. at the start of each run)
+
+        Parameters
+        ----------
+        total_records: int, optional
+            Total number of records expected (defaults to None - unknown, the estimated time remaining is not shown)
+        """
+
+        self.total_records = total_records
+        self._progress_start_records = self.records_done
+        self._progress_start_time = time.perf_counter()
+        self._last_progress_time = self._progress_start_time
+        self._progress_finished = False
+
+    def advance(self, records):
+        """
+        Counts records as completed and prints the progress line if progress_interval seconds have passed since the last one
+        (the line of the last of the expected total records is printed once, nothing is printed after it)
+
+        Parameters
+        ----------
+        records: int
+            Number of records completed
+        """
+
+        self.records_done += records
+        if self.progress_interval is None or self._progress_start_time is None or self._progress_finished:
+            return
+        now = time.perf_counter()
+        progress_records = self.records_done - self._progress_start_records
+        self._progress_finished = bool(self.total_records) and progress_records >= self.total_records
+        if self._progress_finished or now - self._last_progress_time >= self.progress_interval:
+            self._last_progress_time = now
+            print(self.progress_line(now))
+
+    def progress_line(self, now=None):
+        """
+        Returns the progress line: records completed, throughput (records/sec) and estimated time remaining
+
+        Parameters
+        ----------
+        now: float, optional
+            The current time.perf_counter value (defaults to None - the current time)
+        """
+
+        elapsed = (now or time.perf_counter()) - (self._progress_start_time or self._start_time)
+        progress_records = self.records_done - self._progress_start_records
+        rate = progress_records / elapsed if elapsed > 0 else 0.0
+        line = f'  {progress_records}'
+        if self.total_records:
+            line += f'/{self.total_records}'
+        line += f' records, {rate:.1f} records/sec'
+        if self.total_records and rate > 0:
+            remaining = max(self.total_records - progress_records, 0) / rate
+            line += f', ETA {timedelta(seconds=round(remaining))}'
+        return line
+
+    def stage_rows(self):
+        """
+        Returns a list of dictionaries of the metrics of each stage (with summary statistics of the time taken by each record)
+        """
+
+        rows = []
+        with self._lock:
+            stages = list(self.stages.values())
+        for stage in stages:
+            row = {key: value for key, value in stage.items() if key != 'record_seconds'}
+            row['records_per_second'] = stage['records'] / stage['seconds'] if stage['records'] and stage['seconds'] else None
+            record_seconds = sorted(stage['record_seconds'])
+            if record_seconds:
+                row['record_mean_ms'] = 1000 * sum(record_seconds) / len(record_seconds)
+                row['record_p95_ms'] = 1000 * record_seconds[min(int(len(record_seconds) * 0.95), len(record_seconds) - 1)]
+                row['record_max_ms'] = 1000 * record_seconds[-1]
+            else:
+                row['record_mean_ms'] = row['record_p95_ms'] = row['record_max_ms'] = None
+            rows.append(row)
+        return rows
+
+    def summary(self):
+        """
+        Returns a dictionary of the metrics of the run: totals, the metrics of each stage and the totals of each stage name
+        """
+
+        total_seconds = time.perf_counter() - self._start_time
+        stage_rows = self.stage_rows()
+        stage_totals = {}
+        for row in stage_rows:
+            totals = stage_totals.setdefault(row['stage'], {'calls': 0, 'seconds': 0.0, 'records': 0, 'bytes_written': 0})
+            for key in totals:
+                totals[key] += row[key]
+        return {
+            'started': self.started.isoformat(timespec='seconds'),
+            'total_seconds': total_seconds,
+            'records': self.records_done,
+            'records_per_second': self.records_done / total_seconds if total_seconds > 0 else None,
+            'bytes_written': sum(row['bytes_written'] for row in stage_rows),
+            'peak_rss_mb': peak_rss_mb(),
+            'stage_totals': stage_totals,
+            'stages': stage_rows
+        }
+
+    def write_json(self, file_path):
+        """
+        Writes the metrics of the run (see summary) to a JSON file
+
+        Parameters
+        ----------
+        file_path: str
+            The file path/name of the JSON file
+        """
+
+        with open(file_path, 'w') as json_file:
+            json.dump(self.summary(), json_file, indent=2)
+
+    def write_csv(self, file_path):
+        """
+        Writes the metrics of each stage to a CSV file (one row per stage and file)
+
+        Parameters
+        ----------
+        file_path: str
+            The file path/name of the CSV file
+        """
+
+        with open(file_path, 'w', newline='') as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=CSV_COLUMNS)
+            writer.writeheader()
+            for row in self.stage_rows():
+                writer.writerow(row)
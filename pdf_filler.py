@@ -1,10 +1,647 @@
+import copy
+import os
+import struct
+import time
+import zlib
+from collections import OrderedDict
+from hashlib import md5, sha256
+from io import BytesIO
 from PyPDF2 import PdfFileReader, PdfFileWriter
-from PyPDF2.generic import BooleanObject, NameObject, IndirectObject, createStringObject
+from PyPDF2.pdf import PageObject
+from PyPDF2.utils import PdfReadError, PdfStreamError
+from PyPDF2.generic import readObject, BooleanObject, NameObject, IndirectObject, createStringObject, \
+    TextStringObject, DictionaryObject, ArrayObject, StreamObject, EncodedStreamObject, NullObject, NumberObject, FloatObject
+from background_writer import BackgroundPdfWriter, write_pdf_file
+from metrics import RunMetrics
+
+#Form field kinds of a FillPlan
+TEXT_FIELD = 'text'
+CHECKBOX_FIELD = 'checkbox'
+RADIO_BUTTON_FIELD = 'radio'
+DROPDOWN_FIELD = 'dropdown'
+
+TEXT_FIELD_TYPE = NameObject('/Tx')
+CHECKBOX_ON = NameObject('/Yes')
+CHECKBOX_OFF = NameObject('/Off')
+#Radio button states of values that are not the name of a radio button state (e.g. '/0')
+RADIO_BUTTON_STATES = {
+    'Yes': NameObject('/0'),
+    'No': NameObject('/1')
+}
+
+#Annotation flags (/F) of annotations that are not displayed
+HIDDEN_ANNOTATION_FLAGS = 2 | 32
+#Field flag (/Ff) of multiline text fields
+MULTILINE_FIELD_FLAG = 4096
+#Character widths (per 1000 units of font size) of the standard Helvetica font, used to size and align the text of 
+#generated appearance streams when the form font does not specify its own widths
+HELVETICA_WIDTHS = dict(zip(
+    ' !"#$%&\'()*+,-./0123456789:;<=>?@ABCDEFGHIJKLMNOPQRSTUVWXYZ[\\]^_`abcdefghijklmnopqrstuvwxyz{|}~',
+    [278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278, 556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 
+    278, 278, 584, 584, 584, 556, 1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778, 667, 778, 722, 667, 
+    611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556, 333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 
+    556, 556, 556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584]))
+#Python codecs of the font encodings (/Encoding) generated appearance streams can encode text in
+FONT_ENCODINGS = {'/WinAnsiEncoding': 'cp1252', '/MacRomanEncoding': 'mac_roman'}
+#Characters with the same code in the standard encoding (the built-in encoding of the standard Type 1 fonts, e.g. Helvetica
+#without an /Encoding) and in ASCII. The other codes of the standard encoding are different characters (e.g. ' is quoteright)
+STANDARD_ENCODING_CHARS = frozenset(chr(code) for code in range(0x20, 0x7f)) - {"'", '`'}
+
+def pdf_number(value):
+    """
+    Returns a number formatted for a PDF content stream (at most 4 decimals, without trailing zeros)
+
+    Parameters
+    ----------
+    value: float
+        The number
+    """
+
+    number = ('%.4f' % value).rstrip('0').rstrip('.')
+    return '0' if number in ('', '-0') else number
+
+def content_stream(data):
+    """
+    Returns a new content stream object
+
+    Parameters
+    ----------
+    data: bytes
+        The content of the stream
+    """
+
+    stream = StreamObject()
+    stream._data = data
+    return stream
+
+#Content stream that saves the graphics state before the original content of a flattened page (see TemplatePage.flatten)
+SAVE_STATE_STREAM = content_stream(b"q\n")
+
+def checkbox_state(value):
+    """
+    Returns the checkbox state (/Yes or /Off) of a field value
+
+    Parameters
+    ----------
+    value: str
+        The field value ('Yes' checks the checkbox, any other value unchecks it)
+    """
+
+    return CHECKBOX_ON if value == 'Yes' else CHECKBOX_OFF
+
+def radio_button_state(value):
+    """
+    Returns the radio button state of a field value
+
+    Parameters
+    ----------
+    value: str
+        The field value ('Yes' and 'No' select the /0 and /1 states, any other value is used as the name of the state, e.g. '/Yes')
+    """
+
+    if value in RADIO_BUTTON_STATES:
+        return RADIO_BUTTON_STATES[value]
+    return NameObject(value)
+
+class PdfPart():
+    """
+    The objects of a PdfFileWriter2 serialized with their references to each other left relocatable, so the pages 
+    can be sent to another process and added to another PdfFileWriter2 without being parsed again 
+    (see PdfFileWriter2.export_part and PdfFileWriter2.add_part)
+
+    Attributes
+    ----------
+    objects: list
+        List of the serialized objects (None for objects not part of the pages), each a list of bytes and 
+        the (int) object numbers of the objects it references
+    pages: list
+        List of the object numbers of the pages (in page order)
+    pages_idnum: int
+        Object number of the page tree the pages belong to (references to it are relocated to the page tree the pages are added to)
+    template_objects: dict
+        Dictionary of the object numbers of objects copied from the PDF template and the (idnum, generation) of the template object
+    fields: list
+        List of the object numbers of the top level form fields of the pages
+    missing_appearances: bool
+        A populated field of the pages has no appearance stream, so PDF viewers need to build it (see PdfFileWriter2.missing_appearances)
+    """
+
+    def __init__(self, objects, pages, pages_idnum, template_objects, fields, missing_appearances=False):
+        self.objects = objects
+        self.pages = pages
+        self.pages_idnum = pages_idnum
+        self.template_objects = template_objects
+        self.fields = fields
+        self.missing_appearances = missing_appearances
+
+class RelocatedObject():
+    """
+    An object of a PdfPart added to a PdfFileWriter2, written with its references renumbered to the objects of the writer
+
+    Attributes
+    ----------
+    segments: list
+        The serialized object, a list of bytes and the (int) object numbers of the part objects it references
+    object_refs: dict
+        Dictionary of the object numbers of the part and the IndirectObject of the object in the writer
+    """
+
+    def __init__(self, segments, object_refs):
+        self.segments = segments
+        self.object_refs = object_refs
+
+    @property
+    def is_stream(self):
+        #Serialized stream objects end with their stream data, every other object ends with a delimiter (e.g. >> or ])
+        return self.segments[-1].endswith(b"endstream")
+
+    def writeToStream(self, stream, encryption_key):
+        for segment in self.segments:
+            if isinstance(segment, int):
+                stream.write(b"%d 0 R" % self.object_refs[segment].idnum)
+            else:
+                stream.write(segment)
+
+class _RelocatableStream():
+    #Collects the serialized bytes of an object, keeping the object numbers of its references separate
+    def __init__(self):
+        self.segments = []
+        self._buffer = []
+
+    def write(self, data):
+        self._buffer.append(data)
+
+    def reference(self, idnum):
+        self._flush()
+        self.segments.append(idnum)
+
+    def getvalue(self):
+        self._flush()
+        return self.segments
+
+    def _flush(self):
+        if self._buffer:
+            self.segments.append(b"".join(self._buffer))
+            self._buffer = []
+
+class PdfFileReader2(PdfFileReader):
+    #Inherits/extends the PyPDF2 built-in PdfFileReader class (https://pythonhosted.org/PyPDF2/PdfFileReader.html)
+    def __init__(self, stream, strict=True, warndest=None, overwriteWarnings=True):
+        #Map of the object number of each object stream read to its decompressed data and the offset of each object in it
+        self._object_streams = {}
+        #Contents of the PDF file (read the first time the raw data of an uncompressed object is needed, see object_data)
+        self._file_data = None
+        super().__init__(stream, strict, warndest, overwriteWarnings)
+
+    def _getObjectFromStream(self, indirectReference):
+        """
+        Reads an object from a compressed object stream (replaces the PyPDF2 implementation, which parses the table of the object numbers 
+        and offsets of the object stream again for every object, so reading every object of a large compressed PDF file is quadratic)
+
+        Parameters
+        ----------
+        indirectReference: IndirectObject
+            The reference of the object
+        """
+
+        stream_data, offsets = self._object_stream(self.xref_objStm[indirectReference.idnum][0])
+        if indirectReference.idnum not in offsets:
+            return super()._getObjectFromStream(indirectReference)
+        stream_data.seek(offsets[indirectReference.idnum], 0)
+        try:
+            return readObject(stream_data, self)
+        except PdfStreamError:
+            #Let PyPDF2 report the invalid object (or replace it with null)
+            return super()._getObjectFromStream(indirectReference)
+
+    def _object_stream(self, stmnum):
+        #Returns the decompressed data of an object stream and the offset of each object in it (read once per object stream)
+        if stmnum not in self._object_streams:
+            object_stream = IndirectObject(stmnum, 0, self).getObject()
+            stream_data = BytesIO(object_stream.getData())
+            first_offset = object_stream['/First']
+            numbers = stream_data.getvalue()[:first_offset].split()
+            self._object_streams[stmnum] = (stream_data,
+                {int(numbers[i]): first_offset + int(numbers[i + 1]) for i in range(0, 2 * object_stream['/N'], 2)})
+        return self._object_streams[stmnum]
+
+    def object_data(self, idnum, generation=0):
+        """
+        Returns the raw (unparsed) data an object is read from and the offset of the object in it: the decompressed data of its object stream,
+        or the contents of the PDF file after the object header (None if the object is not in the cross-reference table or the file is encrypted)
+
+        Parameters
+        ----------
+        idnum: int
+            The object number of the object
+        generation: int, optional
+            The generation number of the object (defaults to 0)
+        """
+
+        if self.isEncrypted:
+            return None
+        if generation == 0 and idnum in self.xref_objStm:
+            stream_data, offsets = self._object_stream(self.xref_objStm[idnum][0])
+            return (stream_data.getvalue(), offsets[idnum]) if idnum in offsets else None
+        if idnum not in self.xref.get(generation, {}):
+            return None
+        if self._file_data is None:
+            self.stream.seek(0, 0)
+            self._file_data = self.stream.read()
+        self.stream.seek(self.xref[generation][idnum], 0)
+        header_idnum, header_generation = self.readObjectHeader(self.stream)
+        if (header_idnum, header_generation) != (idnum, generation):
+            return None
+        return self._file_data, self.stream.tell()
+
+#Maximum number of objects packed into a single compressed object stream
+OBJECT_STREAM_SIZE = 200
 
 class PdfFileWriter2(PdfFileWriter):
     #Inherits/extends the PyPDF2 built-in PdfFileWriter class (https://pythonhosted.org/PyPDF2/PdfFileWriter.html)
-    def __init__(self):
+    def __init__(self, compress=False):
         super().__init__()
+        #Map of (pdf, generation, idnum) of objects of other PDF files to the IndirectObject of their copy in this writer
+        self._external_refs = {}
+        #Write a compressed PDF 1.5 file: objects packed into compressed object streams with a cross-reference stream (see _write_compressed)
+        self.compress = compress
+        #Map of id() of objects shared by several pages (see add_shared_object) to the object and the IndirectObject of its copy in this writer
+        self._shared_refs = {}
+        #A populated field of the pages was left without an appearance stream, so PDF viewers need to build it (see FillPlan.fill)
+        self.missing_appearances = False
+
+    def write(self, stream):
+        """
+        Writes the collection of pages added to this object out as a PDF file
+        (replaces the PyPDF2 implementation to prepare the objects with prepare_objects and to write RelocatedObjects)
+
+        Parameters
+        ----------
+        stream: file
+            An object to write the file to (must support the write and tell methods, similar to a file object)
+        """
+
+        self.prepare_objects()
+        if self.compress and not hasattr(self, "_encrypt"):
+            self._write_compressed(stream)
+            return
+
+        object_positions = []
+        stream.write(self._header + b"\n")
+        for i in range(0, len(self._objects)):
+            idnum = i + 1
+            object_positions.append(stream.tell())
+            stream.write(b"%d 0 obj\n" % idnum)
+            self._objects[i].writeToStream(stream, self._encryption_key(idnum))
+            stream.write(b"\nendobj\n")
+
+        #Cross-reference table
+        xref_location = stream.tell()
+        stream.write(b"xref\n")
+        stream.write(b"0 %d\n" % (len(self._objects) + 1))
+        stream.write(b"%010d %05d f \n" % (0, 65535))
+        stream.write(b"".join(b"%010d %05d n \n" % (offset, 0) for offset in object_positions))
+
+        #Trailer
+        stream.write(b"trailer\n")
+        trailer = DictionaryObject()
+        trailer.update({
+            NameObject("/Size"): NumberObject(len(self._objects) + 1),
+            NameObject("/Root"): self._root,
+            NameObject("/Info"): self._info
+        })
+        if hasattr(self, "_ID"):
+            trailer[NameObject("/ID")] = self._ID
+        if hasattr(self, "_encrypt"):
+            trailer[NameObject("/Encrypt")] = self._encrypt
+        trailer.writeToStream(stream, None)
+        stream.write(b"\nstartxref\n%d\n%%%%EOF\n" % xref_location)
+
+    def _write_compressed(self, stream):
+        """
+        Writes the PDF file with every object that is not a stream packed into compressed object streams and a compressed 
+        cross-reference stream instead of the cross-reference table (PDF 1.5). Streams without a filter are compressed as well
+
+        Parameters
+        ----------
+        stream: file
+            An object to write the file to (must support the write and tell methods, similar to a file object)
+        """
+
+        #Cross-reference entry of each object: (1, offset, 0) for objects in the file and (2, object stream number, index) for objects in an object stream
+        xref_entries = [(0, 0, 65535)] + [None] * len(self._objects)
+        packed_objects = []
+
+        def write_object(idnum, header, data=None):
+            xref_entries[idnum] = (1, stream.tell(), 0)
+            stream.write(b"%d 0 obj\n" % idnum)
+            stream.write(header)
+            if data is not None:
+                stream.write(b"\nstream\n")
+                stream.write(data)
+                stream.write(b"\nendstream")
+            stream.write(b"\nendobj\n")
+
+        def write_object_stream():
+            object_stream_idnum = len(xref_entries)
+            xref_entries.append(None)
+            offsets = []
+            body = BytesIO()
+            for index, (idnum, data) in enumerate(packed_objects):
+                xref_entries[idnum] = (2, object_stream_idnum, index)
+                offsets.append(b"%d %d" % (idnum, body.tell()))
+                body.write(data)
+                body.write(b"\n")
+            offset_table = b" ".join(offsets) + b"\n"
+            data = zlib.compress(offset_table + body.getvalue())
+            write_object(object_stream_idnum, b"<< /Type /ObjStm /N %d /First %d /Filter /FlateDecode /Length %d >>" % (len(packed_objects), len(offset_table), len(data)), data)
+            del packed_objects[:]
+
+        stream.write(b"%PDF-1.5\n%\xe2\xe3\xcf\xd3\n")
+        for i in range(0, len(self._objects)):
+            idnum = i + 1
+            obj = self._objects[i]
+            if isinstance(obj, StreamObject):
+                if "/Filter" not in obj:
+                    #Compress a copy, so the object itself is unchanged
+                    encoded = EncodedStreamObject()
+                    encoded.update(obj)
+                    encoded[NameObject("/Filter")] = NameObject("/FlateDecode")
+                    encoded._data = zlib.compress(obj._data)
+                    obj = encoded
+                object_data = BytesIO()
+                obj.writeToStream(object_data, None)
+                write_object(idnum, object_data.getvalue())
+            elif isinstance(obj, RelocatedObject) and obj.is_stream:
+                object_data = BytesIO()
+                obj.writeToStream(object_data, None)
+                write_object(idnum, object_data.getvalue())
+            else:
+                object_data = BytesIO()
+                obj.writeToStream(object_data, None)
+                packed_objects.append((idnum, object_data.getvalue()))
+                if len(packed_objects) >= OBJECT_STREAM_SIZE:
+                    write_object_stream()
+        if packed_objects:
+            write_object_stream()
+
+        #Cross-reference stream (its own entry is the last one)
+        xref_idnum = len(xref_entries)
+        xref_entries.append((1, stream.tell(), 0))
+        field_width = max(1, (max(max(entry[1], entry[2]) for entry in xref_entries).bit_length() + 7) // 8)
+        xref_data = zlib.compress(b"".join(entry[0].to_bytes(1, 'big') + entry[1].to_bytes(field_width, 'big') + entry[2].to_bytes(field_width, 'big') 
+            for entry in xref_entries))
+        trailer = DictionaryObject()
+        trailer.update({
+            NameObject("/Type"): NameObject("/XRef"),
+            NameObject("/Size"): NumberObject(len(xref_entries)),
+            NameObject("/W"): ArrayObject([NumberObject(1), NumberObject(field_width), NumberObject(field_width)]),
+            NameObject("/Root"): self._root,
+            NameObject("/Info"): self._info,
+            NameObject("/Filter"): NameObject("/FlateDecode"),
+            NameObject("/Length"): NumberObject(len(xref_data))
+        })
+        if hasattr(self, "_ID"):
+            trailer[NameObject("/ID")] = self._ID
+        trailer_data = BytesIO()
+        trailer.writeToStream(trailer_data, None)
+        write_object(xref_idnum, trailer_data.getvalue(), xref_data)
+        stream.write(b"startxref\n%d\n%%%%EOF\n" % xref_entries[xref_idnum][1])
+
+    def _encryption_key(self, idnum):
+        #Returns the encryption key of an object (None if the PDF is not encrypted, see PdfFileWriter.encrypt)
+        if not hasattr(self, "_encrypt") or idnum == self._encrypt.idnum:
+            return None
+        key = self._encrypt_key + struct.pack("<i", idnum)[:3] + struct.pack("<i", 0)[:2]
+        return md5(key).digest()[:min(16, len(self._encrypt_key) + 5)]
+
+    def add_shared_object(self, obj):
+        """
+        Adds a copy of an object shared by several pages (e.g. a cached appearance stream) to this PDF the first time it is added
+        and returns the reference to the copy
+
+        Parameters
+        ----------
+        obj: PdfObject
+            The shared object (must not be modified after it is first added)
+        """
+
+        if id(obj) not in self._shared_refs:
+            #Copy the object, so sweeping its references in this writer never changes the shared object
+            self._shared_refs[id(obj)] = (obj, self._addObject(copy.copy(obj)))
+        return self._shared_refs[id(obj)][1]
+
+    def prepare_objects(self):
+        """
+        Adds the document catalog and copies every object referenced from another PDF file into this writer, 
+        so every object only references other objects of this writer
+        """
+
+        if not self._root:
+            self._root = self._addObject(self._root_object)
+
+        #PDF objects sometimes have circular references to their /Page objects (for example, annotations). Map the original page 
+        #of each added page to the added page, so these references point to the added page instead of a new copy of the original page
+        for i in range(0, len(self._objects)):
+            obj = self._objects[i]
+            if isinstance(obj, PageObject) and obj.indirectRef is not None:
+                page_ref = obj.indirectRef
+                self._external_refs.setdefault(page_ref.pdf, {}).setdefault(page_ref.generation, {})[page_ref.idnum] = IndirectObject(i + 1, 0, self)
+
+        #Track the writer objects already swept (a set instead of PyPDF2's list for constant time lookups)
+        self._swept_idnums = set()
+        self._sweepIndirectReferences(self._external_refs, self._root)
+        del self._swept_idnums
+
+    def _sweepIndirectReferences(self, externMap, data):
+        """
+        Replaces the PyPDF2 implementation so objects from other PDF files are copied into this writer instead of
+        being rewritten in place. This keeps a shared CompiledPdfTemplate reader unchanged after any number of writes
+
+        Parameters
+        ----------
+        externMap: dict
+            Map of (pdf, generation, idnum) of external objects to the IndirectObject already created in this writer
+        data: PdfObject
+            The object to sweep
+
+        Returns
+        -------
+        PdfObject
+            The swept object (direct dictionaries and arrays are returned as swept copies)
+        """
+
+        if isinstance(data, IndirectObject):
+            if data.pdf == self:
+                #Internal indirect references are fine, but their contents still need to be swept once
+                if data.idnum not in self._swept_idnums:
+                    self._swept_idnums.add(data.idnum)
+                    self._sweep_object_values(externMap, self.getObject(data))
+                return data
+
+            new_object_ref = externMap.get(data.pdf, {}).get(data.generation, {}).get(data.idnum, None)
+            if new_object_ref is None:
+                try:
+                    external_object = data.pdf.getObject(data)
+                except ValueError:
+                    #Unable to resolve the object, returning NullObject instead
+                    return NullObject()
+                new_object_ref = self._addObject(copy.copy(external_object))
+                externMap.setdefault(data.pdf, {}).setdefault(data.generation, {})[data.idnum] = new_object_ref
+                self._swept_idnums.add(new_object_ref.idnum)
+                self._sweep_object_values(externMap, self.getObject(new_object_ref))
+            return new_object_ref
+        elif isinstance(data, (DictionaryObject, ArrayObject)):
+            #Direct objects may be shared with another PDF file, so sweep a copy
+            data = copy.copy(data)
+            self._sweep_object_values(externMap, data)
+        return data
+
+    def _sweep_object_values(self, externMap, data):
+        """
+        Sweeps the values of a dictionary or array object owned by this writer in place
+
+        Parameters
+        ----------
+        externMap: dict
+            Map of (pdf, generation, idnum) of external objects to the IndirectObject already created in this writer
+        data: PdfObject
+            The object owned by this writer
+        """
+
+        if isinstance(data, DictionaryObject):
+            items = list(data.items())
+        elif isinstance(data, ArrayObject):
+            items = list(enumerate(data))
+        else:
+            return
+
+        for key, value in items:
+            value = self._sweepIndirectReferences(externMap, value)
+            if isinstance(value, StreamObject):
+                #Streams must be indirect objects
+                value = self._addObject(value)
+            data[key] = value
+
+    def export_part(self, fields=None, template_reader=None):
+        """
+        Returns the pages of this writer and every object they reference as a PdfPart that can be added to 
+        another PdfFileWriter2 (see add_part)
+
+        Parameters
+        ----------
+        fields: list, optional
+            List of references to the top level form fields of the pages (defaults to None)
+        template_reader: PdfFileReader, optional
+            PdfFileReader of the PDF template, objects copied from it are only added once to the writer the part is added to (defaults to None)
+
+        Returns
+        -------
+        PdfPart
+            The pages of this writer
+        """
+
+        self.prepare_objects()
+
+        template_objects = {}
+        for generation, idnums in self._external_refs.get(template_reader, {}).items():
+            for idnum, object_ref in idnums.items():
+                if not isinstance(self.getObject(object_ref), PageObject):
+                    template_objects[object_ref.idnum] = (idnum, generation)
+
+        #Serialize every object except the document catalog, info and page tree (these are replaced by the ones of the other writer)
+        excluded_idnums = {self._root.idnum, self._info.idnum, self._pages.idnum}
+        objects = []
+        for i in range(0, len(self._objects)):
+            if i + 1 in excluded_idnums:
+                objects.append(None)
+                continue
+            stream = _RelocatableStream()
+            self._write_relocatable(self._objects[i], stream)
+            objects.append(stream.getvalue())
+
+        pages = [page_ref.idnum for page_ref in self.getObject(self._pages)['/Kids']]
+        return PdfPart(objects, pages, self._pages.idnum, template_objects, [field.idnum for field in fields or []], self.missing_appearances)
+
+    def _write_relocatable(self, obj, stream):
+        #Writes an object like PdfObject.writeToStream, but writes references through stream.reference
+        if isinstance(obj, IndirectObject):
+            stream.reference(obj.idnum)
+        elif isinstance(obj, DictionaryObject):
+            items = list(obj.items())
+            if isinstance(obj, StreamObject):
+                length = NumberObject(len(obj._data))
+                items = [(key, length if key == '/Length' else value) for key, value in items]
+                if '/Length' not in obj:
+                    items.append((NameObject('/Length'), length))
+            stream.write(b"<<\n")
+            for key, value in items:
+                key.writeToStream(stream, None)
+                stream.write(b" ")
+                self._write_relocatable(value, stream)
+                stream.write(b"\n")
+            stream.write(b">>")
+            if isinstance(obj, StreamObject):
+                stream.write(b"\nstream\n")
+                stream.write(obj._data)
+                stream.write(b"\nendstream")
+        elif isinstance(obj, ArrayObject):
+            stream.write(b"[")
+            for value in obj:
+                stream.write(b" ")
+                self._write_relocatable(value, stream)
+            stream.write(b" ]")
+        else:
+            obj.writeToStream(stream, None)
+
+    def add_part(self, part, template_reader=None):
+        """
+        Adds the pages of a PdfPart to the end of this PDF
+
+        Parameters
+        ----------
+        part: PdfPart
+            The pages to add
+        template_reader: PdfFileReader, optional
+            PdfFileReader of the PDF template the part was created from, template objects already added to this writer 
+            are reused instead of being added again (defaults to None)
+
+        Returns
+        -------
+        list
+            List of references to the top level form fields of the added pages
+        """
+
+        template_refs = self._external_refs.setdefault(template_reader, {}) if template_reader is not None else {}
+
+        #Assign an object in this writer to each object of the part
+        object_refs = {part.pages_idnum: self._pages}
+        new_objects = []
+        for i in range(0, len(part.objects)):
+            idnum = i + 1
+            if part.objects[i] is None:
+                continue
+            template_key = part.template_objects.get(idnum)
+            if template_key is not None:
+                template_idnum, generation = template_key
+                if template_idnum in template_refs.get(generation, {}):
+                    object_refs[idnum] = template_refs[generation][template_idnum]
+                    continue
+            object_refs[idnum] = self._addObject(None)
+            new_objects.append((object_refs[idnum], part.objects[i]))
+            if template_key is not None:
+                template_refs.setdefault(generation, {})[template_idnum] = object_refs[idnum]
+
+        for object_ref, segments in new_objects:
+            self._objects[object_ref.idnum - 1] = RelocatedObject(segments, object_refs)
+
+        pages = self.getObject(self._pages)
+        for page_idnum in part.pages:
+            pages['/Kids'].append(object_refs[page_idnum])
+        pages[NameObject('/Count')] = NumberObject(pages['/Count'] + len(part.pages))
+        self.missing_appearances = self.missing_appearances or part.missing_appearances
+
+        return [object_refs[idnum] for idnum in part.fields]
     
     def update_checkbox_radio_field_values(self, page, fields):
         """
@@ -25,64 +662,22 @@ class PdfFileWriter2(PdfFileWriter):
             if '/Parent' in annotation:
                 #If the field is a radio button, then get the parent annotation
                 annotation = annotation['/Parent']
-            
-            #Update each specified field in the PDF page
-            for fieldname in fields:
-                #Check if the field name of the current annotation is equal to our field name
-                if annotation.get('/T') == fieldname:
-                    #Update the form value and the appearance stream values
-                    if '/Kids' in annotation: #if radio button
-                        if fields[fieldname] == 'Yes':
-                            annotation.update({
-                                NameObject('/V'):NameObject('/0'),
-                                NameObject('/AS'):NameObject('/0')
-                            })
-                        elif fields[fieldname] == 'No':
-                            annotation.update({
-                                NameObject('/V'):NameObject('/1'), 
-                                NameObject('/AS'):NameObject('/1')
-                            })
-                        elif fields[fieldname] == '/0':
-                            annotation.update({
-                                NameObject('/V'):NameObject('/0'),
-                                NameObject('/AS'):NameObject('/0')
-                            })
-
-                        elif fields[fieldname] == '/1':
-                            annotation.update({
-                                NameObject('/V'):NameObject('/1'),
-                                NameObject('/AS'):NameObject('/1')
-                            })
-                            
-                        elif fields[fieldname] == '/Yes':
-                            annotation.update({
-                                NameObject('/V'):NameObject('/Yes'),
-                                NameObject('/AS'):NameObject('/Yes')
-                            })
-                            
-                        elif fields[fieldname] == '/No':
-                            annotation.update({
-                                NameObject('/V'):NameObject('/No'),
-                                NameObject('/AS'):NameObject('/No')
-                            })
-                        else:
-                            annotation.update({
-                                NameObject('/V'):NameObject(fields[fieldname]),
-                                NameObject('/AS'):NameObject(fields[fieldname])
-                        })
-                    else:
-                        if fields[fieldname] == 'Yes':
-                            #Check the checkbox field
-                            annotation.update({
-                                NameObject('/V'):NameObject('/Yes'), #value
-                                NameObject('/AS'):NameObject('/Yes') #appearance stream
-                            })
-                        else:
-                            #Uncheck the checkbox field
-                            annotation.update({
-                                NameObject('/V'):NameObject('/Off'),
-                                NameObject('/AS'):NameObject('/Off')
-                            })
+
+            #Check if the field name of the current annotation is one of our field names
+            fieldname = annotation.get('/T')
+            if fieldname not in fields:
+                continue
+
+            #Update the form value and the appearance stream values
+            if '/Kids' in annotation: #if radio button
+                state = radio_button_state(fields[fieldname])
+            else:
+                #Check or uncheck the checkbox field
+                state = checkbox_state(fields[fieldname])
+            annotation.update({
+                NameObject('/V'): state, #value
+                NameObject('/AS'): state #appearance stream
+            })
 
     def convert_dropdown_to_text(self, page, fields):
         """
@@ -100,19 +695,45 @@ class PdfFileWriter2(PdfFileWriter):
         for i in range(0, len(page['/Annots'])):
             #Get the current annotation
             annotation = page['/Annots'][i].getObject()
-            for fieldname in fields:
-                #Check if the field name of the current annotation is equal to our field name
-                if annotation.get('/T') == fieldname:
-                    #Change the field type of the current form field from a choice field to a text field
-                    annotation.update({
-                        NameObject('/FT'): NameObject('/Tx')
-                    })
+            #Check if the field name of the current annotation is one of our field names
+            if annotation.get('/T') in fields:
+                #Change the field type of the current form field from a choice field to a text field
+                annotation.update({
+                    NameObject('/FT'): TEXT_FIELD_TYPE
+                })
 
 
-    def set_need_appearances(self):
+    def add_acroform_fields(self, template_acroform, fields):
+        """
+        Adds form fields to the interactive form of the new PDF. The interactive form is created from a copy of the 
+        template's AcroForm (without the template's own fields) if it does not exist yet
+
+        Parameters
+        ----------
+        template_acroform: DictionaryObject
+            The AcroForm of the PDF template (can be None if the template has no interactive form)
+        fields: list
+            List of references to the form fields to add
+        """
+
+        if '/AcroForm' not in self._root_object:
+            acroform = DictionaryObject()
+            if template_acroform is not None:
+                acroform.update(template_acroform)
+            acroform[NameObject('/Fields')] = ArrayObject()
+            self._root_object[NameObject('/AcroForm')] = self._addObject(acroform)
+        self._root_object['/AcroForm']['/Fields'].extend(fields)
+
+    def set_need_appearances(self, need_appearances=True):
         """
         Set NeedAppearances flag on interactive form in order to see 
         field values appear in form fields
+
+        Parameters
+        ----------
+        need_appearances: bool, optional
+            The value of the flag (defaults to True - PDF viewers build the appearance of every field, False when the fields have 
+            their own appearance streams)
         """
 
         catalog = self._root_object
@@ -122,8 +743,793 @@ class PdfFileWriter2(PdfFileWriter):
                 NameObject('/AcroForm'):IndirectObject(len(self._objects), 0, self)
             })
         
-        need_appearances = NameObject('/NeedAppearances')
-        self._root_object['/AcroForm'][need_appearances] = BooleanObject(True)
+        self._root_object['/AcroForm'][NameObject('/NeedAppearances')] = BooleanObject(need_appearances)
+
+class CompiledPdfTemplate():
+    """
+    A PDF template that is parsed a single time and hands out isolated copies of its pages
+    
+    Attributes
+    ----------
+    pdf_template_file_path: str
+        The file path/name of the PDF template
+    digest: str
+        SHA-256 hash of the contents of the PDF template file
+    reader: PdfFileReader
+        A PdfFileReader object of the PDF template with every object resolved and the NeedAppearances flag set
+    acroform: DictionaryObject
+        The AcroForm of the PDF template (None if the template does not have an interactive form)
+    pages: list
+        List of the PageObjects of the PDF template
+    """
+
+    def __init__(self, pdf_template_file_path):
+        """
+        Parameters
+        ----------
+        pdf_template_file_path: str
+            The file path/name of the PDF template
+        """
+
+        self.pdf_template_file_path = pdf_template_file_path
+
+        #Read the template into memory so the reader never goes back to the file
+        with open(pdf_template_file_path, 'rb') as pdf_file:
+            pdf_bytes = pdf_file.read()
+        self.digest = sha256(pdf_bytes).hexdigest()
+        self.reader = PdfFileReader(BytesIO(pdf_bytes))
+
+        self.acroform = None
+        if "/AcroForm" in self.reader.trailer["/Root"]:
+            self.acroform = self.reader.trailer["/Root"]["/AcroForm"]
+            self.acroform.update(
+            {NameObject("/NeedAppearances"): BooleanObject(True)})
+
+        self.pages = [self.reader.getPage(i) for i in range(0, self.reader.getNumPages())]
+        self._fill_plans = {}
+
+        #Resolve every object up front so copies handed out later never need to parse the template again
+        object_refs = [(idnum, generation) for generation in self.reader.xref for idnum in self.reader.xref[generation] if idnum > 0]
+        object_refs += [(idnum, 0) for idnum in self.reader.xref_objStm]
+        for idnum, generation in object_refs:
+            try:
+                self.reader.getObject(IndirectObject(idnum, generation, self.reader))
+            except PdfReadError:
+                #Skip free or damaged xref entries (only referenced objects are needed)
+                pass
+        self._share_page_resources(max([idnum for idnum, generation in object_refs] + [int(self.reader.trailer.get("/Size", 0))]))
+
+    def _share_page_resources(self, last_idnum):
+        """
+        Moves the resources of each page that has them inline (or inherits them from the pages tree) into an object of the template, 
+        so they are written a single time to a PDF file instead of once per copy of the page
+
+        Parameters
+        ----------
+        last_idnum: int
+            The highest object number used by the PDF template (the shared objects are numbered after it)
+        """
+
+        shared_resources = {}
+        for page in self.pages:
+            resources = page.get(NameObject("/Resources"))
+            if not isinstance(resources, DictionaryObject) or isinstance(page.raw_get("/Resources"), IndirectObject):
+                continue
+            if id(resources) not in shared_resources:
+                last_idnum += 1
+                #Add the object to the reader's cache of resolved objects, so it is copied like any other object of the template
+                shared_resources[id(resources)] = IndirectObject(last_idnum, 0, self.reader)
+                self.reader.cacheIndirectObject(0, last_idnum, resources)
+            page[NameObject("/Resources")] = shared_resources[id(resources)]
+
+    def getNumPages(self):
+        """
+        Returns the number of pages in the PDF template
+        """
+
+        return len(self.pages)
+
+    def fill_plan(self, pageNum):
+        """
+        Returns the FillPlan of a template page (compiled the first time it is requested)
+
+        Parameters
+        ----------
+        pageNum: int
+            Page number of the PDF template
+        """
+
+        if pageNum not in self._fill_plans:
+            self._fill_plans[pageNum] = FillPlan(self.pages[pageNum], pageNum, self.acroform)
+        return self._fill_plans[pageNum]
+
+    def clone_page(self, writer, pageNum):
+        """
+        Adds an isolated copy of a template page to a PdfFileWriter
+
+        Parameters
+        ----------
+        writer: PdfFileWriter2
+            The PdfFileWriter the copied page is added to
+        pageNum: int
+            Page number of the PDF template to copy
+
+        Returns
+        -------
+        TemplatePage
+            The copied page
+        """
+
+        return TemplatePage(writer, self.pages[pageNum])
+
+class TemplatePage():
+    """
+    An isolated copy of a CompiledPdfTemplate page added to a PdfFileWriter. The page dictionary and its annotation list are
+    copied right away, but each annotation is only copied the first time it is written to (copy-on-write) so that unchanged
+    annotations and all other page resources stay shared with the template
+
+    Attributes
+    ----------
+    writer: PdfFileWriter2
+        The PdfFileWriter the page was added to
+    page: PageObject
+        The copied page
+    page_ref: IndirectObject
+        Reference to the copied page in the writer
+    fields: list
+        List of references to the copied top level form fields of the page (in the order they were first written to)
+    missing_appearances: bool
+        A populated field of the page was left without an appearance stream for the PDF viewer to build (see FillPlan.fill)
+    """
+
+    def __init__(self, writer, template_page):
+        """
+        Parameters
+        ----------
+        writer: PdfFileWriter2
+            The PdfFileWriter the copied page is added to
+        template_page: PageObject
+            The page of the CompiledPdfTemplate to copy
+        """
+
+        self.writer = writer
+        self.page = copy.copy(template_page)
+        self.fields = []
+        self.missing_appearances = False
+        self._annotation_indexes = {}
+        self._copied_annotations = {}
+        self._copied_parents = {}
+
+        if '/Annots' in self.page:
+            annotations = ArrayObject(self.page['/Annots'])
+            self.page[NameObject('/Annots')] = annotations
+            for i in range(0, len(annotations)):
+                if isinstance(annotations[i], IndirectObject):
+                    self._annotation_indexes[(annotations[i].idnum, annotations[i].generation)] = i
+
+        writer.addPage(self.page)
+        self.page_ref = writer.getObject(writer._pages)['/Kids'][-1]
+
+    def annotation(self, index):
+        """
+        Returns the annotation at the index of the page's annotation list without copying it (the annotation must not be modified)
+
+        Parameters
+        ----------
+        index: int
+            Index of the annotation in the page's /Annots list
+        """
+
+        return self.page['/Annots'][index].getObject()
+
+    def writable_annotation(self, index):
+        """
+        Returns a copy of the annotation at the index of the page's annotation list that is owned by this page and can be modified
+
+        Parameters
+        ----------
+        index: int
+            Index of the annotation in the page's /Annots list
+        """
+
+        if index not in self._copied_annotations:
+            annotations = self.page['/Annots']
+            annotation = copy.copy(annotations[index].getObject())
+            annotations[index] = self.writer._addObject(annotation)
+            if '/P' in annotation:
+                annotation[NameObject('/P')] = self.page_ref
+            if '/Parent' not in annotation:
+                self.fields.append(annotations[index])
+            self._copied_annotations[index] = annotation
+        return self._copied_annotations[index]
+
+    def writable_field(self, index):
+        """
+        Returns a modifiable copy of the form field of the annotation at the index of the page's annotation list.
+        For fields with several widgets (e.g. radio buttons) this is the shared parent field, which is copied along with all of its kids on the page
+
+        Parameters
+        ----------
+        index: int
+            Index of the annotation in the page's /Annots list
+        """
+
+        if index in self._copied_parents:
+            return self._copied_parents[index]
+
+        annotation = self.writable_annotation(index)
+        if '/Parent' not in annotation:
+            return annotation
+
+        parent = copy.copy(annotation['/Parent'])
+        parent_ref = self.writer._addObject(parent)
+        self.fields.append(parent_ref)
+
+        #Point each kid on the page to the copied parent and the copied parent to the copied kids
+        kids = ArrayObject()
+        for kid_ref in parent['/Kids']:
+            kid_index = self._annotation_indexes.get((kid_ref.idnum, kid_ref.generation))
+            if kid_index is None:
+                kids.append(kid_ref)
+                continue
+            kid = self.writable_annotation(kid_index)
+            kid[NameObject('/Parent')] = parent_ref
+            kids.append(self.page['/Annots'][kid_index])
+            self._copied_parents[kid_index] = parent
+        parent[NameObject('/Kids')] = kids
+        return parent
+
+    def select_radio_button(self, index, state):
+        """
+        Sets the appearance state (/AS) of each radio button of a radio button field on the page: the state for the radio button
+        that has an appearance for it, and off for the others
+
+        Parameters
+        ----------
+        index: int
+            Index of an annotation of the radio button field in the page's /Annots list
+        state: NameObject
+            The selected state of the radio button field (e.g. /0)
+        """
+
+        for kid_ref in self.writable_field(index)['/Kids']:
+            if kid_ref.pdf != self.writer:
+                #Radio buttons on other pages are not copied
+                continue
+            kid = kid_ref.getObject()
+            appearances = kid['/AP'] if '/AP' in kid else {}
+            normal_appearances = appearances['/N'] if '/N' in appearances else {}
+            kid[NameObject('/AS')] = state if state in normal_appearances else CHECKBOX_OFF
+
+    def flatten(self):
+        """
+        Draws the normal appearance of each visible widget annotation (form field) into the page content and removes the widgets 
+        and form fields from the page, so the page displays the populated values without any form processing by the PDF viewer.
+        A page with a populated field left without an appearance stream is kept as a form for the PDF viewer to draw
+        """
+
+        if '/Annots' not in self.page or self.missing_appearances:
+            return
+
+        annotations = self.page['/Annots']
+        kept_annotations = ArrayObject()
+        xobjects = DictionaryObject()
+        content = [b"Q"]
+        for i in range(0, len(annotations)):
+            annotation = annotations[i].getObject()
+            if annotation.get('/Subtype') != '/Widget':
+                kept_annotations.append(annotations[i])
+                continue
+            appearance_ref = self._normal_appearance(annotation)
+            if appearance_ref is None or int(annotation.get('/F', 0)) & HIDDEN_ANNOTATION_FLAGS:
+                continue
+            appearance = appearance_ref.getObject()
+            if not isinstance(appearance, StreamObject) or '/Rect' not in annotation:
+                continue
+            name = NameObject('/FlatField%d' % i)
+            xobjects[name] = appearance_ref
+            content.append(b"q %s cm %s Do Q" % (self._appearance_matrix(annotation['/Rect'], appearance).encode('latin-1'), name.encode('latin-1')))
+
+        #Remove the copied widgets and form fields of the page from the new PDF file
+        for idnum in set([annotations[i].idnum for i in self._copied_annotations] + [field_ref.idnum for field_ref in self.fields]):
+            self.writer._objects[idnum - 1] = NullObject()
+        self.fields = []
+        self._copied_annotations = {}
+        self._copied_parents = {}
+        if kept_annotations:
+            self.page[NameObject('/Annots')] = kept_annotations
+        else:
+            del self.page['/Annots']
+
+        #Wrap the original content in q/Q so the appearances are drawn in the default coordinate system
+        contents = self.page['/Contents'] if '/Contents' in self.page else None
+        if isinstance(contents, ArrayObject):
+            original_contents = list(contents)
+        elif contents is not None:
+            original_contents = [self.page.raw_get('/Contents')]
+        else:
+            original_contents = []
+        self.page[NameObject('/Contents')] = ArrayObject([self.writer.add_shared_object(SAVE_STATE_STREAM)] + original_contents + 
+            [self.writer._addObject(content_stream(b"\n".join(content) + b"\n"))])
+
+        resources = copy.copy(self.page['/Resources']) if '/Resources' in self.page else DictionaryObject()
+        page_xobjects = copy.copy(resources['/XObject']) if '/XObject' in resources else DictionaryObject()
+        page_xobjects.update(xobjects)
+        resources[NameObject('/XObject')] = page_xobjects
+        self.page[NameObject('/Resources')] = resources
+
+    @staticmethod
+    def _normal_appearance(annotation):
+        #Returns the reference to the normal appearance stream of a widget annotation in its current state (None if it has none)
+        appearances = annotation['/AP'] if '/AP' in annotation else None
+        if appearances is None or '/N' not in appearances:
+            return None
+        normal_appearances = appearances['/N']
+        if isinstance(normal_appearances, StreamObject):
+            return appearances.raw_get('/N')
+        state = annotation.get('/AS')
+        if state is None or state not in normal_appearances:
+            return None
+        return normal_appearances.raw_get(state)
+
+    @staticmethod
+    def _appearance_matrix(rect, appearance):
+        #Returns the matrix that maps an appearance stream's bounding box to the annotation rectangle (see PDF 32000-1:2008 12.5.5)
+        bbox = [float(value) for value in appearance.get('/BBox', [0, 0, 1, 1])]
+        a, b, c, d, e, f = [float(value) for value in appearance.get('/Matrix', [1, 0, 0, 1, 0, 0])]
+        corners = [(x * a + y * c + e, x * b + y * d + f) for x in (bbox[0], bbox[2]) for y in (bbox[1], bbox[3])]
+        x1, x2 = min(x for x, y in corners), max(x for x, y in corners)
+        y1, y2 = min(y for x, y in corners), max(y for x, y in corners)
+        rect_x1, rect_x2 = sorted([float(rect[0]), float(rect[2])])
+        rect_y1, rect_y2 = sorted([float(rect[1]), float(rect[3])])
+        scale_x = (rect_x2 - rect_x1) / (x2 - x1) if x2 != x1 else 1.0
+        scale_y = (rect_y2 - rect_y1) / (y2 - y1) if y2 != y1 else 1.0
+        return ' '.join(pdf_number(value) for value in [scale_x, 0, 0, scale_y, rect_x1 - scale_x * x1, rect_y1 - scale_y * y1])
+
+class TextAppearance():
+    """
+    Builds the normal appearance stream of a text field (or a dropdown field converted to a text field) for a value, the way a PDF viewer 
+    would with the NeedAppearances flag: the value in the field's default appearance font, size and color on the field's background and border.
+    Streams are cached by value, so a value repeated on many pages (e.g. 'CRM Only') is only built once
+
+    Attributes
+    ----------
+    width: float
+        Width of the field's widget annotation
+    height: float
+        Height of the field's widget annotation
+    font_name: str
+        Name of the font resource of the default appearance (e.g. '/Helv')
+    font_size: float
+        Font size of the default appearance (0 sizes the text to fit the field)
+    color: str
+        The color operators of the default appearance (e.g. '0 g')
+    alignment: int
+        Alignment of the text (0 left, 1 centered, 2 right)
+    multiline: bool
+        The text wraps onto multiple lines
+    encoding: str
+        Python codec of the font's encoding (e.g. 'cp1252' for /WinAnsiEncoding), None for the standard encoding (see STANDARD_ENCODING_CHARS)
+    resources: DictionaryObject
+        Resources of the appearance streams (the font of the default appearance)
+    streams: dict
+        Dictionary of the values and their cached appearance streams
+    """
+
+    def __init__(self, rect, default_appearance, font, font_ref, alignment=0, multiline=False, characteristics=None, encoding=None):
+        """
+        Parameters
+        ----------
+        rect: list
+            The rectangle of the field's widget annotation ([x1, y1, x2, y2])
+        default_appearance: str
+            The default appearance of the field (e.g. '/Helv 0 Tf 0 g')
+        font: DictionaryObject
+            The font of the default appearance
+        font_ref: PdfObject
+            The reference to the font used in the resources of the appearance streams
+        alignment: int, optional
+            Alignment of the text (defaults to 0 - left)
+        multiline: bool, optional
+            The text wraps onto multiple lines (defaults to False)
+        characteristics: DictionaryObject, optional
+            The appearance characteristics (/MK) of the widget annotation, used for the background and border colors (defaults to None)
+        encoding: str, optional
+            Python codec of the font's encoding (defaults to None - the standard encoding)
+        """
+
+        self.width = abs(float(rect[2]) - float(rect[0]))
+        self.height = abs(float(rect[3]) - float(rect[1]))
+        tokens = default_appearance.split()
+        font_index = tokens.index('Tf')
+        self.font_name = tokens[font_index - 2]
+        self.font_size = float(tokens[font_index - 1])
+        self.color = ' '.join(tokens[:font_index - 2] + tokens[font_index + 1:])
+        self.alignment = alignment
+        self.multiline = multiline
+        self.encoding = encoding
+        self.resources = DictionaryObject({
+            NameObject('/Font'): DictionaryObject({NameObject(self.font_name): font_ref})
+        })
+        self.streams = {}
+
+        self._widths = {}
+        if '/Widths' in font and '/FirstChar' in font:
+            first_char = int(font['/FirstChar'])
+            for i, width in enumerate(font['/Widths']):
+                char = self._decode(first_char + i)
+                if char is not None:
+                    self._widths[char] = float(width)
+        characteristics = characteristics or {}
+        self._background = self._color_operator(characteristics.get('/BG'), 'g', 'rg', 'k')
+        self._border = self._color_operator(characteristics.get('/BC'), 'G', 'RG', 'K')
+
+    @staticmethod
+    def from_field(annotation, acroform, field=None):
+        """
+        Returns the TextAppearance of a text field's widget annotation (None if the field has no default appearance or its font 
+        cannot be found or has an encoding appearance streams are not built for, e.g. /Differences or a composite font)
+
+        Parameters
+        ----------
+        annotation: DictionaryObject
+            The widget annotation of the text field
+        acroform: DictionaryObject
+            The AcroForm of the PDF template, the source of the default appearance and font resources (can be None)
+        field: DictionaryObject, optional
+            The parent field of the widget annotation, the source of the entries the widget inherits (defaults to None - the widget is the field)
+        """
+
+        acroform = acroform or {}
+        field = field if field is not None else annotation
+        default_appearance = annotation.get('/DA', field.get('/DA', acroform.get('/DA')))
+        resources = acroform.get('/DR', {})
+        fonts = resources.get('/Font', {})
+        if default_appearance is None or '/Rect' not in annotation:
+            return None
+        tokens = str(default_appearance).split()
+        if 'Tf' not in tokens or tokens.index('Tf') < 2 or tokens[tokens.index('Tf') - 2] not in fonts:
+            return None
+        font_name = tokens[tokens.index('Tf') - 2]
+        font = fonts[font_name]
+        font_encoding = font.get('/Encoding')
+        if (font_encoding is None and font.get('/Subtype') == '/Type1') or font_encoding == '/StandardEncoding':
+            encoding = None
+        elif isinstance(font_encoding, NameObject) and font_encoding in FONT_ENCODINGS:
+            encoding = FONT_ENCODINGS[font_encoding]
+        else:
+            return None
+        return TextAppearance(annotation['/Rect'], str(default_appearance), font, fonts.raw_get(font_name),
+            int(annotation.get('/Q', field.get('/Q', acroform.get('/Q', 0)))), bool(int(field.get('/Ff', 0)) & MULTILINE_FIELD_FLAG), 
+            annotation.get('/MK'), encoding)
+
+    def _decode(self, code):
+        #Returns the character of a code of the font's encoding (None if it has none)
+        if self.encoding is None:
+            char = chr(code)
+            return char if char in STANDARD_ENCODING_CHARS else None
+        try:
+            return bytes([code]).decode(self.encoding)
+        except (UnicodeDecodeError, ValueError):
+            return None
+
+    def can_encode(self, value):
+        """
+        Returns True if every character of a field value can be drawn with the font's encoding (line breaks are not drawn).
+        Values that cannot are left for the PDF viewer to draw, instead of being drawn with replacement characters
+
+        Parameters
+        ----------
+        value: str
+            The field value
+        """
+
+        text = ''.join(str(value).splitlines())
+        if self.encoding is None:
+            return all(char in STANDARD_ENCODING_CHARS for char in text)
+        try:
+            text.encode(self.encoding)
+        except UnicodeEncodeError:
+            return False
+        return True
+
+    @staticmethod
+    def _color_operator(color, gray_operator, rgb_operator, cmyk_operator):
+        #Returns the operator that sets a color array of /MK (None if there is no color)
+        operators = {1: gray_operator, 3: rgb_operator, 4: cmyk_operator}
+        if not color or len(color) not in operators:
+            return None
+        return ' '.join(pdf_number(float(component)) for component in color) + ' ' + operators[len(color)]
+
+    def text_width(self, text, font_size):
+        """
+        Returns the width of a line of text in the font of the default appearance
+
+        Parameters
+        ----------
+        text: str
+            The line of text
+        font_size: float
+            The font size
+        """
+
+        widths = self._widths or HELVETICA_WIDTHS
+        return sum(widths.get(char, 556) for char in text) * font_size / 1000
+
+    def _lines(self, text, font_size):
+        #Splits the text into the lines that fit the width of the field at a font size (multiline fields only)
+        lines = []
+        for paragraph in text.splitlines() or ['']:
+            line = ''
+            for word in paragraph.split(' '):
+                candidate = word if not line else line + ' ' + word
+                if line and self.text_width(candidate, font_size) > self.width - 4:
+                    lines.append(line)
+                    line = word
+                else:
+                    line = candidate
+            lines.append(line)
+        return lines
+
+    def stream(self, value):
+        """
+        Returns the (cached) appearance stream of a field value (the value must be encodable, see can_encode)
+
+        Parameters
+        ----------
+        value: str
+            The field value
+        """
+
+        if value not in self.streams:
+            self.streams[value] = self._build_stream(str(value))
+        return self.streams[value]
+
+    def _build_stream(self, text):
+        #Builds the Form XObject of the value (see PDF 32000-1:2008 12.7.3.3 - Variable Text)
+        font_size = self.font_size
+        if self.multiline:
+            if not font_size:
+                #Use the largest font size (up to 12) that fits every line in the field
+                font_size = 12.0
+                while font_size > 4 and len(self._lines(text, font_size)) * font_size * 1.15 > self.height - 4:
+                    font_size -= 0.5
+            lines = self._lines(text, font_size)
+        else:
+            lines = [' '.join(text.splitlines())]
+            if not font_size:
+                #Size the text to the height of the field, then shrink it to fit the width
+                font_size = min(12.0, max(4.0, (self.height - 4) / 1.15))
+                text_width = self.text_width(lines[0], font_size)
+                if text_width > self.width - 4:
+                    font_size = max(4.0, font_size * (self.width - 4) / text_width)
+
+        content = []
+        if self._background:
+            content.append(f'{self._background} 0 0 {pdf_number(self.width)} {pdf_number(self.height)} re f')
+        if self._border:
+            content.append(f'{self._border} 0.5 0.5 {pdf_number(self.width - 1)} {pdf_number(self.height - 1)} re S')
+        content.append('/Tx BMC')
+        content.append('q')
+        content.append(f'1 1 {pdf_number(self.width - 2)} {pdf_number(self.height - 2)} re W n')
+        content.append('BT')
+        content.append(f'{self.font_name} {pdf_number(font_size)} Tf {self.color}'.strip())
+        for i, line in enumerate(lines):
+            if self.multiline:
+                #Lines start at the top of the field
+                y = self.height - 2 - font_size * (0.9 + 1.15 * i)
+            else:
+                #The line is centered vertically (Helvetica ascent 0.718 and descent -0.207)
+                y = self.height / 2 - 0.2555 * font_size
+            x = 2.0
+            if self.alignment in (1, 2):
+                free_width = self.width - 4 - self.text_width(line, font_size)
+                x += free_width / 2 if self.alignment == 1 else free_width
+            encoded_line = line.encode(self.encoding or 'ascii').replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+            content.append(f'1 0 0 1 {pdf_number(x)} {pdf_number(y)} Tm (' + encoded_line.decode('latin-1') + ') Tj')
+        content.append('ET')
+        content.append('Q')
+        content.append('EMC')
+
+        appearance_stream = StreamObject()
+        appearance_stream._data = '\n'.join(content).encode('latin-1')
+        appearance_stream.update({
+            NameObject('/Type'): NameObject('/XObject'),
+            NameObject('/Subtype'): NameObject('/Form'),
+            NameObject('/BBox'): ArrayObject([NumberObject(0), NumberObject(0), FloatObject(self.width), FloatObject(self.height)]),
+            NameObject('/Resources'): self.resources
+        })
+        return appearance_stream
+
+class FormFieldPlan():
+    """
+    The annotation slot, kind and pre-built value objects of a form field on a template page
+
+    Attributes
+    ----------
+    name: str
+        The name of the form field in the PDF template (e.g. '1 Existing Okta Account')
+    kind: str
+        The kind of form field (TEXT_FIELD, CHECKBOX_FIELD, RADIO_BUTTON_FIELD or DROPDOWN_FIELD).
+        None if the field is only renamed and never populated
+    annotation_index: int
+        Index of the (first) annotation of the form field in the page's /Annots list
+    states: dict
+        Dictionary of the field values and their pre-built state objects (checkbox and radio button fields only)
+    appearances: list
+        List of the (annotation index, TextAppearance) of each widget of the field, which build the appearance stream of each value 
+        (text and dropdown fields only, empty if the font of a widget cannot be found or a widget is on another page)
+    """
+
+    def __init__(self, name, kind, annotation_index, states=None, appearances=None):
+        """
+        Parameters
+        ----------
+        name: str
+            The name of the form field in the PDF template
+        kind: str
+            The kind of form field (None if the field is only renamed and never populated)
+        annotation_index: int
+            Index of the (first) annotation of the form field in the page's /Annots list
+        states: dict, optional
+            Dictionary of the field values and their pre-built state objects (defaults to None)
+        appearances: list, optional
+            List of the (annotation index, TextAppearance) of each widget of the field (defaults to None)
+        """
+
+        self.name = name
+        self.kind = kind
+        self.annotation_index = annotation_index
+        self.states = states if states is not None else {}
+        self.appearances = appearances or []
+
+    def state(self, value):
+        """
+        Returns the pre-built state object of a checkbox or radio button field value
+
+        Parameters
+        ----------
+        value: str
+            The field value
+        """
+
+        if value not in self.states:
+            if self.kind == CHECKBOX_FIELD:
+                self.states[value] = checkbox_state(value)
+            else:
+                self.states[value] = radio_button_state(value)
+        return self.states[value]
+
+class FillPlan():
+    """
+    The form fields of a template page compiled a single time, so populating a copy of the page is a direct assignment
+    to each field instead of matching every annotation against every field name
+
+    Attributes
+    ----------
+    pageNum: int
+        Page number of the PDF template the plan was compiled from
+    fields: list
+        List of FormFieldPlan of each form field on the page (in annotation order)
+    has_appearances: bool
+        An appearance stream can be built for every text and dropdown field on the page
+    """
+
+    def __init__(self, template_page, pageNum, acroform=None):
+        """
+        Parameters
+        ----------
+        template_page: PageObject
+            The page of the CompiledPdfTemplate
+        pageNum: int
+            Page number of the PDF template
+        acroform: DictionaryObject, optional
+            The AcroForm of the PDF template, the source of the default appearance and fonts of text fields (defaults to None)
+        """
+
+        self.pageNum = pageNum
+        self.fields = []
+
+        parent_fields = set()
+        annotations = template_page['/Annots'] if '/Annots' in template_page else []
+        annotation_indexes = {(annotations[i].idnum, annotations[i].generation): i for i in range(0, len(annotations)) 
+            if isinstance(annotations[i], IndirectObject)}
+        for index in range(0, len(annotations)):
+            annotation = annotations[index].getObject()
+            if '/Parent' in annotation:
+                #The widgets (kids) of radio buttons, and of text and dropdown fields shown more than once, share their parent field, 
+                #which is only planned once
+                parent_ref = annotation.raw_get('/Parent')
+                if (parent_ref.idnum, parent_ref.generation) in parent_fields:
+                    continue
+                parent_fields.add((parent_ref.idnum, parent_ref.generation))
+                field = annotation['/Parent']
+                field_type = field.get('/FT')
+                if field_type == '/Tx' or (field_type == '/Ch' and '/Opt' in field):
+                    kind = TEXT_FIELD if field_type == '/Tx' else DROPDOWN_FIELD
+                    kid_indexes = [annotation_indexes.get((kid.idnum, kid.generation)) for kid in field['/Kids']]
+                    appearances = [(i, TextAppearance.from_field(annotations[i].getObject(), acroform, field)) for i in kid_indexes if i is not None]
+                    if None in kid_indexes or any(appearance is None for i, appearance in appearances):
+                        appearances = []
+                    self.fields.append(FormFieldPlan(field.get('/T'), kind, index, appearances=appearances))
+                elif field_type == '/Btn':
+                    states = dict(RADIO_BUTTON_STATES)
+                    #Pre-build the state of each radio button appearance (e.g. '/0', '/Yes')
+                    for kid in field['/Kids']:
+                        kid = kid.getObject()
+                        appearances = kid['/AP'] if '/AP' in kid else {}
+                        normal_appearances = appearances['/N'] if '/N' in appearances else {}
+                        if isinstance(normal_appearances, DictionaryObject) and not isinstance(normal_appearances, StreamObject):
+                            for state in normal_appearances:
+                                states[state] = NameObject(state)
+                    self.fields.append(FormFieldPlan(field.get('/T'), RADIO_BUTTON_FIELD, index, states))
+                else:
+                    self.fields.append(FormFieldPlan(field.get('/T'), None, index))
+            elif '/T' in annotation:
+                field_type = annotation.get('/FT')
+                if field_type == '/Tx':
+                    kind = TEXT_FIELD
+                elif field_type == '/Btn':
+                    kind = CHECKBOX_FIELD
+                elif field_type == '/Ch' and '/Opt' in annotation:
+                    kind = DROPDOWN_FIELD
+                else:
+                    kind = None
+                states = {'Yes': CHECKBOX_ON} if kind == CHECKBOX_FIELD else None
+                appearance = TextAppearance.from_field(annotation, acroform) if kind in (TEXT_FIELD, DROPDOWN_FIELD) else None
+                self.fields.append(FormFieldPlan(annotation.get('/T'), kind, index, states, [(index, appearance)] if appearance is not None else None))
+
+        self.has_appearances = all(field_plan.appearances for field_plan in self.fields if field_plan.kind in (TEXT_FIELD, DROPDOWN_FIELD))
+
+    def fill(self, template_page, data, generate_appearances=False):
+        """
+        Renames each form field of a copied template page to a unique name and populates it with the passed values
+
+        Parameters
+        ----------
+        template_page: TemplatePage
+            The copied template page to populate
+        data: dict
+            Dictionary of the name of the PDF form fields and their associated values (requires having a unique 'id' field)
+        generate_appearances: bool, optional
+            Set the appearance stream of each populated text and dropdown field whose value the field's font can encode (cached by field 
+            and value, see TextAppearance) and the appearance state of each radio button (defaults to False - left to the PDF viewer, 
+            see PdfFileWriter2.set_need_appearances)
+        """
+
+        unique_id = '###' + str(data['id'])
+        for field_plan in self.fields:
+            field = template_page.writable_field(field_plan.annotation_index)
+            field[NameObject('/T')] = createStringObject(field_plan.name + unique_id)
+
+            if field_plan.kind is None or field_plan.name not in data:
+                continue
+            value = data[field_plan.name]
+            if field_plan.kind == TEXT_FIELD:
+                field[NameObject('/V')] = TextStringObject(value)
+            elif field_plan.kind == DROPDOWN_FIELD:
+                #Convert the dropdown field to a text field to display the value
+                field[NameObject('/FT')] = TEXT_FIELD_TYPE
+                field[NameObject('/V')] = TextStringObject(value)
+            else:
+                state = field_plan.state(value)
+                field[NameObject('/V')] = state
+                field[NameObject('/AS')] = state
+                if generate_appearances and field_plan.kind == RADIO_BUTTON_FIELD:
+                    template_page.select_radio_button(field_plan.annotation_index, state)
+                continue
+
+            if generate_appearances and field_plan.appearances:
+                if not all(appearance.can_encode(value) for annotation_index, appearance in field_plan.appearances):
+                    #Leave the value for the PDF viewer to draw (NeedAppearances is set on the new PDF file, see PdfFileFiller.need_appearances)
+                    template_page.missing_appearances = True
+                    template_page.writer.missing_appearances = True
+                    continue
+                #Each value's appearance stream is only added once to the new PDF file
+                for annotation_index, appearance in field_plan.appearances:
+                    template_page.writable_annotation(annotation_index)[NameObject('/AP')] = DictionaryObject({
+                        NameObject('/N'): template_page.writer.add_shared_object(appearance.stream(value))
+                    })
 
 class PdfFileFiller():
     """
@@ -135,24 +1541,74 @@ class PdfFileFiller():
         The file path/name of the PDF template used to generate new, populated PDF files
     pdf_template: PdfFileReader
         A PdfFileReader object of the PDF file template 
+    compiled_template: CompiledPdfTemplate
+        The PDF file template parsed a single time, used to create isolated copies of its pages for each new PDF file
+    metrics: RunMetrics
+        Timings of the fill, write and merge stages (per new PDF file) and of each populated record
+    compress_output: bool
+        Write new PDF files with their objects packed into compressed object streams (PDF 1.5, see PdfFileWriter2._write_compressed)
+    generate_appearances: bool
+        Build the appearance stream of each populated text and dropdown field (cached by field and value), so PDF viewers do not
+        need to build them when the new PDF files are opened (see TextAppearance)
+    flatten: bool
+        Draw the populated form fields into the page content and remove them from the populated pages (see TemplatePage.flatten)
+    write_threads: int
+        Number of background threads the new PDF files are serialized and written by while the next ones are populated (0 writes them in the calling thread)
+    background_writer: BackgroundPdfWriter
+        The background writer threads, possibly shared with other PdfFileFillers (None if write_threads is 0)
     """
 
-    def __init__(self, pdf_template_file_path):
+    def __init__(self, pdf_template_file_path, metrics=None, compress_output=False, generate_appearances=False, flatten=False, write_threads=0, 
+        max_pending_writes=2, background_writer=None):
         """
         Parameters
         ----------
         pdf_template_file_path: str
             The file path/name of the PDF template used to generate new, populated PDF files
+        metrics: RunMetrics, optional
+            Object the stage timings are recorded in (defaults to None - a new RunMetrics that does not print progress)
+        compress_output: bool, optional
+            Write new PDF files with their objects packed into compressed object streams (defaults to False - uncompressed PDF 1.3 files)
+        generate_appearances: bool, optional
+            Build the appearance stream of each populated text and dropdown field (defaults to False - the PDF viewer builds them)
+        flatten: bool, optional
+            Draw the populated form fields into the page content, the appearance streams are always built (defaults to False)
+        write_threads: int, optional
+            Number of background threads the new PDF files are serialized and written by (defaults to 0 - written in the calling thread).
+            Call wait_for_writes before using the new PDF files
+        max_pending_writes: int, optional
+            Maximum number of populated PDF files waiting for a background writer thread (defaults to 2)
+        background_writer: BackgroundPdfWriter, optional
+            Background writer threads shared with other PdfFileFillers, e.g. of other PDF templates (defaults to None - 
+            new threads are started if write_threads is more than 0, write_threads and max_pending_writes are ignored otherwise)
         """
 
         self.pdf_template_file_path = pdf_template_file_path
-        self.pdf_template = PdfFileReader(pdf_template_file_path)
+        self.metrics = metrics or RunMetrics(progress_interval=None)
+        self.compress_output = compress_output
+        self.generate_appearances = generate_appearances or flatten
+        self.flatten = flatten
+        if background_writer is None and write_threads > 0:
+            background_writer = BackgroundPdfWriter(self.metrics, write_threads, max_pending_writes)
+        self.write_threads = background_writer.num_threads if background_writer is not None else 0
+        self.background_writer = background_writer
+        with self.metrics.stage('compile_template', pdf_template_file_path):
+            self.compiled_template = CompiledPdfTemplate(pdf_template_file_path)
+        self.pdf_template = self.compiled_template.reader
 
-        if "/AcroForm" in self.pdf_template.trailer["/Root"]:
-            self.pdf_template.trailer["/Root"]["/AcroForm"].update(
-            {NameObject("/NeedAppearances"): BooleanObject(True)})
+    @property
+    def need_appearances(self):
+        """
+        True if PDF viewers need to build the appearance of the form fields (the NeedAppearances flag of new PDF files): appearance 
+        streams are not generated or cannot be generated for every text and dropdown field of the PDF template. New PDF files with a 
+        value the field's font cannot encode also need it (see PdfFileWriter2.missing_appearances)
+        """
+
+        if not self.generate_appearances:
+            return True
+        return not all(self.compiled_template.fill_plan(i).has_appearances for i in range(0, self.compiled_template.getNumPages()))
     
-    def update_pdf_form_values(self, new_pdf_file_name, data, pageNum=0):
+    def update_pdf_form_values(self, new_pdf_file_name, data, pageNum=0, on_written=None):
         """
         Creates a new PDF file from the PDF template with form values populated based on the field name and values passed
 
@@ -164,83 +1620,258 @@ class PdfFileFiller():
             Dictionary of the name of the PDF form fields and their associated values (requires having a unique 'id' field)
         pageNum: int, optional
             Page number of the PDF Template to populate data into (default is 0 - e.g. the first page)
+        on_written: callable, optional
+            Function called without arguments once the new PDF file is written (defaults to None, see write_pdf)
         """
 
-        #Create a new PdfFileReader instance (this is required due PyPDF2 retaining any modification to a PageObject for the PdfFileReader)
-        pdf_template = PdfFileReader(self.pdf_template_file_path)
-        if "/AcroForm" in pdf_template.trailer["/Root"]:
-            pdf_template.trailer["/Root"]["/AcroForm"].update(
-            {NameObject("/NeedAppearances"): BooleanObject(True)})
-
-
         new_pdf = PdfFileWriter2()
+        template_page = self.fill_pages(new_pdf, [data], pageNum, new_pdf_file_name)[0]
+
         #Set NeedAppearances on new PdfFileWriter so it's applied to the new PDF
-        trailer = pdf_template.trailer["/Root"]["/AcroForm"]
-        new_pdf._root_object.update({
-            NameObject('/AcroForm'): trailer})
-        new_pdf.set_need_appearances()
+        new_pdf.add_acroform_fields(self.compiled_template.acroform, template_page.fields)
+        need_appearances = self.need_appearances or new_pdf.missing_appearances
+        new_pdf.set_need_appearances(need_appearances)
         if "/AcroForm" in new_pdf._root_object:
             new_pdf._root_object["/AcroForm"].update(
-            {NameObject("/NeedAppearances"): BooleanObject(True)})
+                {NameObject("/NeedAppearances"): BooleanObject(need_appearances)})
+
+        #Create a new PDF file with the unique id of the data tagged at the end with the completed form fields
+        new_pdf_file = new_pdf_file_name.replace('.pdf', '_' + str(data['id']) + '.pdf')
+        self.write_pdf(new_pdf, new_pdf_file, new_pdf_file_name, on_written)
+
+    def fill_page(self, writer, data, pageNum=0):
+        """
+        Adds a copy of a PDF template page to a PdfFileWriter with form values populated based on the field name and values passed
+
+        Parameters
+        ----------
+        writer: PdfFileWriter2
+            The PdfFileWriter the populated page is added to
+        data: dict
+            Dictionary of the name of the PDF form fields and their associated values (requires having a unique 'id' field)
+        pageNum: int, optional
+            Page number of the PDF Template to populate data into (default is 0 - e.g. the first page)
 
-        #Get page from PDF template
-        page = pdf_template.getPage(pageNum)
-        #Add the page to the new PDF
-        new_pdf.addPage(page)
+        Returns
+        -------
+        TemplatePage
+            The populated page
+        """
 
-        pdf_text_fields = []
-        pdf_checkbox_radio_fields = []
-        pdf_dropdown_fields = []
+        #Add an isolated copy of the page from the compiled PDF template to the new PDF
+        #(the template is never modified, so it does not need to be re-read for each new PDF file)
+        template_page = self.compiled_template.clone_page(writer, pageNum)
 
         #Rename each form field name in the page to a unique value to prevent the data in the first page from being 
-        #written to all pages if the PDF file were to be merged with another PDF file from the same template
-        for j in range(0, len(page['/Annots'])):
-            writer_annot = page['/Annots'][j].getObject()
-            if '/Parent' in writer_annot: #if radio button field
-                writer_annot = writer_annot['/Parent']
-                if writer_annot.get('/T').endswith('###'+data['id']):
-                    continue
-            #Update the form field name
-            writer_annot.update({
-                NameObject("/T"): createStringObject(writer_annot.get('/T')+'###'+data['id'])
-            })
+        #written to all pages if the PDF file were to be merged with another PDF file from the same template,
+        #and update the fields in the PDF page for each field type
+        self.compiled_template.fill_plan(pageNum).fill(template_page, data, self.generate_appearances)
+        if self.flatten:
+            template_page.flatten()
 
-            #Determine the field types of each form field in the PDF page
-            if writer_annot.get('/FT') == '/Tx':
-                #Is a text field
-                pdf_text_fields.append(writer_annot.get('/T'))
-            elif writer_annot.get('/FT') == '/Btn':
-                #Is a button field (i.e. checkbox or radio field)
-                pdf_checkbox_radio_fields.append(writer_annot.get('/T'))
-            elif writer_annot.get('/FT') == '/Ch' and '/Opt' in writer_annot:
-                #Is a choice field (i.e. dropdown field)
-                pdf_dropdown_fields.append(writer_annot.get('/T'))
-
-        #Filter the data into the appropriate field type
-        unique_id = '###' + data['id']
-        text_field_data = {k + unique_id:v for k,v in data.items() if k + unique_id in pdf_text_fields or k in pdf_dropdown_fields}
-        checkbox_radio_field_data = {k + unique_id:v for k,v in data.items() if k + unique_id in pdf_checkbox_radio_fields}
-        dropdown_field_data = {k + unique_id:v for k,v in data.items() if k + unique_id in pdf_dropdown_fields}
-
-        #Convert dropdown field to text field
-        new_pdf.convert_dropdown_to_text(page, dropdown_field_data)
-
-        #Update the fields in the PDF page for each field type
-        new_pdf.updatePageFormFieldValues(page, text_field_data)
-        new_pdf.update_checkbox_radio_field_values(page, checkbox_radio_field_data)
-        new_pdf.updatePageFormFieldValues(page, dropdown_field_data)
-
-        new_pdf.set_need_appearances()
-        if "/AcroForm" in new_pdf._root_object:
-            new_pdf._root_object["/AcroForm"].update(
-                {NameObject("/NeedAppearances"): BooleanObject(True)})
+        return template_page
 
-        #Create a new PDF file with the unique id of the data tagged at the end with the completed form fields
-        new_pdf_file = new_pdf_file_name.replace('.pdf', '_' + str(data['id']) + '.pdf')
-        with open(new_pdf_file, 'wb') as out:
-            new_pdf.write(out)
-    
-    def merge_pdfs(self, input_filenames, output_filename, header_pages=None):
+    def fill_pages(self, writer, data_records, pageNum=0, file_name=None):
+        """
+        Adds a copy of a PDF template page populated for each data record to a PdfFileWriter, recording the time taken by each record
+
+        Parameters
+        ----------
+        writer: PdfFileWriter2
+            The PdfFileWriter the populated pages are added to
+        data_records: list
+            List of dictionaries of the name of the PDF form fields and their associated values (each requires having a unique 'id' field)
+        pageNum: int, optional
+            Page number of the PDF Template to populate data into (default is 0 - e.g. the first page)
+        file_name: str, optional
+            Name of the new PDF file the metrics are recorded under (defaults to None)
+
+        Returns
+        -------
+        list
+            List of the populated TemplatePages
+        """
+
+        template_pages = []
+        with self.metrics.stage('fill', file_name, len(data_records)):
+            for data in data_records:
+                start_time = time.perf_counter()
+                template_pages.append(self.fill_page(writer, data, pageNum))
+                self.metrics.record_done(time.perf_counter() - start_time)
+        return template_pages
+
+    def write_pdf(self, writer, output_filename, file_name=None, on_written=None):
+        """
+        Writes a PdfFileWriter to a new PDF file, recording the time taken and the number of bytes written. With write_threads, the writer 
+        is queued to be written by a background thread instead (see BackgroundPdfWriter), and errors of previous background writes are raised.
+        A failed write never leaves a partial PDF file (see write_pdf_file)
+
+        Parameters
+        ----------
+        writer: PdfFileWriter2
+            The PdfFileWriter to write (must not be modified afterwards)
+        output_filename: str
+            Name of the new PDF file
+        file_name: str, optional
+            Name the metrics are recorded under (defaults to None - the new PDF file name)
+        on_written: callable, optional
+            Function called without arguments (in the calling thread) once the new PDF file is written, e.g. to record it in a build manifest.
+            With write_threads, it is called by a later write_pdf or wait_for_writes call (defaults to None)
+        """
+
+        writer.compress = self.compress_output
+        if self.background_writer is not None:
+            self.background_writer.submit(writer, output_filename, file_name, on_written)
+            return
+
+        with self.metrics.stage('write', file_name or output_filename) as stage:
+            stage['bytes_written'] += write_pdf_file(writer, output_filename)
+        if on_written is not None:
+            on_written()
+
+    def wait_for_writes(self):
+        """
+        Waits until every new PDF file queued to the background writer threads is written, and raises the first error 
+        of a background write (does nothing without write_threads)
+        """
+
+        if self.background_writer is not None:
+            self.background_writer.wait()
+
+    def close(self):
+        """
+        Waits for the new PDF files queued to the background writer threads (see wait_for_writes) and stops the threads
+        """
+
+        if self.background_writer is not None:
+            self.background_writer.close()
+
+    def merge_pdf_form_values(self, output_filename, data_records, pageNum=0, header_pages=None, on_written=None):
+        """
+        Creates a single PDF file with a copy of a PDF template page populated for each data record, without creating
+        an intermediate PDF file for each record
+
+        Parameters
+        ----------
+        output_filename: str
+            Name of the new merged PDF file
+        data_records: list
+            List of dictionaries of the name of the PDF form fields and their associated values (each requires having a unique 'id' field).
+            A page is added for each record in the order of the list
+        pageNum: int, optional
+            Page number of the PDF Template to populate data into (default is 0 - e.g. the first page)
+        header_pages: int, optional
+            Number of pages from the PDF template to include in the beginning of the merged PDF file 
+            (ex. header_pages = 2 will include the first and second page of the PDF template as the first and second pages of the merged PDF file)
+        on_written: callable, optional
+            Function called without arguments once the new merged PDF file is written (defaults to None, see write_pdf)
+        """
+
+        writer = self.create_merged_pdf(data_records, pageNum, header_pages, output_filename)
+
+        #Create and write to new PDF file
+        self.write_pdf(writer, output_filename, on_written=on_written)
+
+    def create_merged_pdf(self, data_records, pageNum=0, header_pages=None, file_name=None):
+        """
+        Creates a PdfFileWriter with a copy of a PDF template page populated for each data record
+
+        Parameters
+        ----------
+        data_records: list
+            List of dictionaries of the name of the PDF form fields and their associated values (each requires having a unique 'id' field).
+            A page is added for each record in the order of the list
+        pageNum: int, optional
+            Page number of the PDF Template to populate data into (default is 0 - e.g. the first page)
+        header_pages: int, optional
+            Number of pages from the PDF template to include in the beginning of the new PDF (defaults to None - no header pages)
+        file_name: str, optional
+            Name of the new PDF file the metrics are recorded under (defaults to None)
+
+        Returns
+        -------
+        PdfFileWriter2
+            The new PDF
+        """
+
+        writer = PdfFileWriter2()
+
+        #Add the header pages to the new PDF file
+        for i in range(0, header_pages or 0):
+            self.compiled_template.clone_page(writer, i)
+
+        #Add a populated page for each data record to the end of the new PDF file
+        fields = []
+        for template_page in self.fill_pages(writer, data_records, pageNum, file_name):
+            fields.extend(template_page.fields)
+
+        #Set NeedAppearances on the interactive form of the new PDF file that holds the fields of every page
+        writer.add_acroform_fields(self.compiled_template.acroform, fields)
+        writer.set_need_appearances(self.need_appearances or writer.missing_appearances)
+
+        return writer
+
+    def create_pdf_part(self, data_records, pageNum=0):
+        """
+        Creates a PdfPart with a copy of a PDF template page populated for each data record, to be merged 
+        (possibly by another process) with merge_pdf_parts
+
+        Parameters
+        ----------
+        data_records: list
+            List of dictionaries of the name of the PDF form fields and their associated values (each requires having a unique 'id' field).
+            A page is added for each record in the order of the list
+        pageNum: int, optional
+            Page number of the PDF Template to populate data into (default is 0 - e.g. the first page)
+
+        Returns
+        -------
+        PdfPart
+            The populated pages
+        """
+
+        writer = PdfFileWriter2()
+        fields = []
+        for template_page in self.fill_pages(writer, data_records, pageNum):
+            fields.extend(template_page.fields)
+        return writer.export_part(fields, self.compiled_template.reader)
+
+    def merge_pdf_parts(self, pdf_parts, output_filename, header_pages=None, on_written=None):
+        """
+        Merges the pages of PdfParts created by create_pdf_part into a new, single PDF file without parsing them again.
+        Objects of the PDF template shared by the parts are only written once
+
+        Parameters
+        ----------
+        pdf_parts: list
+            List of PdfParts to be combined into a single PDF file (in page order)
+        output_filename: str
+            Name of the new merged PDF file 
+        header_pages: int, optional
+            Number of pages from the PDF template to include in the beginning of the merged PDF file (defaults to None - no header pages)
+        on_written: callable, optional
+            Function called without arguments once the new merged PDF file is written (defaults to None, see write_pdf)
+        """
+
+        writer = PdfFileWriter2()
+
+        #Add the header pages to the new PDF file
+        for i in range(0, header_pages or 0):
+            self.compiled_template.clone_page(writer, i)
+
+        #Add the pages of each part to the end of the new PDF file
+        fields = []
+        with self.metrics.stage('merge', output_filename, sum(len(pdf_part.pages) for pdf_part in pdf_parts)):
+            for pdf_part in pdf_parts:
+                fields.extend(writer.add_part(pdf_part, self.compiled_template.reader))
+
+        writer.add_acroform_fields(self.compiled_template.acroform, fields)
+        writer.set_need_appearances(self.need_appearances or writer.missing_appearances)
+
+        #Create and write to new PDF file
+        self.write_pdf(writer, output_filename, on_written=on_written)
+
+    def merge_pdfs(self, input_filenames, output_filename, header_pages=None, on_written=None):
         """
         Merges multiple PDF files into a new, single PDF file
 
@@ -253,23 +1884,137 @@ class PdfFileFiller():
         header_pages: int, optional
             Number of pages from the PDF template to include in the beginning of the merged PDF file 
             (ex. header_pages = 2 will include the first and second page of the PDF template as the first and second pages of the merged PDF file)
+        on_written: callable, optional
+            Function called without arguments once the new merged PDF file is written (defaults to None, see write_pdf).
+            The input PDF files are read until it is written, so they must not be deleted before then (see wait_for_writes)
         """
 
         writer = PdfFileWriter2()
-        writer.set_need_appearances()
+        writer.set_need_appearances(self.need_appearances)
 
         #Add the header pages to the new PDF file
         for i in range(0, header_pages):
-            writer.addPage(self.pdf_template.getPage(i))
+            self.compiled_template.clone_page(writer, i)
         
         #Add each page from each PDF file to the end of the new PDF file
-        for input_file in input_filenames:
-            file = PdfFileReader(input_file)
-            for pageNum in range(0, file.getNumPages()):
-                page = file.getPage(pageNum - 1)
-                writer.addPage(page)
+        with self.metrics.stage('merge', output_filename, len(input_filenames)):
+            for input_file in input_filenames:
+                file = PdfFileReader(input_file)
+                for pageNum in range(0, file.getNumPages()):
+                    page = file.getPage(pageNum - 1)
+                    writer.addPage(page)
+                acroform = file.trailer['/Root']['/AcroForm'] if '/AcroForm' in file.trailer['/Root'] else {}
+                need_appearances = acroform.get('/NeedAppearances')
+                if isinstance(need_appearances, BooleanObject) and need_appearances.value:
+                    writer.missing_appearances = True
+        if writer.missing_appearances:
+            #A PDF file has values left for the PDF viewer to draw
+            writer.set_need_appearances(True)
         
         #Create and write to new PDF file
-        new_file = open(output_filename, 'wb')
-        writer.write(new_file)
-        new_file.close()
\ No newline at end of file
+        self.write_pdf(writer, output_filename, on_written=on_written)
+
+class PdfFileFillerCache():
+    """
+    A size-bounded cache of PdfFileFillers of several PDF templates, so new PDF files of any of the templates are populated in the same run
+    without parsing a template (or building the fill plans of its pages) again. Once max_size templates are cached, the least recently used 
+    template is evicted to compile the next one. A cached template is compiled again if its file was changed (size or modification time).
+    Every PdfFileFiller has the same output options and shares the same background writer threads
+
+    Attributes
+    ----------
+    max_size: int
+        Maximum number of compiled PDF templates kept in the cache
+    metrics: RunMetrics
+        Object the 'compile_template' stage of each compiled PDF template and the 'evict_template' stage of each evicted one are recorded in
+    compress_output: bool
+        Write new PDF files with their objects packed into compressed object streams (see PdfFileFiller)
+    generate_appearances: bool
+        Build the appearance stream of each populated text and dropdown field (see PdfFileFiller)
+    flatten: bool
+        Draw the populated form fields into the page content (see PdfFileFiller)
+    background_writer: BackgroundPdfWriter
+        The background writer threads shared by the PdfFileFillers (None writes the new PDF files in the calling thread)
+    hits: int
+        Number of PdfFileFillers returned from the cache
+    misses: int
+        Number of PDF templates compiled (not cached, or changed since they were compiled)
+    evictions: int
+        Number of PDF templates evicted to make room for another one
+    """
+
+    def __init__(self, max_size=4, metrics=None, compress_output=False, generate_appearances=False, flatten=False, background_writer=None):
+        """
+        Parameters
+        ----------
+        max_size: int, optional
+            Maximum number of compiled PDF templates kept in the cache (defaults to 4)
+        metrics: RunMetrics, optional
+            Object the stage timings are recorded in (defaults to None - a new RunMetrics that does not print progress)
+        compress_output: bool, optional
+            Write new PDF files with their objects packed into compressed object streams (defaults to False)
+        generate_appearances: bool, optional
+            Build the appearance stream of each populated text and dropdown field (defaults to False)
+        flatten: bool, optional
+            Draw the populated form fields into the page content (defaults to False)
+        background_writer: BackgroundPdfWriter, optional
+            Background writer threads shared by the PdfFileFillers (defaults to None - the new PDF files are written in the calling thread)
+        """
+
+        if max_size < 1:
+            raise ValueError('The PDF template cache must hold at least one template.')
+        self.max_size = max_size
+        self.metrics = metrics or RunMetrics(progress_interval=None)
+        self.compress_output = compress_output
+        self.generate_appearances = generate_appearances
+        self.flatten = flatten
+        self.background_writer = background_writer
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        #PdfFileFiller and file signature of each cached PDF template, in least to most recently used order
+        self._fillers = OrderedDict()
+
+    def __len__(self):
+        return len(self._fillers)
+
+    def __contains__(self, pdf_template_file_path):
+        return os.path.abspath(pdf_template_file_path) in self._fillers
+
+    def get(self, pdf_template_file_path):
+        """
+        Returns the PdfFileFiller of a PDF template, compiling the template if it is not cached (or was changed since it was compiled)
+
+        Parameters
+        ----------
+        pdf_template_file_path: str
+            The file path/name of the PDF template
+        """
+
+        cache_key = os.path.abspath(pdf_template_file_path)
+        stat = os.stat(pdf_template_file_path)
+        signature = (stat.st_size, stat.st_mtime_ns)
+        cached = self._fillers.get(cache_key)
+        if cached is not None and cached[1] == signature:
+            self._fillers.move_to_end(cache_key)
+            self.hits += 1
+            return cached[0]
+
+        self.misses += 1
+        self._fillers.pop(cache_key, None)
+        while len(self._fillers) >= self.max_size:
+            #Evict the least recently used template (PDF files of it still waiting to be written keep their own references to it)
+            evicted_key, (evicted_filler, evicted_signature) = self._fillers.popitem(last=False)
+            self.evictions += 1
+            self.metrics.record_stage('evict_template', evicted_filler.pdf_template_file_path)
+        pdf_filler = PdfFileFiller(pdf_template_file_path, self.metrics, self.compress_output, self.generate_appearances, self.flatten, 
+            background_writer=self.background_writer)
+        self._fillers[cache_key] = (pdf_filler, signature)
+        return pdf_filler
+
+    def clear(self):
+        """
+        Removes every compiled PDF template from the cache
+        """
+
+        self._fillers.clear()
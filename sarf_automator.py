@@ -1,13 +1,76 @@
-from pdf_filler import PdfFileFiller
-import pandas as pd
+from field_mapper import FieldMapper, string_columns, string_values
+from workbook_reader import read_sheet, read_sheet_columns, read_sheets
+from build_cache import BuildManifest, PageIndex, WorkbookCache, content_key
+from metrics import RunMetrics, profiled
+from concurrent.futures import ProcessPoolExecutor
+from fnmatch import fnmatch
+from functools import partial
+import json
 import os
 import shutil
 import sys
 
+#SARF PDF field mappings
+#Mappings with list values will be concatenated together with each value separated by ', '
+#Mappings with dictionary values, will map the dict key column by default, but if that value is blank it will map the dict value column instead
+FIELD_MAPPINGS = {
+    '1 Name':['Last Name', 'First Name', 'Middle Name'],
+    '1 Preferred Email':'Email Address\n(state.gov preferred)',
+    '1 Job Title':'Job Title',
+    '1 Employment Type':'Employment Type',
+    '1 Office  Post':'Office',
+    '1 Notes':'Bureau',
+    '1 Timezone':'Time Zone',
+    '1 Existing Okta Account':'Do you have an existing Okta account?  ',
+    '1 DOS email':{"DoS Email Address \n(only if @state.gov wasn't already listed in column E)":'Email Address\n(state.gov preferred)'},
+    '1 no email':"Do you have a DoS Email Address? \n(only if @state.gov wasn't already listed in column E)",
+    '1 mobile device':'Do you have access to a mobile phone in your workplace?',
+    '1 mobile app':'Do you have the ability to download the Okta Verify moble app to a work or personal phone, and use it at your workplace?',
+    '1 CRM User Type':'User Type',
+    '1 Exec Contacts':'Executive Contacts ',
+    '1 Printing':'Event Printing'
+}
+
+#SARF PDF Override Value mappings for checkbox and radio button values that require specific values to select the correct option 
+#and includes a default string value in cases of a blank value in the column
+VALUE_OVERRIDE_MAPPINGS = {
+    '1 Existing Okta Account':{'':'Yes','Yes':'/0', 'No':'/1', "I Don't Know":'/2'},
+    '1 no email':{'':'/No', 'Yes':'/No', 'No':'Yes', '/No':'No'},
+    '1 mobile device':{'': 'Yes', 'Yes':'/Yes', 'No':'/No'},
+    '1 mobile app':{'': 'Yes', 'Yes':'/0', 'No':'/No'},
+    '1 CRM User Type':{'':'CRM User', 'CRM User':'/1#20CRM#20User', 'CRM Mission/Office Admin':'/1#20Admin', 'CRM Contacts Only User':'/1#20Contacts'},
+    '1 Exec Contacts':{'':'No'},
+    '1 Printing':{'':'No'}
+}
+
+#SARF PDF field mappings for default string values 
+DEFAULT_STRING_MAPPINGS = {
+    '1 Request Type':'New User',
+    '1 Application Access':'CRM Only'
+}
+
+#The page number the SARF user data section resides (0 based)
+SARF_USER_INFO_PAGE_NUM = 2
+#Record key of the SARF template file name of user records not populated into the default SARF template (see SarfAutomator.assign_templates)
+SARF_TEMPLATE_KEY = '_sarf_template'
+
+#PdfFileFiller of the default SARF template and cache of the other SARF templates of a SARF worker process (see init_sarf_worker)
+_worker_pdf_filler = None
+_worker_template_cache = None
+
 def main():
     print('Starting process...')
-    #Local directory the SARF template is located
+    #Local directory the SARF template(s) is located
     sarf_template_path = 'SARF_Template/'
+    #File name of the SARF template used unless another one is selected below (None if SARF_Template/ only contains one template)
+    default_template = None
+    #SARF template of the P&P files whose file name matches each pattern, e.g. {'*_ITS_*.xlsx': 'ITS_SARF.pdf'} 
+    #(each template is a separate SARF, e.g. CRM_SARF_<Bureau>_ITS_SARF.pdf)
+    workbook_templates = {}
+    #P&P file column whose value (a SARF template file name, with or without .pdf) selects the SARF template of each user (None to not select per user)
+    template_column = None
+    #Maximum number of SARF templates (other than the default one) kept compiled in memory at a time
+    template_cache_size = 4
 
     #Local directory the completed P&P file(s) is located 
     user_data_path = 'P&P_Files/'
@@ -18,6 +81,49 @@ def main():
 
     #Prefix for the newly created PDF files
     new_file_prefix = 'CRM_SARF_'
+    #Fill and merge each SARF in memory instead of writing a temporary PDF file for each user
+    merge_in_memory = True
+    #Split the SARF of each P&P file into SARF files of at most this many users (e.g. CRM_SARF_<Bureau>_part03.pdf), listed in CRM_SARF_<Bureau>.shards.json
+    #(None creates a single SARF file per P&P file)
+    shard_size = None
+    #Number of processes used to read the user data files and generate the SARFs (or shards) in parallel (1 processes them one at a time)
+    max_workers = os.cpu_count() or 1
+    #Only generate (and verify) the SARFs with worker processes if there are at least this many user records in total: starting the worker processes 
+    #and compiling the SARF template in each of them takes longer than populating a few hundred users in this process
+    parallel_min_records = 1000
+    #Read, map and generate the SARF of each user data file one at a time instead of loading all of the user data first (keeps memory flat)
+    streaming = False
+    #File that records the inputs each SARF was generated from, so SARFs whose inputs have not changed are not regenerated
+    manifest_path = 'sarf_manifest.json'
+    #Directory the normalized user data of each P&P file is cached in, so P&P files that have not changed are not parsed again
+    workbook_cache_dir = 'sarf_cache/'
+    #Read the P&P files with pandas instead of the lightweight reader (the user data is the same, but importing pandas takes most of a small run)
+    use_pandas = False
+    #Regenerate every SARF, even if its inputs have not changed
+    force_rebuild = '--force' in sys.argv[1:]
+    #Only populate the pages of added or changed users, reusing the pages of the previous run for the rest
+    incremental = '--incremental' in sys.argv[1:]
+    #Files the timings, counts, bytes written and peak memory of each stage are saved to
+    metrics_json_path = 'sarf_metrics.json'
+    metrics_csv_path = 'sarf_metrics.csv'
+    #File the cProfile stats of generating the SARFs are saved to (only when profiling)
+    profile_path = 'sarf_profile.prof' if '--profile' in sys.argv[1:] else None
+    #Write the SARFs as compressed PDF 1.5 files (objects packed into compressed object streams), much smaller for large SARFs
+    compress_output = True
+    #Build the appearance of each populated text field in the SARFs, so PDF viewers do not rebuild every field each time a SARF is opened or printed
+    generate_appearances = True
+    #Draw the populated fields into the SARF pages instead of keeping them as form fields (the SARFs can no longer be edited)
+    flatten = '--flatten' in sys.argv[1:]
+    #Number of background threads that write the SARFs (e.g. to a network share) while the next ones are populated (0 writes them as they are populated).
+    #More than 1 thread is needed to overlap the disk/network waits, since serializing a SARF holds the interpreter
+    write_threads = 2
+    if profile_path:
+        #Profile the fill path in this process (worker processes are not profiled)
+        max_workers = 1
+    #Keep running and generate the SARF of each P&P file added to (or changed in) the P&P file directory within seconds
+    watch = '--watch' in sys.argv[1:]
+    #Compare the populated form fields of each user in the SARFs with the user data after they are generated
+    verify = '--verify' in sys.argv[1:] and not flatten
 
     if not os.path.exists(user_data_path):
         os.mkdir(user_data_path)
@@ -25,12 +131,102 @@ def main():
     if not os.path.exists(sarf_template_path):
         os.mkdir(sarf_template_path)
 
-    automator = SarfAutomator(sarf_template_path)
-    print('Loading user data files...')
-    automator.load_data(user_data_path, user_data_sheetname, user_data_header_row_num)
-    print('Generating SARFs...')
-    automator.run(new_file_prefix)
-    print('Process complete.')
+    automator = SarfAutomator(sarf_template_path, manifest_path, compress_output, generate_appearances, flatten, workbook_cache_dir, write_threads, 
+        default_template, workbook_templates, template_column, template_cache_size)
+    if watch:
+        from watch_service import SarfWatchService
+        service = SarfWatchService(automator, user_data_path, user_data_sheetname, user_data_header_row_num, new_file_prefix, max_workers,
+            run_options={'force_rebuild': force_rebuild, 'incremental': incremental, 'shard_size': shard_size}, metrics_paths=(metrics_json_path, metrics_csv_path), 
+            use_pandas=use_pandas)
+        service.run_forever()
+        return
+    if streaming:
+        print('Loading user data files and generating SARFs...')
+        with profiled(profile_path):
+            automator.run_streaming(user_data_path, user_data_sheetname, user_data_header_row_num, new_file_prefix, max_workers, force_rebuild=force_rebuild, incremental=incremental, 
+                shard_size=shard_size, use_pandas=use_pandas)
+    else:
+        print('Loading user data files...')
+        automator.load_data(user_data_path, user_data_sheetname, user_data_header_row_num, max_workers, use_pandas)
+        print('Generating SARFs...')
+        if sum(len(cur_user_data) for cur_user_data in automator.user_data) < parallel_min_records:
+            max_workers = 1
+        with profiled(profile_path):
+            automator.run(new_file_prefix, merge_in_memory, max_workers, force_rebuild=force_rebuild, incremental=incremental, shard_size=shard_size)
+        if verify:
+            print('Verifying SARFs...')
+            automator.verify_sarfs(new_file_prefix, max_workers, shard_size)
+    automator.metrics.write_json(metrics_json_path)
+    automator.metrics.write_csv(metrics_csv_path)
+    print(f'Process complete. Metrics saved to {metrics_json_path} and {metrics_csv_path}.')
+
+def user_number_sort_key(user_record):
+    """
+    Returns the sort key of a user data record, the integer value of its unique id (e.g. User Number)
+
+    Parameters
+    ----------
+    user_record: dict
+        Dictionary of the SARF PDF field names and values of a user (requires having a unique 'id' field)
+    """
+
+    return int(str(user_record['id']).split('.')[0])
+
+def init_sarf_worker(pdf_template_file_path, compress_output=False, generate_appearances=False, flatten=False, template_cache_size=4):
+    """
+    Initializes a SARF worker process with its own compiled copy of the default SARF template (the other SARF templates are compiled 
+    the first time the worker process populates them)
+
+    Parameters
+    ----------
+    pdf_template_file_path: str
+        The file path/name of the default SARF template PDF file
+    compress_output: bool, optional
+        Write the SARF PDF files with their objects packed into compressed object streams (defaults to False)
+    generate_appearances: bool, optional
+        Build the appearance stream of each populated text field (defaults to False)
+    flatten: bool, optional
+        Draw the populated fields into the page content (defaults to False)
+    template_cache_size: int, optional
+        Maximum number of other SARF templates kept compiled by the worker process (defaults to 4)
+    """
+
+    from pdf_filler import PdfFileFiller, PdfFileFillerCache
+
+    global _worker_pdf_filler, _worker_template_cache
+    _worker_pdf_filler = PdfFileFiller(pdf_template_file_path, compress_output=compress_output, generate_appearances=generate_appearances, flatten=flatten)
+    _worker_template_cache = PdfFileFillerCache(template_cache_size, compress_output=compress_output, generate_appearances=generate_appearances, flatten=flatten)
+
+def render_sarf(new_sarf_filename, user_records, header_pages, pdf_template_file_path=None):
+    """
+    Populates a SARF page for each user record in a SARF worker process
+
+    Parameters
+    ----------
+    new_sarf_filename: str
+        Name of the SARF PDF file to create (None returns the populated pages as a PdfPart instead)
+    user_records: list
+        List of dictionaries of the SARF PDF field names and values of each user (in page order)
+    header_pages: int
+        Number of pages from the SARF template to include in the beginning of the PDF file
+    pdf_template_file_path: str, optional
+        The file path/name of the SARF template PDF file to populate (defaults to None - the default SARF template of the worker process)
+
+    Returns
+    -------
+    PdfPart
+        The populated pages if new_sarf_filename is None (see PdfFileFiller.merge_pdf_parts)
+    """
+
+    pdf_filler = _worker_pdf_filler
+    if pdf_template_file_path is not None and pdf_template_file_path != _worker_pdf_filler.pdf_template_file_path:
+        pdf_filler = _worker_template_cache.get(pdf_template_file_path)
+
+    if new_sarf_filename is not None:
+        pdf_filler.merge_pdf_form_values(new_sarf_filename, user_records, SARF_USER_INFO_PAGE_NUM, header_pages)
+        return None
+
+    return pdf_filler.create_pdf_part(user_records, SARF_USER_INFO_PAGE_NUM)
 
 class SarfAutomator():
     """
@@ -40,37 +236,155 @@ class SarfAutomator():
     ----------
     user_data: list
         List of dictionaries containing the user data from each input data source
+    sarf_template_path: str
+        Path of file directory that contains the SARF Template PDF file(s)
+    template_names: list
+        File names of the SARF template PDF files in the SARF template directory
+    default_template: str
+        File name of the SARF template the user records are populated into unless another one is selected for their Excel file or record
     pdf_filler: PdfFileFiller
-        Object used to read, populate, and create PDF files
+        Object used to read, populate, and create PDF files of the default SARF template
+    template_cache: PdfFileFillerCache
+        Size-bounded cache of the compiled SARF templates other than the default one (see template_filler)
+    workbook_templates: dict
+        Dictionary of Excel file name patterns (e.g. 'CRM_*.xlsx', see fnmatch) and the file name of the SARF template of the matching Excel files
+    template_column: str
+        Name of the user data column whose value selects the SARF template of each record, the file name with or without .pdf 
+        (None if the template is not selected per record, blank values and Excel files without the column use the template of the Excel file)
+    field_mapper: FieldMapper
+        Object used to map the user data columns to the SARF PDF fields
+    build_manifest: BuildManifest
+        Record of the inputs each SARF PDF file was generated from, used to skip SARFs whose inputs have not changed (None if disabled)
+    workbook_cache: WorkbookCache
+        Cache of the normalized user data of each Excel file, used to skip parsing Excel files that have not changed (None if disabled)
+    metrics: RunMetrics
+        Timings, counts, bytes written and peak memory of each stage of the process (see RunMetrics.write_json and RunMetrics.write_csv)
     """
     
-    def __init__(self, sarf_template_path):
+    def __init__(self, sarf_template_path, manifest_path=None, compress_output=False, generate_appearances=False, flatten=False, workbook_cache_dir=None, 
+        write_threads=0, default_template=None, workbook_templates=None, template_column=None, template_cache_size=4):
         """
         Parameters
         ----------
         sarf_template_path: str
-            Path of file directory that contains the SARF Template PDF file
+            Path of file directory that contains the SARF Template PDF file(s)
+        manifest_path: str, optional
+            The file path/name of the build manifest JSON file (defaults to None - every SARF is always regenerated)
+        compress_output: bool, optional
+            Write the SARF PDF files with their objects packed into compressed object streams (defaults to False - uncompressed PDF 1.3 files)
+        generate_appearances: bool, optional
+            Build the appearance stream of each populated text field, cached by field and value (defaults to False - PDF viewers build them)
+        flatten: bool, optional
+            Draw the populated fields into the page content of the SARF PDF files instead of keeping them as form fields (defaults to False)
+        workbook_cache_dir: str, optional
+            The directory of the cache of the normalized user data of each Excel file (defaults to None - every Excel file is always parsed)
+        write_threads: int, optional
+            Number of background threads the SARF PDF files are written by while the next ones are populated (defaults to 0 - written as they are populated)
+        default_template: str, optional
+            File name of the default SARF template (defaults to None - the only PDF file in the SARF template directory)
+        workbook_templates: dict, optional
+            Dictionary of Excel file name patterns and the file name of the SARF template of the matching Excel files, 
+            e.g. {'*_ITS_*.xlsx': 'ITS_SARF.pdf'} (defaults to None - the default SARF template)
+        template_column: str, optional
+            Name of the user data column whose value selects the SARF template of each record (defaults to None - not selected per record)
+        template_cache_size: int, optional
+            Maximum number of SARF templates other than the default one kept compiled (defaults to 4)
         """
 
         self.user_data = []
+        self.metrics = RunMetrics()
+        self.field_mapper = FieldMapper(FIELD_MAPPINGS, VALUE_OVERRIDE_MAPPINGS, DEFAULT_STRING_MAPPINGS)
+        self.build_manifest = BuildManifest(manifest_path) if manifest_path else None
+        self.workbook_cache = WorkbookCache(workbook_cache_dir) if workbook_cache_dir else None
+        self.workbook_templates = workbook_templates or {}
+        self.template_column = template_column
+        self.pdf_filler = None
+        self.load_template(sarf_template_path, compress_output, generate_appearances, flatten, write_threads, default_template, template_cache_size)
+
+    def load_template(self, sarf_template_path, compress_output=False, generate_appearances=False, flatten=False, write_threads=0, default_template=None, 
+        template_cache_size=4):
+        """
+        Validates the SARF template directory and compiles the default SARF template PDF file in it (e.g. again after the templates were replaced).
+        The other SARF templates are compiled the first time user records are populated into them (see template_filler)
+
+        Parameters
+        ----------
+        sarf_template_path: str
+            Path of file directory that contains the SARF Template PDF file(s)
+        compress_output: bool, optional
+            Write the SARF PDF files with their objects packed into compressed object streams (defaults to False)
+        generate_appearances: bool, optional
+            Build the appearance stream of each populated text field (defaults to False)
+        flatten: bool, optional
+            Draw the populated fields into the page content of the SARF PDF files (defaults to False)
+        write_threads: int, optional
+            Number of background threads the SARF PDF files are written by (defaults to 0 - written as they are populated)
+        default_template: str, optional
+            File name of the default SARF template (defaults to None - the only PDF file in the SARF template directory)
+        template_cache_size: int, optional
+            Maximum number of SARF templates other than the default one kept compiled (defaults to 4)
+        """
 
-        #Check if SARF path exists and contains only one template file
+        #Check if SARF path exists and contains only SARF template files
         if os.path.exists(sarf_template_path):
-            if len(os.listdir(sarf_template_path)) < 1:
+            template_names = sorted(os.listdir(sarf_template_path))
+            if len(template_names) < 1:
                 raise ValueError(f"No SARF template found in {sarf_template_path}")
-            elif len(os.listdir(sarf_template_path)) > 1:
-                raise ValueError(f"There should only be one SARF template in {sarf_template_path}") 
-            elif not os.listdir(sarf_template_path)[0].endswith('.pdf'):
+            elif not all(template_name.endswith('.pdf') for template_name in template_names):
                 raise ValueError(f"SARF Template must be a .pdf")
         else:
             raise ValueError(f"SARF Template directory '{sarf_template_path}' cannot be found.")
 
-        sarf_file_name = os.listdir(sarf_template_path)[0]
-        self.pdf_filler = PdfFileFiller(sarf_template_path + sarf_file_name)
+        #The default SARF template must be named if there is more than one
+        if default_template is None:
+            if len(template_names) > 1:
+                raise ValueError(f"There are {len(template_names)} SARF templates in {sarf_template_path}, set default_template to the file name of the default one")
+            default_template = template_names[0]
+        elif default_template not in template_names:
+            raise ValueError(f"Default SARF template '{default_template}' cannot be found in {sarf_template_path}")
+        for pattern, template_name in self.workbook_templates.items():
+            if template_name not in template_names:
+                raise ValueError(f"SARF template '{template_name}' of the P&P files matching '{pattern}' cannot be found in {sarf_template_path}")
+
+        from pdf_filler import PdfFileFiller, PdfFileFillerCache
+
+        pdf_filler = PdfFileFiller(sarf_template_path + default_template, self.metrics, compress_output, generate_appearances, flatten, write_threads)
+        if self.pdf_filler is not None:
+            #Stop the background writer threads of the replaced SARF templates
+            self.pdf_filler.close()
+        self.sarf_template_path = sarf_template_path
+        self.template_names = template_names
+        self.default_template = default_template
+        self.pdf_filler = pdf_filler
+        #The other SARF templates share the output options and background writer threads of the default one
+        self.template_cache = PdfFileFillerCache(template_cache_size, self.metrics, compress_output, generate_appearances, flatten, pdf_filler.background_writer)
+
+    def load_data(self, user_data_path, data_sheetname, header_row_num=0, max_workers=1, use_pandas=True):
+        """
+        Reads each Excel file in the User Data file path and maps it to the required SARF fields.
+        Only the user data sheet and the columns used by the SARF fields are read from each file
+
+        Parameters
+        ----------
+        user_data_path: str
+            Path of file directory that contains the completed user data Excel files
+        data_sheetname: str
+            Name of the Excel sheet that contains the user data in each of the Excel files
+        header_row_num: int, optional
+            Row number (0-based) that contains the column headers of the user data (defaults to 0)
+        max_workers: int, optional
+            Number of worker processes used to read the Excel files in parallel (defaults to 1 - read one at a time in this process)
+        use_pandas: bool, optional
+            Read the Excel files with pandas instead of the lightweight reader (defaults to True, the user data is the same - see read_sheet_columns)
+        """
+
+        #Store the user data from each valid Excel file
+        for data_filename, cur_user_data in self.iter_user_data(user_data_path, data_sheetname, header_row_num, max_workers, use_pandas=use_pandas):
+            self.user_data.append(cur_user_data)
 
-    def load_data(self, user_data_path, data_sheetname, header_row_num=0):
+    def iter_user_data(self, user_data_path, data_sheetname, header_row_num=0, max_workers=1, max_in_flight=None, use_pandas=True):
         """
-        Reads each Excel file in the User Data file path and maps it to the required SARF fields
+        Generator that reads each Excel file in the User Data file path and yields its user data mapped to the required SARF fields
 
         Parameters
         ----------
@@ -80,50 +394,34 @@ class SarfAutomator():
             Name of the Excel sheet that contains the user data in each of the Excel files
         header_row_num: int, optional
             Row number (0-based) that contains the column headers of the user data (defaults to 0)
+        max_workers: int, optional
+            Number of worker processes used to read the Excel files in parallel (defaults to 1 - read one at a time in this process)
+        max_in_flight: int, optional
+            Maximum number of Excel files read ahead by the worker processes (defaults to None - all files are read ahead)
+        use_pandas: bool, optional
+            Read the Excel files with pandas instead of the lightweight reader (defaults to True, the user data is the same - see read_sheet_columns)
+
+        Yields
+        ------
+        tuple
+            The file name of the Excel file and the list of dictionaries of the SARF PDF fields of each user
+        """
+
+        return self.iter_workbooks(self.user_data_filenames(user_data_path), data_sheetname, header_row_num, max_workers, max_in_flight, use_pandas)
+
+    def user_data_filenames(self, user_data_path):
+        """
+        Returns the file paths/names of the Excel files (.xls or .xlsx) in the User Data file path
+
+        Parameters
+        ----------
+        user_data_path: str
+            Path of file directory that contains the completed user data Excel files
         """
         
         #List of user data records from each Excel file
         user_data_filenames = []
 
-        #SARF PDF field mappings
-        #Mappings with list values will be concatenated together with each value separated by ', '
-        #Mappings with dictionary values, will map the dict key column by default, but if that value is blank it will map the dict value column instead
-        field_mappings = {
-            '1 Name':['Last Name', 'First Name', 'Middle Name'],
-            '1 Preferred Email':'Email Address\n(state.gov preferred)',
-            '1 Job Title':'Job Title',
-            '1 Employment Type':'Employment Type',
-            '1 Office  Post':'Office',
-            '1 Notes':'Bureau',
-            '1 Timezone':'Time Zone',
-            '1 Existing Okta Account':'Do you have an existing Okta account?  ',
-            '1 DOS email':{"DoS Email Address \n(only if @state.gov wasn't already listed in column E)":'Email Address\n(state.gov preferred)'},
-            '1 no email':"Do you have a DoS Email Address? \n(only if @state.gov wasn't already listed in column E)",
-            '1 mobile device':'Do you have access to a mobile phone in your workplace?',
-            '1 mobile app':'Do you have the ability to download the Okta Verify moble app to a work or personal phone, and use it at your workplace?',
-            '1 CRM User Type':'User Type',
-            '1 Exec Contacts':'Executive Contacts ',
-            '1 Printing':'Event Printing'
-        }
-
-        #SARF PDF Override Value mappings for checkbox and radio button values that require specific values to select the correct option 
-        #and includes a default string value in cases of a blank value in the column
-        value_override_mappings = {
-            '1 Existing Okta Account':{'':'Yes','Yes':'/0', 'No':'/1', "I Don't Know":'/2'},
-            '1 no email':{'':'/No', 'Yes':'/No', 'No':'Yes', '/No':'No'},
-            '1 mobile device':{'': 'Yes', 'Yes':'/Yes', 'No':'/No'},
-            '1 mobile app':{'': 'Yes', 'Yes':'/0', 'No':'/No'},
-            '1 CRM User Type':{'':'CRM User', 'CRM User':'/1#20CRM#20User', 'CRM Mission/Office Admin':'/1#20Admin', 'CRM Contacts Only User':'/1#20Contacts'},
-            '1 Exec Contacts':{'':'No'},
-            '1 Printing':{'':'No'}
-        }
-
-        #SARF PDF field mappings for default string values 
-        default_string_mappings = {
-            '1 Request Type':'New User',
-            '1 Application Access':'CRM Only'
-        }
-        
         #Check if user data path exists
         if not os.path.exists(user_data_path):
             raise ValueError(f"User Data directory '{user_data_path}' cannot be found.")
@@ -136,64 +434,470 @@ class SarfAutomator():
         #Flag if no valid Excel files were found in the directory
         if not user_data_filenames:
             raise ValueError (f"No valid user data files in '{user_data_path}' found. Please make sure files are in .xls or .xlsx format and try again.")
+        return user_data_filenames
+
+    def iter_workbooks(self, user_data_filenames, data_sheetname, header_row_num=0, max_workers=1, max_in_flight=None, use_pandas=True):
+        """
+        Generator that reads each Excel file and yields its user data mapped to the required SARF fields
+
+        Parameters
+        ----------
+        user_data_filenames: list
+            List of the file paths/names of the completed user data Excel files
+        data_sheetname: str
+            Name of the Excel sheet that contains the user data in each of the Excel files
+        header_row_num: int, optional
+            Row number (0-based) that contains the column headers of the user data (defaults to 0)
+        max_workers: int, optional
+            Number of worker processes used to read the Excel files in parallel (defaults to 1 - read one at a time in this process)
+        max_in_flight: int, optional
+            Maximum number of Excel files read ahead by the worker processes (defaults to None - all files are read ahead)
+        use_pandas: bool, optional
+            Read the Excel files with pandas instead of the lightweight reader (defaults to True, the user data is the same - see read_sheet_columns)
+
+        Yields
+        ------
+        tuple
+            The file name of the Excel file and the list of dictionaries of the SARF PDF fields of each user
+        """
+
+        #Columns read from each Excel file (raises a SheetNotFoundError if the user data sheet cannot be found in a file)
+        flag_blank_fields = ['User Type']
+        template_columns = [self.template_column] if self.template_column else []
+        data_columns = self.field_mapper.source_columns + ['First Name', 'Last Name'] + flag_blank_fields + template_columns
+
+        #Only parse the Excel files whose normalized user data is not cached (hashing their contents first, see WorkbookCache.save)
+        content_hashes = {}
+        for data_filename in user_data_filenames:
+            if self.workbook_cache is not None and not self.workbook_cache.contains(data_filename, data_sheetname, header_row_num, data_columns):
+                content_hashes[data_filename] = self.workbook_cache.content_hash(data_filename)
+        parsed_filenames = [data_filename for data_filename in user_data_filenames 
+            if self.workbook_cache is None or data_filename in content_hashes]
+        reader = read_sheet if use_pandas else read_sheet_columns
+        data_sheets = iter(read_sheets(parsed_filenames, data_sheetname, header_row_num, data_columns, max_workers, max_in_flight, reader))
 
-        #Store the user data from each valid Excel file
         for data_filename in user_data_filenames:
-            #Read in the Excel data into a DataFrame
-            user_data = pd.read_excel(data_filename, sheet_name=None, encoding='utf-8-sig', skiprows=header_row_num)
-            
-            #Flag if the user data sheet cannot be found in the Excel file
-            if data_sheetname not in user_data.keys():
-                raise ValueError(f"Sheet name: '{data_sheetname}' could not be found in file: '{data_sheetname}' - please confirm sheet name and try again.")
-
-            #Get the data in the Excel sheet
-            user_data = user_data[data_sheetname]
-            #Exclude the Example row
-            user_data = user_data[user_data['User Number'] != 'Example']
-            #Remove any rows that do not have the First and Last Name columns completed
-            user_data.dropna(subset=['First Name', 'Last Name'], inplace=True)
-            #Convert all values to strings
-            user_data = user_data.fillna('').applymap(lambda x: str(x))
-
-            #Send warning message if any of the values in the specified columns have a blank value
-            flag_blank_fields = ['User Type']
-            for flag_field in flag_blank_fields:
-                flagged_data = user_data[user_data[flag_field] == '']
-                if flagged_data.shape[0] > 0:
-                    print(f"***WARNING: Blank value(s) found in {flag_field} field in {data_filename} - Value(s) will be defaulted.***")
-
-            #Create new DataFrame with SARF PDF field mappings and formatted values
-            formatted_user_data = pd.DataFrame(columns=field_mappings.keys())
-            #Map field mappings
-            for col in formatted_user_data.columns:
-                if isinstance(field_mappings[col], list):
-                    #Map the value of each column separated by ', '
-                    formatted_user_data[col] = user_data[field_mappings[col]].apply(lambda row: ', '.join(row).strip(' ,'), axis=1)
-                elif isinstance(field_mappings[col], dict):
-                    #Map the key value by default, but use the key value if the default column is blank
-                    default_field = list(field_mappings[col].keys())[0]
-                    backup_field = field_mappings[col][default_field]
-                    formatted_user_data[col] = user_data[[default_field, backup_field]].apply(lambda row: row[default_field] if row[default_field] != '' else row[backup_field], axis=1)
+            user_data = None
+            if data_filename not in parsed_filenames:
+                with self.metrics.stage('read_cache', data_filename) as stage:
+                    user_data = self.workbook_cache.load(data_filename, data_sheetname, header_row_num, data_columns)
+                    stage['records'] += len(next(iter(user_data.values()), [])) if user_data is not None else 0
+            if user_data is None:
+                with self.metrics.stage('read_workbook', data_filename) as stage:
+                    if data_filename in parsed_filenames:
+                        user_data = next(data_sheets)
+                    else:
+                        #The cache entry could not be read
+                        user_data = reader(data_filename, data_sheetname, header_row_num, data_columns)
+                    if user_data is None:
+                        #The Excel file cannot be read the same way without pandas
+                        user_data = read_sheet(data_filename, data_sheetname, header_row_num, data_columns)
+                    stage['records'] += len(next(iter(user_data.values()), [])) if isinstance(user_data, dict) else len(user_data)
+
+                with self.metrics.stage('normalize_records', data_filename) as stage:
+                    if self.template_column and self.template_column not in user_data:
+                        #An Excel file without the template column has a blank value in every row (its template is used for every record)
+                        user_data[self.template_column] = [None] * len(user_data['User Number'])
+                    if isinstance(user_data, dict):
+                        #Exclude the Example row and remove any rows that do not have the First and Last Name columns completed
+                        kept_rows = [i for i, (user_number, first_name, last_name) in 
+                            enumerate(zip(user_data['User Number'], user_data['First Name'], user_data['Last Name'])) 
+                            if user_number != 'Example' and first_name is not None and last_name is not None]
+                        #Convert all values of the mapped columns to strings
+                        user_data = {col: string_values([user_data[col][i] for i in kept_rows]) 
+                            for col in dict.fromkeys(self.field_mapper.source_columns + flag_blank_fields + template_columns)}
+                    else:
+                        #Exclude the Example row
+                        user_data = user_data[user_data['User Number'] != 'Example']
+                        #Remove any rows that do not have the First and Last Name columns completed
+                        user_data.dropna(subset=['First Name', 'Last Name'], inplace=True)
+                        #Convert all values of the mapped columns to strings
+                        user_data = string_columns(user_data, self.field_mapper.source_columns + flag_blank_fields + template_columns)
+                    stage['records'] += len(user_data['User Number'])
+                    if self.workbook_cache is not None:
+                        cache_data = user_data if isinstance(user_data, dict) else {col: user_data[col].tolist() for col in user_data.columns}
+                        self.workbook_cache.save(data_filename, data_sheetname, header_row_num, data_columns, cache_data, content_hashes.get(data_filename))
+
+            with self.metrics.stage('map_records', data_filename) as stage:
+                #Send warning message if any of the values in the specified columns have a blank value
+                for flag_field in flag_blank_fields:
+                    if isinstance(user_data, dict):
+                        has_blank_values = '' in user_data[flag_field]
+                    else:
+                        has_blank_values = user_data[user_data[flag_field] == ''].shape[0] > 0
+                    if has_blank_values:
+                        print(f"***WARNING: Blank value(s) found in {flag_field} field in {data_filename} - Value(s) will be defaulted.***")
+
+                #Map the user data to the SARF PDF fields and convert data to dictionary to map to PDF file
+                #(user data read without pandas or from the cache is mapped without pandas, to the same records)
+                if isinstance(user_data, dict):
+                    cur_user_data = self.field_mapper.map_column_records(user_data)
                 else:
-                    formatted_user_data[col] = user_data[field_mappings[col]]
-            formatted_user_data['id'] = user_data['User Number']
-            
-            #Update input values with PDF equivalent values to appear correctly in generated PDF file
-            if value_override_mappings:
-                for field in value_override_mappings:
-                    for value in value_override_mappings[field]:
-                        formatted_user_data[field] = formatted_user_data[field].apply(lambda x: value_override_mappings[field][value] if x.lower()==value.lower() else x)
-            
-            #Map static string value to the specified field of all records in the data set
-            if default_string_mappings:
-                for field in default_string_mappings:
-                    formatted_user_data[field] = default_string_mappings[field]
-
-            #Convert data to dictionary and add to list of all user data to map to PDF file
-            self.user_data.append(formatted_user_data.to_dict(orient='records'))
+                    cur_user_data = self.field_mapper.map_records(user_data)
+                #Select the SARF template of each record (the records are in the same order as the user data rows)
+                self.assign_templates(data_filename, cur_user_data, list(user_data[self.template_column]) if self.template_column else None)
+                stage['records'] += len(cur_user_data)
             print('Done')
+            yield data_filename, cur_user_data
+
+    def workbook_template(self, data_filename):
+        """
+        Returns the file name of the SARF template of an Excel file: the template of the first workbook_templates pattern 
+        the Excel file name matches (case-insensitive), otherwise the default SARF template
+
+        Parameters
+        ----------
+        data_filename: str
+            The file path/name of the Excel file
+        """
+
+        file_name = os.path.basename(data_filename).lower()
+        for pattern, template_name in self.workbook_templates.items():
+            if fnmatch(file_name, pattern.lower()):
+                return template_name
+        return self.default_template
+
+    def template_name(self, template_value, data_filename=None):
+        """
+        Returns the file name of the SARF template selected by a value of the template column (the file name with or without .pdf, case-insensitive)
+
+        Parameters
+        ----------
+        template_value: str
+            Value of the template column of a user record
+        data_filename: str, optional
+            The file path/name of the Excel file of the user record, reported if no SARF template matches the value (defaults to None)
+        """
+
+        value = template_value.strip().lower()
+        for template_name in self.template_names:
+            if value in (template_name.lower(), os.path.splitext(template_name)[0].lower()):
+                return template_name
+        raise ValueError(f"SARF template '{template_value}' in the {self.template_column} column of {data_filename} cannot be found in {self.sarf_template_path}")
+
+    def assign_templates(self, data_filename, cur_user_data, template_values=None):
+        """
+        Selects the SARF template each user record of an Excel file is populated into: the template named in its template column, 
+        otherwise the template of the Excel file (see workbook_template). Records populated into another template than the default one 
+        are tagged with the template file name (SARF_TEMPLATE_KEY), records of the default template are not changed
+
+        Parameters
+        ----------
+        data_filename: str
+            The file path/name of the Excel file
+        cur_user_data: list
+            List of dictionaries of the SARF PDF field names and values of each user
+        template_values: list, optional
+            List of the template column value of each user record (defaults to None - every record uses the template of the Excel file)
+        """
+
+        workbook_template = self.workbook_template(data_filename)
+        for i, user_record in enumerate(cur_user_data):
+            template_name = workbook_template
+            if template_values is not None and template_values[i].strip():
+                template_name = self.template_name(template_values[i], data_filename)
+            if template_name != self.default_template:
+                user_record[SARF_TEMPLATE_KEY] = template_name
+
+    def template_path(self, user_records):
+        """
+        Returns the file path/name of the SARF template of a group of user records (all populated into the same template, see sarf_shards),
+        without compiling it
+
+        Parameters
+        ----------
+        user_records: list
+            List of dictionaries of the SARF PDF field names and values of each user
+        """
+
+        template_name = user_records[0].get(SARF_TEMPLATE_KEY) if user_records else None
+        return self.sarf_template_path + (template_name or self.default_template)
+
+    def template_filler(self, user_records):
+        """
+        Returns the PdfFileFiller of the SARF template of a group of user records (all populated into the same template, see sarf_shards).
+        SARF templates other than the default one are compiled the first time they are used and kept in the template cache
+
+        Parameters
+        ----------
+        user_records: list
+            List of dictionaries of the SARF PDF field names and values of each user
+        """
+
+        pdf_template_file_path = self.template_path(user_records)
+        if pdf_template_file_path == self.pdf_filler.pdf_template_file_path:
+            return self.pdf_filler
+        return self.template_cache.get(pdf_template_file_path)
+
+    def template_fields(self, user_records):
+        """
+        Returns the dictionary of the name and kind of each form field populated on the user page of the SARF template of a group 
+        of user records (see sarf_verifier.compare_to_records)
+
+        Parameters
+        ----------
+        user_records: list
+            List of dictionaries of the SARF PDF field names and values of each user
+        """
+
+        fill_plan = self.template_filler(user_records).compiled_template.fill_plan(SARF_USER_INFO_PAGE_NUM)
+        return {str(field_plan.name): field_plan.kind for field_plan in fill_plan.fields if field_plan.kind is not None}
+
+    def sarf_filename(self, cur_user_data, new_pdf_filename_prefix=None):
+        """
+        Returns the file name of the SARF PDF file of a group of user data
+
+        Parameters
+        ----------
+        cur_user_data: list
+            List of dictionaries containing the user data from an input data source
+        new_pdf_filename_prefix: str, optional
+            The prefix of the new SARF PDF file name (defaults to None)
+        """
+
+        #Set the file name prefix to an empty string if one was not specified 
+        if not new_pdf_filename_prefix:
+            new_pdf_filename_prefix = ''
+        #Create the new file name from the passed prefix value and the Bureau value of the first user data record in the dataset
+        #(followed by the SARF template name if it is not the default one, e.g. CRM_SARF_<Bureau>_<Template>.pdf)
+        template_name = cur_user_data[0].get(SARF_TEMPLATE_KEY)
+        template_suffix = '_' + os.path.splitext(template_name)[0] if template_name else ''
+        return new_pdf_filename_prefix + cur_user_data[0]['1 Notes'] + template_suffix + '.pdf'
+
+    def sarf_shards(self, cur_user_data, new_pdf_filename_prefix=None, shard_size=None):
+        """
+        Returns the file name and user records (sorted by the unique id of the data, e.g. User Number) of each SARF PDF file of a group of user data.
+        The user records of each SARF template are a separate SARF PDF file (the default template first, see sarf_filename).
+        With a shard size, the user records are split into shards of at most shard_size users saved to separate SARF PDF files
+        (e.g. CRM_SARF_<Bureau>_part03.pdf), each with the header pages. Nothing is written, the index of the users in each shard is written 
+        once the shards are (see shard_indexes and write_shard_index)
+
+        Parameters
+        ----------
+        cur_user_data: list
+            List of dictionaries of the SARF PDF field names and values of each user
+        new_pdf_filename_prefix: str, optional
+            The prefix of the new SARF PDF file name (defaults to None)
+        shard_size: int, optional
+            Maximum number of users in each SARF PDF file (defaults to None - a single SARF PDF file)
+
+        Returns
+        -------
+        list
+            List of tuples of the file name and list of user records of each SARF PDF file
+        """
+
+        #Group the user records by SARF template (records of the default template are not tagged, see assign_templates)
+        template_records = {}
+        for user_record in cur_user_data:
+            template_records.setdefault(user_record.get(SARF_TEMPLATE_KEY), []).append(user_record)
+
+        sarf_shards = []
+        for template_name in sorted(template_records, key=lambda name: (name is not None, name or '')):
+            new_sarf_filename = self.sarf_filename(template_records[template_name], new_pdf_filename_prefix)
+            user_records = sorted(template_records[template_name], key=user_number_sort_key)
+            if not shard_size:
+                sarf_shards.append((new_sarf_filename, user_records))
+                continue
+
+            sarf_basename = os.path.splitext(new_sarf_filename)[0]
+            sarf_shards.extend((f'{sarf_basename}_part{shard_num + 1:02d}.pdf', user_records[i:i + shard_size]) 
+                for shard_num, i in enumerate(range(0, len(user_records), shard_size)))
+        return sarf_shards
+
+    def user_data_shards(self, new_pdf_filename_prefix=None, shard_size=None):
+        """
+        Returns the file name and user records of each SARF PDF file of all of the user data (see sarf_shards), ordered by SARF template 
+        (the default template first), so each SARF template is only compiled once even if there are more templates than the template cache holds
+
+        Parameters
+        ----------
+        new_pdf_filename_prefix: str, optional
+            The prefix of the new SARF PDF file names (defaults to None)
+        shard_size: int, optional
+            Maximum number of users in each SARF PDF file (defaults to None - a single SARF PDF file per dataset and template)
+
+        Returns
+        -------
+        list
+            List of tuples of the file name and list of user records of each SARF PDF file
+        """
+
+        sarf_shards = [sarf_shard for cur_user_data in self.user_data 
+            for sarf_shard in self.sarf_shards(cur_user_data, new_pdf_filename_prefix, shard_size)]
+        return sorted(sarf_shards, key=lambda sarf_shard: (SARF_TEMPLATE_KEY in sarf_shard[1][0], sarf_shard[1][0].get(SARF_TEMPLATE_KEY, '')))
+
+    def shard_indexes(self, sarf_shards, new_pdf_filename_prefix=None, shard_size=None):
+        """
+        Returns the shard index of each sharded SARF of a list of shards (see sarf_shards): the file name, first and last User Number 
+        and the User Numbers of each shard
+
+        Parameters
+        ----------
+        sarf_shards: list
+            List of tuples of the file name and list of user records of each shard (see sarf_shards)
+        new_pdf_filename_prefix: str, optional
+            The prefix of the new SARF PDF file names the shards were named with (defaults to None)
+        shard_size: int, optional
+            Maximum number of users in each shard (defaults to None - the SARFs are not sharded, no indexes are returned)
+
+        Returns
+        -------
+        list
+            List of dictionaries of the shard index of each sharded SARF (see write_shard_index)
+        """
+
+        if not shard_size:
+            return []
+        shard_indexes = {}
+        for shard_filename, user_records in sarf_shards:
+            #The shards of a SARF have the file name of the whole SARF (see sarf_filename)
+            new_sarf_filename = self.sarf_filename(user_records, new_pdf_filename_prefix)
+            shard_index = shard_indexes.setdefault(new_sarf_filename, {'sarf': new_sarf_filename, 'shard_size': shard_size, 'users': 0, 'shards': []})
+            user_ids = [user_record['id'] for user_record in user_records]
+            shard_index['users'] += len(user_ids)
+            shard_index['shards'].append({'file': shard_filename, 'first_user': user_ids[0], 'last_user': user_ids[-1], 'users': user_ids})
+        return list(shard_indexes.values())
+
+    def write_shard_index(self, shard_index):
+        """
+        Writes the shard index of a sharded SARF (e.g. CRM_SARF_<Bureau>.shards.json, see shard_indexes). Shard files listed by the previous 
+        index that are no longer needed (e.g. fewer users) are deleted, so the index must only be written once its shards are written
+
+        Parameters
+        ----------
+        shard_index: dict
+            Dictionary of the shard index of the SARF (see shard_indexes)
+        """
+
+        shard_index_path = os.path.splitext(shard_index['sarf'])[0] + '.shards.json'
+        shard_filenames = [shard['file'] for shard in shard_index['shards']]
+
+        #Delete the shards of the previous run that are not part of this run
+        if os.path.exists(shard_index_path):
+            try:
+                with open(shard_index_path, 'r') as shard_index_file:
+                    previous_shards = json.load(shard_index_file)['shards']
+                previous_filenames = [shard['file'] for shard in previous_shards]
+            except (OSError, ValueError, KeyError, TypeError):
+                previous_filenames = []
+            for shard_filename in previous_filenames:
+                if shard_filename not in shard_filenames and os.path.exists(shard_filename):
+                    os.remove(shard_filename)
+
+        with open(shard_index_path + '.tmp', 'w') as shard_index_file:
+            json.dump(shard_index, shard_index_file, indent=2)
+        os.replace(shard_index_path + '.tmp', shard_index_path)
+
+    def sarf_key(self, user_records):
+        """
+        Returns the content key of the inputs of a SARF PDF file: the SARF template of the user records, the field mapping tables, 
+        the mapped user records and the output options (compressed, generated appearances and flattened)
+
+        Parameters
+        ----------
+        user_records: list
+            List of dictionaries of the SARF PDF field names and values of each user (in page order)
+        """
+
+        pdf_filler = self.template_filler(user_records)
+        return content_key(pdf_filler.compiled_template.digest, FIELD_MAPPINGS, VALUE_OVERRIDE_MAPPINGS, DEFAULT_STRING_MAPPINGS, 
+            SARF_USER_INFO_PAGE_NUM, pdf_filler.compress_output, pdf_filler.generate_appearances, pdf_filler.flatten, user_records)
+
+    def is_sarf_current(self, new_sarf_filename, sarf_key, force_rebuild=False):
+        """
+        Returns True (and reports the reuse) if the SARF PDF file was already generated from the same inputs by a previous run
+
+        Parameters
+        ----------
+        new_sarf_filename: str
+            Name of the SARF PDF file
+        sarf_key: str
+            The content key of the inputs of the SARF PDF file (see sarf_key)
+        force_rebuild: bool, optional
+            Always regenerate the SARF PDF file (defaults to False)
+        """
+
+        if self.build_manifest is None or force_rebuild:
+            return False
+        if self.build_manifest.is_current(new_sarf_filename, sarf_key):
+            print(f'Reusing {new_sarf_filename} (user data, SARF template and mappings unchanged)')
+            with self.metrics.stage('reuse', new_sarf_filename):
+                pass
+            return True
+        return False
+
+    def record_sarf(self, new_sarf_filename, sarf_key):
+        """
+        Records the content key of the inputs a SARF PDF file was generated from in the build manifest
+
+        Parameters
+        ----------
+        new_sarf_filename: str
+            Name of the SARF PDF file
+        sarf_key: str
+            The content key of the inputs of the SARF PDF file (see sarf_key)
+        """
+
+        if self.build_manifest is not None:
+            self.build_manifest.record(new_sarf_filename, sarf_key)
+
+    def update_sarf(self, new_sarf_filename, user_records, on_written=None):
+        """
+        Incrementally update a merged SARF PDF file. A sidecar index (see PageIndex) keeps the fingerprint and page number of each user 
+        and the populated page of each user from the previous run. Only added or changed users are populated again, the pages of unchanged users 
+        and the header pages are copied into the new SARF PDF file without being populated again
 
-    def run(self, new_pdf_filename_prefix=None):
+        Parameters
+        ----------
+        new_sarf_filename: str
+            Name of the SARF PDF file to create or update
+        user_records: list
+            List of dictionaries of the SARF PDF field names and values of each user (in page order)
+        on_written: callable, optional
+            Function called without arguments once the SARF PDF file is written (defaults to None, see PdfFileFiller.write_pdf)
+        """
+
+        pdf_filler = self.template_filler(user_records)
+        page_index = PageIndex(new_sarf_filename, content_key(pdf_filler.compiled_template.digest, SARF_USER_INFO_PAGE_NUM, 
+            pdf_filler.generate_appearances, pdf_filler.flatten))
+        fingerprints = [content_key(user_record) for user_record in user_records]
+
+        #Reuse the page of each unchanged user and populate a page for each added or changed user
+        sarf_parts = []
+        rendered_users = 0
+        for user_record, fingerprint in zip(user_records, fingerprints):
+            sarf_part = page_index.pages.get(fingerprint)
+            if sarf_part is None:
+                sarf_part = pdf_filler.create_pdf_part([user_record], SARF_USER_INFO_PAGE_NUM)
+                rendered_users += 1
+            sarf_parts.append(sarf_part)
+
+        self.metrics.advance(len(user_records) - rendered_users)
+        pdf_filler.merge_pdf_parts(sarf_parts, new_sarf_filename, header_pages=SARF_USER_INFO_PAGE_NUM, on_written=on_written)
+
+        #Report the users added, changed and removed since the previous run (by their unique id, e.g. User Number)
+        previous_ids = set(record['id'] for record in page_index.records)
+        user_ids = [user_record['id'] for user_record in user_records]
+        added_users = len(set(user_ids) - previous_ids)
+        removed_users = len(previous_ids - set(user_ids))
+        page_index.update(user_ids, fingerprints, sarf_parts, SARF_USER_INFO_PAGE_NUM)
+        print(f'Updated {new_sarf_filename}: {added_users} added, {rendered_users - added_users} changed, {removed_users} removed, '
+            f'{len(user_records) - rendered_users} unchanged users')
+
+    def wait_for_writes_after_error(self):
+        """
+        Waits for the SARF PDF files still queued to the background writer threads while an error is stopping the run. An error of 
+        a background write is printed instead of raised, so it does not replace the error that stopped the run
+        """
+
+        try:
+            self.pdf_filler.wait_for_writes()
+        except Exception as write_error:
+            print(f'***ERROR: SARF could not be written - {write_error}***')
+
+    def run(self, new_pdf_filename_prefix=None, merge_in_memory=False, max_workers=1, records_per_task=500, force_rebuild=False, incremental=False, 
+        shard_size=None, worker_pool=None):
         """
         Execute the process of taking all user data information and generate a separate, completed SARF PDF file for each Excel data source
 
@@ -201,43 +905,288 @@ class SarfAutomator():
         ----------
         new_pdf_filename_prefix: str, optional
             The prefix of the new SARF PDF file name (defaults to None)
+        merge_in_memory: bool, optional
+            Add each populated user page directly to the merged SARF PDF file instead of creating a PDF file
+            for each user in a temporary directory and merging them afterwards (defaults to False)
+        max_workers: int, optional
+            Number of worker processes used to generate the SARF PDF files (defaults to 1 - no worker processes).
+            With more than 1, the SARFs are populated in memory by a process pool (see run_parallel)
+        records_per_task: int, optional
+            Maximum number of user records populated by a single worker process task (defaults to 500)
+        force_rebuild: bool, optional
+            Regenerate every SARF PDF file, even if the build manifest shows its inputs have not changed (defaults to False)
+        incremental: bool, optional
+            Only populate the pages of added or changed users and reuse the pages of the previous run for the rest (see update_sarf).
+            Incremental updates run in this process (defaults to False)
+        shard_size: int, optional
+            Split the SARF of each dataset into SARF PDF files of at most this many users (see sarf_shards). With more than 1 worker process
+            the shards are written concurrently (defaults to None - a single SARF PDF file per dataset)
+        worker_pool: ProcessPoolExecutor, optional
+            A pool of SARF worker processes kept running between runs, used with more than 1 worker process (see run_parallel, defaults to None)
         """
+
+        if max_workers > 1 and not incremental:
+            self.run_parallel(new_pdf_filename_prefix, max_workers, records_per_task, force_rebuild, shard_size, worker_pool)
+            return
         
-        #Go through each group of user data and generate a completed SARF PDF file for each dataset
-        for cur_user_data in self.user_data:
-            #Set the file name prefix to an empty string if one was not specified 
-            if not new_pdf_filename_prefix:
-                new_pdf_filename_prefix = ''
-            #Create the new file name from the passed prefix value and the Bureau value of the first user data record in the dataset
-            new_sarf_filename = new_pdf_filename_prefix + cur_user_data[0]['1 Notes'] + '.pdf'
+        #Report the throughput and estimated time remaining of all user records
+        self.metrics.start_progress(sum(len(cur_user_data) for cur_user_data in self.user_data))
+
+        sarf_shards = self.user_data_shards(new_pdf_filename_prefix, shard_size)
+        try:
+            #Go through each group of user data and generate a completed SARF PDF file (or one per shard) for each dataset and SARF template
+            #(the user records are sorted by the unique id of the data, e.g. User Number)
+            for new_sarf_filename, user_records in sarf_shards:
+                sarf_key = self.sarf_key(user_records)
+                if self.is_sarf_current(new_sarf_filename, sarf_key, force_rebuild):
+                    self.metrics.advance(len(user_records))
+                    continue
+
+                print(f'Creating {new_sarf_filename}...')
+                #Record the SARF in the build manifest once it is written (possibly by a background writer thread)
+                on_written = partial(self.record_sarf, new_sarf_filename, sarf_key)
+                if incremental:
+                    self.update_sarf(new_sarf_filename, user_records, on_written)
+                    continue
+                pdf_filler = self.template_filler(user_records)
+                if merge_in_memory:
+                    #Populate a page for each user record into a single PDF file
+                    pdf_filler.merge_pdf_form_values(new_sarf_filename, user_records, SARF_USER_INFO_PAGE_NUM, header_pages=SARF_USER_INFO_PAGE_NUM, 
+                        on_written=on_written)
+                    continue
+
+                #Create a temporary directory for the current dataset
+                new_sarf_temp_directory = new_sarf_filename.replace('.pdf', '_temp')
+                if not os.path.exists(new_sarf_temp_directory):
+                    os.mkdir(new_sarf_temp_directory)
+                
+                #For each user data record in the current dataset, create a new SARF PDF file with the populated field values into the temp directory
+                for user_record in user_records:
+                    pdf_filler.update_pdf_form_values(new_sarf_temp_directory + '/' + new_sarf_filename , user_record, SARF_USER_INFO_PAGE_NUM)
+                pdf_filler.wait_for_writes()
+
+                #Merge all individual user record PDF files generated into a single PDF file
+                files = []
+                for file in os.listdir(new_sarf_temp_directory):
+                    if file.endswith('.pdf'):
+                        files.append(new_sarf_temp_directory + '/' + file)
+                #Sort files by the unique id of the data (e.g. User Number)
+                files = sorted(files, key=lambda x: int(x.split('.')[0].split('_')[-1]))
+                #Merge the PDFs (the user record PDF files are read until the merged PDF file is written)
+                pdf_filler.merge_pdfs(files, new_sarf_filename, header_pages=SARF_USER_INFO_PAGE_NUM, on_written=on_written)
+                pdf_filler.wait_for_writes()
+                #Delete the temporary directory and all files within it
+                shutil.rmtree(new_sarf_temp_directory)
+            #Finish writing the SARFs still queued to the background writer threads (raises the first write error)
+            self.pdf_filler.wait_for_writes()
+        except BaseException:
+            self.wait_for_writes_after_error()
+            raise
+
+        #Index the shards of each SARF once every shard is written (a failed run keeps the shards and index of the previous run)
+        for shard_index in self.shard_indexes(sarf_shards, new_pdf_filename_prefix, shard_size):
+            self.write_shard_index(shard_index)
+
+    def run_streaming(self, user_data_path, data_sheetname, header_row_num=0, new_pdf_filename_prefix=None, max_workers=1, max_in_flight=2, force_rebuild=False, 
+        incremental=False, shard_size=None, use_pandas=True):
+        """
+        Read, map and generate the completed SARF PDF file of each Excel file in the User Data file path one at a time, so
+        only the user data of the Excel files in flight is held in memory and each SARF is written while the next files are still read.
+        The user data is not stored in user_data
+
+        Parameters
+        ----------
+        user_data_path: str
+            Path of file directory that contains the completed user data Excel files
+        data_sheetname: str
+            Name of the Excel sheet that contains the user data in each of the Excel files
+        header_row_num: int, optional
+            Row number (0-based) that contains the column headers of the user data (defaults to 0)
+        new_pdf_filename_prefix: str, optional
+            The prefix of the new SARF PDF file name (defaults to None)
+        max_workers: int, optional
+            Number of worker processes used to read the Excel files ahead of the SARF being generated (defaults to 1 - no worker processes)
+        max_in_flight: int, optional
+            Maximum number of Excel files read or generated at a time (defaults to 2)
+        force_rebuild: bool, optional
+            Regenerate every SARF PDF file, even if the build manifest shows its inputs have not changed (defaults to False)
+        incremental: bool, optional
+            Only populate the pages of added or changed users and reuse the pages of the previous run for the rest (see update_sarf, defaults to False)
+        shard_size: int, optional
+            Split the SARF of each dataset into SARF PDF files of at most this many users (see sarf_shards, defaults to None - a single SARF PDF file per dataset)
+        use_pandas: bool, optional
+            Read the Excel files with pandas instead of the lightweight reader (defaults to True, the user data is the same - see read_sheet_columns)
+        """
 
+        #Report the throughput of the user records (the total number of records is unknown until every file is read)
+        self.metrics.start_progress()
 
+        #Shard index of each sharded SARF, written once every shard is written (only the User Numbers are kept, not the user records)
+        shard_indexes = []
+        try:
+            for data_filename, cur_user_data in self.iter_user_data(user_data_path, data_sheetname, header_row_num, max_workers, max_in_flight, use_pandas):
+                #Populate a page for each user record (sorted by the unique id of the data, e.g. User Number) into a single PDF file (or one per shard)
+                sarf_shards = self.sarf_shards(cur_user_data, new_pdf_filename_prefix, shard_size)
+                shard_indexes.extend(self.shard_indexes(sarf_shards, new_pdf_filename_prefix, shard_size))
+                for new_sarf_filename, user_records in sarf_shards:
+                    sarf_key = self.sarf_key(user_records)
+                    if self.is_sarf_current(new_sarf_filename, sarf_key, force_rebuild):
+                        self.metrics.advance(len(user_records))
+                        continue
+                    print(f'Creating {new_sarf_filename}...')
+                    on_written = partial(self.record_sarf, new_sarf_filename, sarf_key)
+                    if incremental:
+                        self.update_sarf(new_sarf_filename, user_records, on_written)
+                    else:
+                        self.template_filler(user_records).merge_pdf_form_values(new_sarf_filename, user_records, SARF_USER_INFO_PAGE_NUM, 
+                            header_pages=SARF_USER_INFO_PAGE_NUM, on_written=on_written)
+            self.pdf_filler.wait_for_writes()
+        except BaseException:
+            self.wait_for_writes_after_error()
+            raise
+
+        for shard_index in shard_indexes:
+            self.write_shard_index(shard_index)
+
+    def verify_sarfs(self, new_pdf_filename_prefix=None, max_workers=1, shard_size=None):
+        """
+        Compares the populated form fields of each user in the SARF PDF files of the user data with the user records and prints 
+        the differences of each user (see sarf_verifier.compare_to_records)
+
+        Parameters
+        ----------
+        new_pdf_filename_prefix: str, optional
+            The prefix of the SARF PDF file names (defaults to None)
+        max_workers: int, optional
+            Number of worker processes used to verify the SARF PDF files in parallel (defaults to 1 - verified one at a time in this process)
+        shard_size: int, optional
+            Maximum number of users in each SARF PDF file the SARFs were generated with (see sarf_shards, defaults to None - a single SARF PDF file per dataset)
+
+        Returns
+        -------
+        dict
+            Dictionary of the file name of each SARF PDF file and the list of its differences
+        """
+
+        from sarf_verifier import print_differences, verify_sarfs
+
+        if self.pdf_filler.flatten:
+            raise ValueError('Flattened SARFs have no form fields to verify.')
+        comparisons = [(new_sarf_filename, user_records, self.template_fields(user_records)) 
+            for new_sarf_filename, user_records in self.user_data_shards(new_pdf_filename_prefix, shard_size)]
+        with self.metrics.stage('verify', None, sum(len(user_records) for new_sarf_filename, user_records, template_fields in comparisons)):
+            sarf_differences = verify_sarfs(comparisons, max_workers)
+        print_differences(sarf_differences)
+        return sarf_differences
+
+    def create_worker_pool(self, max_workers=None):
+        """
+        Returns a new pool of SARF worker processes, each with its own compiled copy of the default SARF template and its own cache of the others
+        (see init_sarf_worker)
+
+        Parameters
+        ----------
+        max_workers: int, optional
+            Number of worker processes (defaults to None - the number of processors on the machine)
+        """
+
+        return ProcessPoolExecutor(max_workers=max_workers, initializer=init_sarf_worker, initargs=(self.pdf_filler.pdf_template_file_path, 
+            self.pdf_filler.compress_output, self.pdf_filler.generate_appearances, self.pdf_filler.flatten, self.template_cache.max_size))
+
+    def run_parallel(self, new_pdf_filename_prefix=None, max_workers=None, records_per_task=500, force_rebuild=False, shard_size=None, worker_pool=None):
+        """
+        Generate the completed SARF PDF files with a pool of worker processes, each with its own compiled copy of the SARF template.
+        Each dataset is a separate task, and datasets with more than records_per_task user records are split into parts populated 
+        by separate tasks and merged in User Number order by this process afterwards (without parsing the populated pages again).
+        The shards of a dataset (see sarf_shards) are separate SARF PDF files, so they are populated and written concurrently
+
+        Parameters
+        ----------
+        new_pdf_filename_prefix: str, optional
+            The prefix of the new SARF PDF file name (defaults to None)
+        max_workers: int, optional
+            Number of worker processes (defaults to None - the number of processors on the machine)
+        records_per_task: int, optional
+            Maximum number of user records populated by a single task (defaults to 500)
+        force_rebuild: bool, optional
+            Regenerate every SARF PDF file, even if the build manifest shows its inputs have not changed (defaults to False)
+        shard_size: int, optional
+            Split the SARF of each dataset into SARF PDF files of at most this many users (see sarf_shards, defaults to None - a single SARF PDF file per dataset)
+        worker_pool: ProcessPoolExecutor, optional
+            A pool of SARF worker processes kept running between runs (see create_worker_pool), so the worker processes do not 
+            compile the SARF template again (defaults to None - a new pool of max_workers processes is created and shut down for this run)
+        """
+
+        #Report the throughput and estimated time remaining of all user records
+        self.metrics.start_progress(sum(len(cur_user_data) for cur_user_data in self.user_data))
+
+        #Split the user records of each dataset (sorted by the unique id of the data, e.g. User Number) into tasks
+        sarf_tasks = []
+        #PdfFileFiller of the SARF template of each SARF merged from parts, kept for the merge even if it is evicted from the template cache
+        #(taken right after sarf_key compiled the template, so no template is compiled twice)
+        merge_fillers = {}
+        sarf_shards = self.user_data_shards(new_pdf_filename_prefix, shard_size)
+        for new_sarf_filename, user_records in sarf_shards:
+            sarf_key = self.sarf_key(user_records)
+            if self.is_sarf_current(new_sarf_filename, sarf_key, force_rebuild):
+                self.metrics.advance(len(user_records))
+                continue
+            record_chunks = [user_records[i:i + records_per_task] for i in range(0, len(user_records), records_per_task)]
+            #The worker processes compile the SARF template themselves, only its path is sent
+            pdf_template_file_path = self.template_path(user_records)
+            if len(record_chunks) > 1 and pdf_template_file_path not in merge_fillers:
+                merge_fillers[pdf_template_file_path] = self.template_filler(user_records)
+            sarf_tasks.append((new_sarf_filename, sarf_key, record_chunks, pdf_template_file_path))
+
+        #Populate the SARFs in this process if there is nothing to run in parallel
+        if len(sarf_tasks) == 1 and len(sarf_tasks[0][2]) == 1:
+            new_sarf_filename, sarf_key, record_chunks, pdf_template_file_path = sarf_tasks[0]
             print(f'Creating {new_sarf_filename}...')
-            #Create a temporary directory for the current dataset
-            new_sarf_temp_directory = new_sarf_filename.replace('.pdf', '_temp')
-            if not os.path.exists(new_sarf_temp_directory):
-                os.mkdir(new_sarf_temp_directory)
-            
-            #For each user data record in the current dataset, create a new SARF PDF file with the populated field values into the temp directory
-            for user_record in cur_user_data:
-                #The page number the SARF user data section resides (0 based)
-                sarf_user_info_page_num = 2
-                self.pdf_filler.update_pdf_form_values(new_sarf_temp_directory + '/' + new_sarf_filename , user_record, sarf_user_info_page_num)
-
-            #Merge all individual user record PDF files generated into a single PDF file
-            files = []
-            for file in os.listdir(new_sarf_temp_directory):
-                if file.endswith('.pdf'):
-                    files.append(new_sarf_temp_directory + '/' + file)
-            #Sort files by the unique id of the data (e.g. User Number)
-            files = sorted(files, key=lambda x: int(x.split('.')[0].split('_')[-1]))
-            #Merge the PDFs
-            self.pdf_filler.merge_pdfs(files, new_sarf_filename, header_pages=sarf_user_info_page_num)
-            #Delete the temporary directory and all files within it
-            shutil.rmtree(new_sarf_temp_directory)
+            pdf_filler = self.template_filler(record_chunks[0])
+            pdf_filler.merge_pdf_form_values(new_sarf_filename, record_chunks[0], SARF_USER_INFO_PAGE_NUM, header_pages=SARF_USER_INFO_PAGE_NUM, 
+                on_written=partial(self.record_sarf, new_sarf_filename, sarf_key))
+            pdf_filler.wait_for_writes()
+        elif sarf_tasks:
+            executor = worker_pool or self.create_worker_pool(max_workers)
+            try:
+                part_futures = []
+                for new_sarf_filename, sarf_key, record_chunks, pdf_template_file_path in sarf_tasks:
+                    print(f'Creating {new_sarf_filename}...')
+                    if len(record_chunks) == 1:
+                        #Create the SARF PDF file in a single task
+                        futures = [executor.submit(render_sarf, new_sarf_filename, record_chunks[0], SARF_USER_INFO_PAGE_NUM, pdf_template_file_path)]
+                    else:
+                        #Create each part of the SARF PDF file in memory
+                        futures = [executor.submit(render_sarf, None, record_chunk, 0, pdf_template_file_path) for record_chunk in record_chunks]
+                    part_futures.append((new_sarf_filename, sarf_key, futures))
+
+                #Merge the parts of each SARF PDF file in order once they are complete (raises any error that occurred in a worker process)
+                for (new_sarf_filename, sarf_key, futures), (_, _, record_chunks, pdf_template_file_path) in zip(part_futures, sarf_tasks):
+                    sarf_parts = []
+                    for future, record_chunk in zip(futures, record_chunks):
+                        #Time spent waiting for the worker processes
+                        with self.metrics.stage('render_parallel', new_sarf_filename, len(record_chunk)):
+                            sarf_parts.append(future.result())
+                        self.metrics.advance(len(record_chunk))
+                    if len(futures) > 1:
+                        #The merged SARF is written while the parts of the next SARF are still being populated
+                        merge_fillers[pdf_template_file_path].merge_pdf_parts(sarf_parts, new_sarf_filename, header_pages=SARF_USER_INFO_PAGE_NUM, 
+                            on_written=partial(self.record_sarf, new_sarf_filename, sarf_key))
+                    else:
+                        self.record_sarf(new_sarf_filename, sarf_key)
+                self.pdf_filler.wait_for_writes()
+            except BaseException:
+                self.wait_for_writes_after_error()
+                raise
+            finally:
+                if worker_pool is None:
+                    executor.shutdown()
+
+        #Index the shards of each SARF once every shard is written (a failed run keeps the shards and index of the previous run)
+        for shard_index in self.shard_indexes(sarf_shards, new_pdf_filename_prefix, shard_size):
+            self.write_shard_index(shard_index)
 
 
 if __name__ == "__main__":
     main()
     sys.exit()
-        
@@ -0,0 +1,483 @@
+from pdf_filler import TEXT_FIELD, CHECKBOX_FIELD, RADIO_BUTTON_FIELD, PdfFileReader2, checkbox_state, radio_button_state
+from PyPDF2.generic import BooleanObject, FloatObject, IndirectObject, NullObject, createStringObject
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import os
+import re
+import sys
+
+#Separator of the form field name and the unique id of the user record in the field names of a merged SARF (see FillPlan.fill)
+UNIQUE_ID_SEPARATOR = '###'
+
+#A reference to an indirect object of a PDF file (see SarfObjectReader)
+PdfReference = namedtuple('PdfReference', ['idnum', 'generation'])
+#Entries of the annotations and form fields read to verify their values
+FIELD_KEYS = frozenset(['/Parent', '/T', '/FT', '/Kids', '/V', '/AS'])
+
+#Token of the layout PdfFileWriter2 writes every object of a SARF in (PyPDF2's writeToStream, see SarfObjectReader), after any line 
+#breaks or spaces: 1-2 a reference, 3 the start or 4 the end of a dictionary or array, 5 the contents of a literal string (every byte 
+#other than a letter, digit or space is a 3 digit octal escape), 6 a hex string, 7 a name, 8 a number or keyword
+PDF_TOKEN = re.compile(rb"""[\n\x20]*(?:
+    (\d+)\x20(\d+)\x20R(?![^\x00\t\n\x0c\r\x20/%()<>\[\]{}])
+    |(<<|\[)
+    |(>>|\])
+    |\(((?:[^()\\]|\\[0-7]{3})*)\)
+    |<([0-9a-f]*)>
+    |(/[^\x00\t\n\x0c\r\x20/%()<>\[\]{}]*)
+    |(-?[0-9]+(?:\.[0-9]*)?|true|false|null)(?![^\x00\t\n\x0c\r\x20/%()<>\[\]{}]))""", re.X)
+PDF_OCTAL_ESCAPE = re.compile(rb'\\([0-7]{3})')
+PDF_KEYWORDS = {b'true': True, b'false': False, b'null': None}
+#Strings that are decoded the same as ASCII (PDFDocEncoding only differs outside of the printable characters)
+PDF_ASCII_STRING = re.compile(rb'[\x20-\x7e]*$')
+
+def _octal_byte(match):
+    #Returns the byte of an octal escape of a literal string
+    return bytes([int(match.group(1), 8) & 0xFF])
+
+def _decode_string(string):
+    #Returns the text of the bytes of a string, decoded the way PyPDF2 decodes them (see createStringObject)
+    if PDF_ASCII_STRING.match(string):
+        return string.decode('ascii')
+    return str(createStringObject(string))
+
+def _skip_pdf_object(data, offset):
+    #Returns the offset after the PDF object at the offset of the data, without converting its values (see parse_pdf_object)
+    depth = 0
+    while True:
+        match = PDF_TOKEN.match(data, offset)
+        if match is None:
+            raise ValueError(f'unsupported PDF object at offset {offset}')
+        offset = match.end()
+        if match.lastindex == 3:
+            depth += 1
+        elif match.lastindex == 4:
+            depth -= 1
+        if depth <= 0:
+            if depth < 0:
+                raise ValueError(f'unexpected {match.group(4)!r} at offset {match.start(4)}')
+            return offset
+
+def parse_pdf_object(data, offset, keys=None):
+    """
+    Parses a PDF object (without its stream data) written in the layout of PdfFileWriter2 and returns it as a plain Python value 
+    with the offset after it (see SarfObjectReader). Strings are decoded the way PyPDF2 decodes them.
+    Raises ValueError if the object is not in that layout (e.g. it has comments or other escapes than octal ones)
+
+    Parameters
+    ----------
+    data: bytes
+        The raw data of the PDF file or object stream
+    offset: int
+        The offset of the object in the data
+    keys: frozenset, optional
+        The keys of the entries to read if the object is a dictionary, the values of the other entries are skipped 
+        (defaults to None - the whole object is read)
+    """
+
+    #The open dictionaries and arrays, with the key of the next value of each dictionary
+    containers = []
+    while True:
+        match = PDF_TOKEN.match(data, offset)
+        if match is None:
+            raise ValueError(f'unsupported PDF object at offset {offset}')
+        offset = match.end()
+        token_type = match.lastindex
+        if token_type == 2:
+            value = PdfReference(int(match.group(1)), int(match.group(2)))
+        elif token_type == 3:
+            containers.append([{} if match.group(3) == b'<<' else [], None])
+            continue
+        elif token_type == 4:
+            if not containers or isinstance(containers[-1][0], dict) != (match.group(4) == b'>>') or containers[-1][1] is not None:
+                raise ValueError(f'unexpected {match.group(4)!r} at offset {match.start(4)}')
+            value = containers.pop()[0]
+        elif token_type == 5:
+            value = _decode_string(PDF_OCTAL_ESCAPE.sub(_octal_byte, match.group(5)))
+        elif token_type == 6:
+            value = _decode_string(bytes.fromhex(match.group(6).decode('ascii')))
+        elif token_type == 7:
+            value = match.group(7).decode('utf-8')
+        elif match.group(8) in PDF_KEYWORDS:
+            value = PDF_KEYWORDS[match.group(8)]
+        elif b'.' in match.group(8):
+            value = float(match.group(8))
+        else:
+            value = int(match.group(8))
+
+        if not containers:
+            return value, offset
+        container = containers[-1]
+        if isinstance(container[0], list):
+            container[0].append(value)
+        elif container[1] is None:
+            if token_type != 7:
+                raise ValueError(f'invalid PDF dictionary key at offset {match.start()}')
+            if keys is not None and len(containers) == 1 and value not in keys:
+                offset = _skip_pdf_object(data, offset)
+            else:
+                container[1] = value
+        else:
+            container[0][container[1]] = value
+            container[1] = None
+
+def pdf_value(obj):
+    """
+    Returns a PyPDF2 object as a plain Python value (see SarfObjectReader)
+
+    Parameters
+    ----------
+    obj: PdfObject
+        The PyPDF2 object (references are not resolved)
+    """
+
+    if isinstance(obj, IndirectObject):
+        return PdfReference(obj.idnum, obj.generation)
+    if isinstance(obj, dict):
+        return {str(key): pdf_value(value) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [pdf_value(value) for value in obj]
+    if isinstance(obj, (bool, int, float)) or obj is None:
+        return obj
+    if isinstance(obj, FloatObject):
+        return float(obj)
+    if isinstance(obj, BooleanObject):
+        return obj.value
+    if isinstance(obj, NullObject):
+        return None
+    return str(obj)
+
+class SarfObjectReader():
+    """
+    Reads the form field and page objects of a SARF PDF file with a minimal parser of the layout PdfFileWriter2 writes every object in 
+    (see parse_pdf_object), which is much faster than parsing every object with PyPDF2 (PdfFileReader2 is only used for the 
+    cross-reference table, the trailer and the object streams). Objects are read as plain Python values: dict, list, str (names and strings), 
+    int, float, bool, None and PdfReference. Objects in any other layout (e.g. a SARF saved again by a PDF viewer) are read with PyPDF2 instead
+
+    Attributes
+    ----------
+    reader: PdfFileReader2
+        The PDF file reader
+    """
+
+    def __init__(self, pdf_file_path):
+        """
+        Parameters
+        ----------
+        pdf_file_path: str
+            The file path/name of the PDF file
+        """
+
+        self.reader = PdfFileReader2(pdf_file_path, strict=False)
+        self._objects = {}
+
+    def get(self, reference, keys=None):
+        """
+        Returns an object of the PDF file (cached)
+
+        Parameters
+        ----------
+        reference: PdfReference
+            The reference of the object
+        keys: frozenset, optional
+            The keys of the entries to read if the object is a dictionary (defaults to None - the whole object is read)
+        """
+
+        obj = self._objects.get((reference, keys))
+        if obj is None:
+            source = self.reader.object_data(reference.idnum, reference.generation)
+            try:
+                if source is None:
+                    raise ValueError('object data not available')
+                obj = parse_pdf_object(*source, keys)[0]
+            except ValueError:
+                obj = pdf_value(self.reader.getObject(IndirectObject(reference.idnum, reference.generation, self.reader)))
+            if keys is not None and isinstance(obj, dict):
+                obj = {key: value for key, value in obj.items() if key in keys}
+            self._objects[(reference, keys)] = obj
+        return obj
+
+    def resolve(self, value, keys=None):
+        """
+        Returns a value, or the object it references if it is a PdfReference
+
+        Parameters
+        ----------
+        value:
+            The value (e.g. of a dictionary entry)
+        keys: frozenset, optional
+            The keys of the entries to read if the object is a dictionary (defaults to None - the whole object is read)
+        """
+
+        if isinstance(value, PdfReference):
+            return self.get(value, keys)
+        if keys is not None and isinstance(value, dict):
+            return {key: entry for key, entry in value.items() if key in keys}
+        return value
+
+    def pages(self):
+        """
+        Returns the page dictionaries of the PDF file in page order
+        """
+
+        pages = []
+        #Depth-first walk of the page tree (kids are pushed in reverse order)
+        nodes = [pdf_value(self.reader.trailer['/Root'].raw_get('/Pages'))]
+        visited = set()
+        while nodes:
+            node_ref = nodes.pop()
+            if isinstance(node_ref, PdfReference):
+                if node_ref in visited:
+                    continue
+                visited.add(node_ref)
+            node = self.resolve(node_ref)
+            if not isinstance(node, dict):
+                continue
+            if node.get('/Type') == '/Pages' or '/Kids' in node:
+                nodes.extend(reversed(self.resolve(node.get('/Kids', []))))
+            else:
+                pages.append(node)
+        return pages
+
+def read_sarf_fields(pdf_file_path):
+    """
+    Reads the populated form fields of each user in a merged SARF PDF file, in a single pass over the annotations of its pages.
+    Only the form fields renamed with the unique id of a user record (e.g. '1 Job Title###1001') are read
+
+    Parameters
+    ----------
+    pdf_file_path: str
+        The file path/name of the SARF PDF file
+
+    Returns
+    -------
+    dict
+        Dictionary of the unique id of each user and the dictionary of the name of each of its form fields and the
+        (kind, value, state) of the field: the kind of field (TEXT_FIELD, CHECKBOX_FIELD, RADIO_BUTTON_FIELD or None),
+        and the /V and /AS values of the field as strings (None if not set)
+    """
+
+    reader = SarfObjectReader(pdf_file_path)
+    sarf_fields = {}
+    #Radio button fields already read from another of their kids
+    read_parents = set()
+    for page in reader.pages():
+        for annotation_ref in reader.resolve(page.get('/Annots', [])):
+            annotation = reader.resolve(annotation_ref, FIELD_KEYS)
+            if not isinstance(annotation, dict):
+                continue
+            if '/Parent' in annotation:
+                parent_ref = annotation['/Parent']
+                if isinstance(parent_ref, PdfReference):
+                    if parent_ref in read_parents:
+                        continue
+                    read_parents.add(parent_ref)
+                field = reader.resolve(parent_ref, FIELD_KEYS)
+            elif '/T' in annotation:
+                field = annotation
+            else:
+                continue
+
+            field_name, separator, unique_id = str(reader.resolve(field.get('/T', ''))).rpartition(UNIQUE_ID_SEPARATOR)
+            if not separator:
+                continue
+            field_type = reader.resolve(field.get('/FT'))
+            if field_type == '/Tx':
+                kind = TEXT_FIELD
+            elif field_type == '/Btn':
+                kind = RADIO_BUTTON_FIELD if '/Kids' in field else CHECKBOX_FIELD
+            else:
+                kind = None
+            value = reader.resolve(field.get('/V'))
+            state = reader.resolve(field.get('/AS'))
+            sarf_fields.setdefault(unique_id, {})[field_name] = (kind, None if value is None else str(value), None if state is None else str(state))
+    return sarf_fields
+
+def expected_field_state(kind, value):
+    """
+    Returns the (value, state) a form field is populated with from a user record value (see FillPlan.fill)
+
+    Parameters
+    ----------
+    kind: str
+        The kind of form field (TEXT_FIELD, CHECKBOX_FIELD or RADIO_BUTTON_FIELD)
+    value: str
+        The value of the field in the user record
+    """
+
+    if kind == CHECKBOX_FIELD:
+        state = str(checkbox_state(value))
+        return state, state
+    if kind == RADIO_BUTTON_FIELD:
+        state = str(radio_button_state(value))
+        return state, state
+    return value, None
+
+def compare_to_records(pdf_file_path, user_records, template_fields=None):
+    """
+    Compares the populated form fields of each user in a merged SARF PDF file with the user records it was generated from.
+    Only the fields of the records that are populated form fields of the SARF template are compared (other fields are never populated),
+    a field missing from the page of a user is a difference
+
+    Parameters
+    ----------
+    pdf_file_path: str
+        The file path/name of the SARF PDF file
+    user_records: list
+        List of dictionaries of the SARF PDF field names and values of each user (requires having a unique 'id' field)
+    template_fields: dict, optional
+        Dictionary of the name and kind of each populated form field of the SARF template page (see SarfAutomator.template_fields).
+        Defaults to None - the populated form fields found on the page of any user of the SARF
+
+    Returns
+    -------
+    list
+        List of dictionaries of the id, field name, expected and actual (value, state) of each difference, in user record order.
+        A missing or unexpected user has a field name of None, a missing field has an actual value of None
+    """
+
+    sarf_fields = read_sarf_fields(pdf_file_path)
+    if template_fields is None:
+        template_fields = {}
+        for user_fields in sarf_fields.values():
+            for field_name, (kind, value, state) in user_fields.items():
+                if kind is not None:
+                    template_fields.setdefault(field_name, kind)
+
+    differences = []
+    for user_record in user_records:
+        unique_id = str(user_record['id'])
+        user_fields = sarf_fields.pop(unique_id, None)
+        if user_fields is None:
+            differences.append({'id': unique_id, 'field': None, 'expected': 'user page', 'actual': None})
+            continue
+        for field_name, kind in template_fields.items():
+            if field_name not in user_record:
+                continue
+            expected = expected_field_state(kind, user_record[field_name])
+            actual = user_fields.get(field_name)
+            if actual is None or actual[1:] != expected:
+                differences.append({'id': unique_id, 'field': field_name, 'expected': expected, 'actual': actual and actual[1:]})
+    for unique_id in sarf_fields:
+        differences.append({'id': unique_id, 'field': None, 'expected': None, 'actual': 'user page'})
+    return differences
+
+def compare_to_reference(pdf_file_path, reference_pdf_file_path):
+    """
+    Compares the populated form fields of each user in a merged SARF PDF file with a reference SARF PDF file
+    (e.g. generated by a previous version of the process)
+
+    Parameters
+    ----------
+    pdf_file_path: str
+        The file path/name of the SARF PDF file
+    reference_pdf_file_path: str
+        The file path/name of the reference SARF PDF file
+
+    Returns
+    -------
+    list
+        List of dictionaries of the id, field name, expected (reference) and actual (value, state) of each difference.
+        A missing or unexpected user or field has an expected or actual value of None
+    """
+
+    sarf_fields = read_sarf_fields(pdf_file_path)
+    reference_fields = read_sarf_fields(reference_pdf_file_path)
+    differences = []
+    for unique_id, expected_fields in reference_fields.items():
+        user_fields = sarf_fields.pop(unique_id, None)
+        if user_fields is None:
+            differences.append({'id': unique_id, 'field': None, 'expected': 'user page', 'actual': None})
+            continue
+        for field_name in list(expected_fields) + [field_name for field_name in user_fields if field_name not in expected_fields]:
+            expected = expected_fields.get(field_name)
+            actual = user_fields.get(field_name)
+            if expected is None or actual is None or expected[1:] != actual[1:]:
+                differences.append({'id': unique_id, 'field': field_name, 'expected': expected and expected[1:], 'actual': actual and actual[1:]})
+    for unique_id in sarf_fields:
+        differences.append({'id': unique_id, 'field': None, 'expected': None, 'actual': 'user page'})
+    return differences
+
+def verify_sarfs(comparisons, max_workers=1):
+    """
+    Verifies multiple SARF PDF files against their user records or reference SARF PDF files, in parallel with more than 1 worker
+
+    Parameters
+    ----------
+    comparisons: list
+        List of the (SARF PDF file path, expected) of each SARF, where expected is either the list of user records
+        the SARF was generated from or the file path of a reference SARF PDF file. A comparison with user records can have
+        the form fields of the SARF template as a third item (see compare_to_records)
+    max_workers: int, optional
+        Number of worker processes used to verify the SARF PDF files (defaults to 1 - verified one at a time in this process)
+
+    Returns
+    -------
+    dict
+        Dictionary of the file path of each SARF PDF file and the list of its differences (see compare_to_records and compare_to_reference)
+    """
+
+    def compare_function(expected):
+        return compare_to_reference if isinstance(expected, str) else compare_to_records
+
+    if max_workers <= 1 or len(comparisons) <= 1:
+        return {comparison[0]: compare_function(comparison[1])(*comparison) for comparison in comparisons}
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [(comparison[0], executor.submit(compare_function(comparison[1]), *comparison)) for comparison in comparisons]
+        return {pdf_file_path: future.result() for pdf_file_path, future in futures}
+
+def print_differences(sarf_differences, max_per_file=20):
+    """
+    Prints the differences of each SARF PDF file grouped by user and returns the total number of differences
+
+    Parameters
+    ----------
+    sarf_differences: dict
+        Dictionary of the file path of each SARF PDF file and the list of its differences (see verify_sarfs)
+    max_per_file: int, optional
+        Maximum number of differences printed per SARF PDF file (defaults to 20)
+    """
+
+    total_differences = 0
+    for pdf_file_path, differences in sarf_differences.items():
+        total_differences += len(differences)
+        if not differences:
+            print(f'{pdf_file_path}: OK')
+            continue
+        user_count = len({difference['id'] for difference in differences})
+        print(f'{pdf_file_path}: {len(differences)} difference(s) in {user_count} user(s)')
+        for difference in differences[:max_per_file]:
+            if difference['field'] is None:
+                print(f"  User {difference['id']}: {'missing' if difference['actual'] is None else 'unexpected'} user page")
+            elif difference['actual'] is None:
+                print(f"  User {difference['id']}: {difference['field']!r} expected {difference['expected']} but the field is missing")
+            else:
+                print(f"  User {difference['id']}: {difference['field']!r} expected {difference['expected']} but found {difference['actual']}")
+        if len(differences) > max_per_file:
+            print(f'  ... {len(differences) - max_per_file} more')
+    return total_differences
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare the populated form fields of each user in SARF PDF files with reference SARF PDF files')
+    parser.add_argument('sarfs', help='SARF PDF file, or directory of SARF PDF files, to verify')
+    parser.add_argument('reference', help='Reference SARF PDF file, or directory of reference SARF PDF files with the same file names')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Number of worker processes used to verify the SARF PDF files')
+    args = parser.parse_args(argv)
+
+    if os.path.isdir(args.sarfs):
+        comparisons = [(os.path.join(args.sarfs, file_name), os.path.join(args.reference, file_name))
+            for file_name in sorted(os.listdir(args.reference)) if file_name.lower().endswith('.pdf')]
+    else:
+        comparisons = [(args.sarfs, args.reference)]
+    missing_files = [pdf_file_path for pdf_file_path, reference_pdf_file_path in comparisons if not os.path.exists(pdf_file_path)]
+    for pdf_file_path in missing_files:
+        print(f'{pdf_file_path}: missing')
+    comparisons = [comparison for comparison in comparisons if comparison[0] not in missing_files]
+
+    total_differences = print_differences(verify_sarfs(comparisons, args.workers))
+    print(f'{len(comparisons)} SARF(s) verified, {total_differences} difference(s), {len(missing_files)} missing SARF(s)')
+    return 1 if total_differences or missing_files else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+#The modules of the process are in the main project directory (not a package)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic_template import write_sarf_template
+
+@pytest.fixture
+def sarf_template_path(tmp_path):
+    """
+    Path of a SARF template directory with a synthetic SARF template (see benchmarks.synthetic_template)
+    """
+
+    template_dir = tmp_path / 'SARF_Template'
+    template_dir.mkdir()
+    write_sarf_template(str(template_dir / 'sarf_template.pdf'))
+    return str(template_dir) + '/'
@@ -0,0 +1,101 @@
+import os
+import threading
+
+import pytest
+
+import background_writer
+from background_writer import BackgroundPdfWriter, write_pdf_file
+from benchmarks.synthetic_workbook import write_user_workbook
+from metrics import RunMetrics
+from sarf_automator import SarfAutomator
+
+class FakeWriter():
+    #Stands in for a PdfFileWriter2: writes its data, or raises its error once released
+    def __init__(self, data=b'%PDF-1.3', error=None, release=None):
+        self.data = data
+        self.error = error
+        self.release = release
+        self.started = threading.Event()
+
+    def write(self, stream):
+        self.started.set()
+        stream.write(self.data)
+        if self.release is not None:
+            self.release.wait(10)
+        if self.error is not None:
+            raise self.error
+
+def test_failed_write_removes_the_part_file(tmp_path):
+    output_filename = str(tmp_path / 'sarf.pdf')
+    with open(output_filename, 'wb') as output_file:
+        output_file.write(b'previous')
+
+    with pytest.raises(OSError, match='disk full'):
+        write_pdf_file(FakeWriter(error=OSError('disk full')), output_filename)
+    assert os.listdir(tmp_path) == ['sarf.pdf']
+    with open(output_filename, 'rb') as output_file:
+        assert output_file.read() == b'previous'
+
+    assert write_pdf_file(FakeWriter(b'new'), output_filename) == 3
+    assert os.listdir(tmp_path) == ['sarf.pdf']
+
+def test_write_error_reaches_the_caller(tmp_path):
+    writer = BackgroundPdfWriter(RunMetrics(progress_interval=None))
+    written = []
+    writer.submit(FakeWriter(error=OSError('disk full')), str(tmp_path / 'a.pdf'), on_written=lambda: written.append('a'))
+    with pytest.raises(OSError, match='disk full'):
+        writer.wait()
+    #The error is only raised once
+    writer.close()
+    assert written == []
+    assert os.listdir(tmp_path) == []
+
+def test_writers_queued_after_a_failure_are_discarded(tmp_path):
+    writer = BackgroundPdfWriter(RunMetrics(progress_interval=None), num_threads=1, max_pending=2)
+    written = []
+    release = threading.Event()
+    failing_writer = FakeWriter(error=OSError('disk full'), release=release)
+    writer.submit(failing_writer, str(tmp_path / 'a.pdf'), on_written=lambda: written.append('a'))
+    failing_writer.started.wait(10)
+    #Queued while the first writer is being written
+    writer.submit(FakeWriter(), str(tmp_path / 'b.pdf'), on_written=lambda: written.append('b'))
+    writer.submit(FakeWriter(), str(tmp_path / 'c.pdf'), on_written=lambda: written.append('c'))
+    release.set()
+    with pytest.raises(OSError, match='disk full'):
+        writer.wait()
+    assert written == []
+    assert os.listdir(tmp_path) == []
+
+    #Writers submitted after the error was raised are written again
+    writer.submit(FakeWriter(), str(tmp_path / 'd.pdf'), on_written=lambda: written.append('d'))
+    writer.close()
+    assert written == ['d']
+    assert os.listdir(tmp_path) == ['d.pdf']
+
+def test_write_error_does_not_replace_the_error_of_the_run(tmp_path, sarf_template_path, monkeypatch, capsys):
+    data_dir = tmp_path / 'P&P_Files'
+    data_dir.mkdir()
+    write_user_workbook(str(data_dir / 'a.xlsx'), 3, 'Bureau A')
+    write_user_workbook(str(data_dir / 'b.xlsx'), 3, 'Bureau B')
+    monkeypatch.chdir(tmp_path)
+    automator = SarfAutomator(sarf_template_path, write_threads=1)
+    automator.load_data('P&P_Files/', 'CRM Users', 2, use_pandas=False)
+
+    #The first SARF cannot be written and the second cannot be populated
+    def fail_write(writer, output_filename):
+        raise OSError('disk full')
+    monkeypatch.setattr(background_writer, 'write_pdf_file', fail_write)
+    merge_pdf_form_values = automator.pdf_filler.merge_pdf_form_values
+    merged = []
+    def fail_second_merge(output_filename, *args, **kwargs):
+        if merged:
+            raise ValueError('bad record')
+        merged.append(output_filename)
+        return merge_pdf_form_values(output_filename, *args, **kwargs)
+    monkeypatch.setattr(automator.pdf_filler, 'merge_pdf_form_values', fail_second_merge)
+
+    with pytest.raises(ValueError, match='bad record'):
+        automator.run('CRM_SARF_', merge_in_memory=True)
+    assert 'SARF could not be written - disk full' in capsys.readouterr().out
+    assert not [file_name for file_name in os.listdir(tmp_path) if file_name.endswith(('.pdf', '.part'))]
+    automator.pdf_filler.close()
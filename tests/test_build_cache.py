@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import pickle
+from io import BytesIO
+
+import pytest
+
+from build_cache import MANIFEST_VERSION, WORKBOOK_CACHE_EXTENSIONS, PageIndex, PageStoreUnpickler, WorkbookCache
+from pdf_filler import PdfFileFiller
+from sarf_automator import SARF_USER_INFO_PAGE_NUM
+
+SHEET_NAME = 'CRM Users'
+COLUMNS = ['User Number', 'Last Name']
+DATA = {'User Number': ['1', '2'], 'Last Name': ['Smith', 'Zoë']}
+
+class CreatesFile():
+    #Creates a file when it is unpickled
+    def __init__(self, file_path):
+        self.file_path = file_path
+
+    def __reduce__(self):
+        return (open, (self.file_path, 'w'))
+
+class RunsCommand():
+    #Runs a shell command that creates a file when it is unpickled
+    def __init__(self, file_path):
+        self.file_path = file_path
+
+    def __reduce__(self):
+        return (os.system, (f'echo > "{self.file_path}"',))
+
+@pytest.fixture
+def cached_workbook(tmp_path):
+    #A workbook cache with the data of a (fake) Excel file
+    file_path = str(tmp_path / 'users.xlsx')
+    with open(file_path, 'wb') as workbook_file:
+        workbook_file.write(b'workbook contents')
+    workbook_cache = WorkbookCache(str(tmp_path / 'cache'))
+    workbook_cache.save(file_path, SHEET_NAME, 2, COLUMNS, DATA)
+    return workbook_cache, file_path
+
+def test_unchanged_workbook_is_loaded(cached_workbook):
+    workbook_cache, file_path = cached_workbook
+    assert workbook_cache.contains(file_path, SHEET_NAME, 2, COLUMNS)
+    assert workbook_cache.load(file_path, SHEET_NAME, 2, COLUMNS) == DATA
+    #Another sheet, header row or set of columns is not cached
+    assert workbook_cache.load(file_path, 'Other', 2, COLUMNS) is None
+    assert workbook_cache.load(file_path, SHEET_NAME, 0, COLUMNS) is None
+    assert workbook_cache.load(file_path, SHEET_NAME, 2, COLUMNS + ['First Name']) is None
+
+def test_modified_time_with_the_same_contents_is_loaded(cached_workbook):
+    workbook_cache, file_path = cached_workbook
+    stat = os.stat(file_path)
+    os.utime(file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert workbook_cache.load(file_path, SHEET_NAME, 2, COLUMNS) == DATA
+
+@pytest.mark.parametrize('contents', [b'workbook contentz', b'changed workbook contents'], ids=['same_size', 'new_size'])
+def test_changed_workbook_is_not_loaded(cached_workbook, contents):
+    workbook_cache, file_path = cached_workbook
+    stat = os.stat(file_path)
+    with open(file_path, 'wb') as workbook_file:
+        workbook_file.write(contents)
+    os.utime(file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert not workbook_cache.contains(file_path, SHEET_NAME, 2, COLUMNS)
+    assert workbook_cache.load(file_path, SHEET_NAME, 2, COLUMNS) is None
+
+def test_pickled_data_is_never_loaded(cached_workbook, tmp_path):
+    workbook_cache, file_path = cached_workbook
+    entry_path = workbook_cache._entry_path(file_path)
+    with open(entry_path + '.json') as entry_file:
+        entry = json.load(entry_file)
+    marker_path = str(tmp_path / 'unpickled')
+
+    #A pickle in place of the data file of the entry
+    with open(entry_path + WORKBOOK_CACHE_EXTENSIONS[entry['format']], 'wb') as data_file:
+        pickle.dump(CreatesFile(marker_path), data_file)
+    assert workbook_cache.load(file_path, SHEET_NAME, 2, COLUMNS) is None
+
+    #An entry of a pickle format
+    with open(entry_path + '.pickle', 'wb') as data_file:
+        pickle.dump(CreatesFile(marker_path), data_file)
+    with open(entry_path + '.json', 'w') as entry_file:
+        json.dump(dict(entry, format='pickle'), entry_file)
+    assert not workbook_cache.contains(file_path, SHEET_NAME, 2, COLUMNS)
+    assert workbook_cache.load(file_path, SHEET_NAME, 2, COLUMNS) is None
+    assert not os.path.exists(marker_path)
+
+def test_data_that_is_not_column_lists_is_not_loaded(cached_workbook):
+    workbook_cache, file_path = cached_workbook
+    entry_path = workbook_cache._entry_path(file_path)
+    with open(entry_path + '.json') as entry_file:
+        entry = json.load(entry_file)
+    if entry['format'] != 'json':
+        pytest.skip('the data is saved as a Feather file')
+    with open(entry_path + WORKBOOK_CACHE_EXTENSIONS['json'], 'w') as data_file:
+        json.dump({'User Number': '12'}, data_file)
+    assert workbook_cache.load(file_path, SHEET_NAME, 2, COLUMNS) is None
+
+def test_page_store_is_loaded(tmp_path, sarf_template_path):
+    pdf_filler = PdfFileFiller(sarf_template_path + 'sarf_template.pdf')
+    sarf_part = pdf_filler.create_pdf_part([{'1 Job Title': 'Officer', 'id': '1'}], SARF_USER_INFO_PAGE_NUM)
+    pdf_filename = str(tmp_path / 'sarf.pdf')
+    PageIndex(pdf_filename, 'template key').update(['1'], ['fingerprint'], [sarf_part], SARF_USER_INFO_PAGE_NUM)
+
+    page_index = PageIndex(pdf_filename, 'template key')
+    assert page_index.records == [{'id': '1', 'fingerprint': 'fingerprint', 'page': SARF_USER_INFO_PAGE_NUM}]
+    assert vars(page_index.pages['fingerprint']) == vars(sarf_part)
+    #The pages of another template are not used
+    assert PageIndex(pdf_filename, 'other template key').pages == {}
+
+@pytest.mark.parametrize('payload', [CreatesFile, RunsCommand])
+def test_page_store_unpickler_rejects_other_globals(tmp_path, payload):
+    marker_path = str(tmp_path / 'unpickled')
+    pages_data = pickle.dumps({'fingerprint': payload(marker_path)})
+    with pytest.raises(pickle.UnpicklingError):
+        PageStoreUnpickler(BytesIO(pages_data)).load()
+
+    #A replaced page store is not loaded even if the index is replaced to match it
+    pdf_filename = str(tmp_path / 'sarf.pdf')
+    page_index = PageIndex(pdf_filename, 'template key')
+    with open(page_index.pages_path, 'wb') as pages_file:
+        pages_file.write(pages_data)
+    with open(page_index.index_path, 'w') as index_file:
+        json.dump({'version': MANIFEST_VERSION, 'template_key': 'template key', 'pages_hash': hashlib.sha256(pages_data).hexdigest(), 
+            'records': [{'id': '1', 'fingerprint': 'fingerprint', 'page': 0}]}, index_file)
+    page_index = PageIndex(pdf_filename, 'template key')
+    assert page_index.pages == {}
+    assert page_index.records == []
+    assert not os.path.exists(marker_path)
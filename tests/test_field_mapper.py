@@ -0,0 +1,67 @@
+import random
+
+import pandas as pd
+import pytest
+
+from field_mapper import FieldMapper, string_columns, string_values
+from sarf_automator import DEFAULT_STRING_MAPPINGS, FIELD_MAPPINGS, VALUE_OVERRIDE_MAPPINGS
+
+#Values of the columns of the checkbox and radio button fields (with their value overrides), in any case, blank or missing (NaN)
+FLAG_VALUES = ['', None, 'Yes', 'yes', 'YES', 'No', 'no', "I Don't Know", "i don't know", '/No', 'CRM User', 'crm mission/office admin', 
+    'CRM Contacts Only User', 'Maybe']
+#Values of the other columns
+TEXT_VALUES = ['', None, 'Smith', 'Zoë', 'O, Brien', ' , ', 'Desk (Acting)', 5, 2.5]
+
+def user_data_frame(num_rows, seed=0):
+    #Returns a DataFrame of the source columns of the SARF fields with random flag, text, blank and missing values
+    rnd = random.Random(seed)
+    flag_columns = set(FIELD_MAPPINGS[field] for field in VALUE_OVERRIDE_MAPPINGS)
+    columns = {}
+    for col in FieldMapper(FIELD_MAPPINGS).source_columns:
+        if col == 'User Number':
+            columns[col] = [float(i + 1) if i % 7 else None for i in range(0, num_rows)]
+        else:
+            values = FLAG_VALUES if col in flag_columns else TEXT_VALUES
+            columns[col] = [rnd.choice(values) for i in range(0, num_rows)]
+    return pd.DataFrame(columns)
+
+def row_by_row_records(user_data):
+    #Maps each row of the user data to the SARF fields one row at a time (the way the fields were mapped before FieldMapper)
+    records = []
+    for index, row in user_data.fillna('').apply(lambda col: col.map(str)).iterrows():
+        record = {}
+        for field, mapping in FIELD_MAPPINGS.items():
+            if isinstance(mapping, list):
+                record[field] = ', '.join(row[col] for col in mapping).strip(' ,')
+            elif isinstance(mapping, dict):
+                default_field = list(mapping.keys())[0]
+                record[field] = row[default_field] if row[default_field] != '' else row[mapping[default_field]]
+            else:
+                record[field] = row[mapping]
+        record['id'] = row['User Number']
+        for field, overrides in VALUE_OVERRIDE_MAPPINGS.items():
+            for value, replacement in overrides.items():
+                if record[field].lower() == value.lower():
+                    record[field] = replacement
+        record.update(DEFAULT_STRING_MAPPINGS)
+        records.append(record)
+    return records
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_vectorized_mapping_matches_row_by_row_mapping(seed):
+    field_mapper = FieldMapper(FIELD_MAPPINGS, VALUE_OVERRIDE_MAPPINGS, DEFAULT_STRING_MAPPINGS)
+    user_data = user_data_frame(300, seed)
+    expected = row_by_row_records(user_data)
+
+    assert field_mapper.map_records(string_columns(user_data, field_mapper.source_columns)) == expected
+    #The same values read without pandas (blank values are None)
+    column_data = {col: string_values([None if pd.isna(value) else value for value in user_data[col]]) for col in field_mapper.source_columns}
+    assert field_mapper.map_column_records(column_data) == expected
+
+def test_chained_value_overrides():
+    field_mapper = FieldMapper(FIELD_MAPPINGS, VALUE_OVERRIDE_MAPPINGS, DEFAULT_STRING_MAPPINGS)
+    #Blank values are replaced by the default value, then by its PDF value
+    assert field_mapper.value_override_tables['1 Existing Okta Account'][''] == '/0'
+    assert field_mapper.value_override_tables['1 CRM User Type'][''] == '/1#20CRM#20User'
+    #A replacement matching an earlier override is not replaced again
+    assert field_mapper.value_override_tables['1 no email'] == {'': 'No', 'yes': 'No', 'no': 'Yes', '/no': 'No'}
@@ -0,0 +1,177 @@
+import pytest
+from PyPDF2 import PdfFileWriter
+from PyPDF2.generic import ArrayObject, DictionaryObject, NameObject, NumberObject, createStringObject
+
+from pdf_filler import PdfFileFiller, PdfFileReader2, TextAppearance
+from sarf_automator import SARF_USER_INFO_PAGE_NUM
+
+#A name the WinAnsiEncoding (cp1252) font of the synthetic template cannot encode
+NON_CP1252_NAME = 'Łukasz, Zoë ☎'
+
+def read_form(pdf_file_path):
+    #Returns the NeedAppearances flag and the dictionary of the name of each form field of the populated pages and its (first) widget
+    reader = PdfFileReader2(pdf_file_path, strict=False)
+    acroform = reader.trailer['/Root']['/AcroForm']
+    fields = {}
+    for pageNum in range(SARF_USER_INFO_PAGE_NUM, reader.getNumPages()):
+        for annotation in reader.getPage(pageNum)['/Annots']:
+            annotation = annotation.getObject()
+            field = annotation['/Parent'] if '/Parent' in annotation else annotation
+            fields.setdefault(str(field['/T']), annotation)
+    return acroform['/NeedAppearances'].value, fields
+
+def appearance_data(annotation):
+    #Returns the data of the normal appearance stream of a widget annotation
+    return annotation['/AP']['/N'].getData()
+
+@pytest.fixture
+def pdf_filler(sarf_template_path):
+    pdf_filler = PdfFileFiller(sarf_template_path + 'sarf_template.pdf', generate_appearances=True)
+    yield pdf_filler
+    pdf_filler.close()
+
+def test_appearance_is_drawn_in_the_font_encoding(tmp_path, pdf_filler):
+    output_file = str(tmp_path / 'sarf.pdf')
+    pdf_filler.merge_pdf_form_values(output_file, [{'id': 1, '1 Name': 'Zoë (Acting)', '1 Job Title': 'Officer'}], SARF_USER_INFO_PAGE_NUM, 
+        header_pages=SARF_USER_INFO_PAGE_NUM)
+
+    need_appearances, fields = read_form(output_file)
+    assert not need_appearances
+    assert b'(Zo\xeb \\(Acting\\)) Tj' in appearance_data(fields['1 Name###1'])
+    assert b'(Officer) Tj' in appearance_data(fields['1 Job Title###1'])
+
+@pytest.mark.parametrize('in_parts', [False, True], ids=['merged', 'parts'])
+def test_value_the_font_cannot_encode_is_left_to_the_viewer(tmp_path, pdf_filler, in_parts):
+    output_file = str(tmp_path / 'sarf.pdf')
+    records = [{'id': 1, '1 Name': 'Smith, Ann', '1 Job Title': 'Officer'}, {'id': 2, '1 Name': NON_CP1252_NAME, '1 Job Title': 'Officer'}]
+    if in_parts:
+        pdf_parts = [pdf_filler.create_pdf_part([record], SARF_USER_INFO_PAGE_NUM) for record in records]
+        pdf_filler.merge_pdf_parts(pdf_parts, output_file, header_pages=SARF_USER_INFO_PAGE_NUM)
+    else:
+        pdf_filler.merge_pdf_form_values(output_file, records, SARF_USER_INFO_PAGE_NUM, header_pages=SARF_USER_INFO_PAGE_NUM)
+
+    need_appearances, fields = read_form(output_file)
+    assert need_appearances
+    name_field = PdfFileReader2(output_file, strict=False).getFields()['1 Name###2']
+    assert name_field['/V'] == NON_CP1252_NAME
+    #The template's blank appearance is kept instead of an appearance with replacement characters
+    assert b'?' not in appearance_data(fields['1 Name###2'])
+    assert b'Tj' not in appearance_data(fields['1 Name###2'])
+    assert b'(Officer) Tj' in appearance_data(fields['1 Job Title###2'])
+
+def test_flattened_page_with_a_value_the_font_cannot_encode_is_kept_as_a_form(tmp_path, sarf_template_path):
+    pdf_filler = PdfFileFiller(sarf_template_path + 'sarf_template.pdf', flatten=True)
+    output_file = str(tmp_path / 'sarf.pdf')
+    records = [{'id': 1, '1 Name': 'Smith, Ann'}, {'id': 2, '1 Name': NON_CP1252_NAME}]
+    pdf_filler.merge_pdf_form_values(output_file, records, SARF_USER_INFO_PAGE_NUM, header_pages=SARF_USER_INFO_PAGE_NUM)
+
+    reader = PdfFileReader2(output_file, strict=False)
+    assert '/Annots' not in reader.getPage(SARF_USER_INFO_PAGE_NUM)
+    assert reader.trailer['/Root']['/AcroForm']['/NeedAppearances'].value
+    assert reader.getFields()['1 Name###2']['/V'] == NON_CP1252_NAME
+
+@pytest.mark.parametrize('font, encodable, not_encodable', [
+    ({'/Subtype': '/Type1', '/Encoding': '/WinAnsiEncoding'}, ['Zoë – €', "O'Brien"], [NON_CP1252_NAME]),
+    ({'/Subtype': '/Type1', '/Encoding': '/MacRomanEncoding'}, ['Zoë – €'], ['Łukasz']),
+    #The standard encoding has other characters than ASCII for ' and ` (quoteright and quoteleft)
+    ({'/Subtype': '/Type1'}, ['Smith, Ann (Acting)'], ["O'Brien", 'Zoë']),
+    ({'/Subtype': '/Type1', '/Encoding': '/StandardEncoding'}, ['Smith'], ['`Smith`'])
+], ids=['win_ansi', 'mac_roman', 'type1_builtin', 'standard'])
+def test_can_encode_checks_the_font_encoding(font, encodable, not_encodable):
+    appearance = TextAppearance.from_field(text_annotation(), form_resources(font))
+    assert appearance is not None
+    for value in encodable:
+        assert appearance.can_encode(value), value
+    for value in not_encodable:
+        assert not appearance.can_encode(value), value
+
+@pytest.mark.parametrize('font', [
+    {'/Subtype': '/Type1', '/Encoding': {'/Differences': [128, '/Euro']}},
+    {'/Subtype': '/TrueType'},
+    {'/Subtype': '/Type0', '/Encoding': '/Identity-H'}
+], ids=['differences', 'truetype_builtin', 'composite'])
+def test_no_appearance_for_unknown_font_encodings(font):
+    assert TextAppearance.from_field(text_annotation(), form_resources(font)) is None
+
+def pdf_dictionary(values):
+    #Returns a PyPDF2 dictionary of a dictionary of names, numbers, lists and dictionaries
+    def pdf_value(value):
+        if isinstance(value, dict):
+            return pdf_dictionary(value)
+        if isinstance(value, list):
+            return ArrayObject([pdf_value(item) for item in value])
+        return NameObject(value) if isinstance(value, str) else NumberObject(value)
+    return DictionaryObject({NameObject(key): pdf_value(value) for key, value in values.items()})
+
+def text_annotation():
+    return pdf_dictionary({'/Rect': [0, 0, 200, 16], '/FT': '/Tx'})
+
+def form_resources(font):
+    #Returns an AcroForm with the default appearance font /Helv
+    acroform = pdf_dictionary({'/DR': {'/Font': {'/Helv': dict({'/Type': '/Font', '/BaseFont': '/Helvetica'}, **font)}}})
+    acroform[NameObject('/DA')] = createStringObject('/Helv 0 Tf 0 g')
+    return acroform
+
+def write_shared_field_template(file_path):
+    #Writes a single page PDF template with a text field and a dropdown field that each have two widgets (kids) on the page
+    writer = PdfFileWriter()
+    page = writer.addBlankPage(612, 792)
+    page_ref = writer.getObject(writer._pages)['/Kids'][-1]
+    font = writer._addObject(pdf_dictionary({'/Type': '/Font', '/Subtype': '/Type1', '/BaseFont': '/Helvetica', '/Encoding': '/WinAnsiEncoding'}))
+    annotations = ArrayObject()
+    fields = ArrayObject()
+    y = 700
+    for name, field_type in [('1 Name', '/Tx'), ('1 Timezone', '/Ch')]:
+        parent = pdf_dictionary({'/FT': field_type})
+        parent[NameObject('/T')] = createStringObject(name)
+        if field_type == '/Ch':
+            parent[NameObject('/Ff')] = NumberObject(131072)
+            parent[NameObject('/Opt')] = ArrayObject([createStringObject('EST'), createStringObject('PST')])
+        parent_ref = writer._addObject(parent)
+        kids = ArrayObject()
+        for x in (50, 320):
+            kid = pdf_dictionary({'/Type': '/Annot', '/Subtype': '/Widget', '/Rect': [x, y, x + 240, y + 16], '/F': 4})
+            kid[NameObject('/P')] = page_ref
+            kid[NameObject('/Parent')] = parent_ref
+            kid_ref = writer._addObject(kid)
+            kids.append(kid_ref)
+            annotations.append(kid_ref)
+        parent[NameObject('/Kids')] = kids
+        fields.append(parent_ref)
+        y -= 40
+    page[NameObject('/Annots')] = annotations
+    acroform = pdf_dictionary({'/DR': {'/Font': {}}})
+    acroform['/DR']['/Font'][NameObject('/Helv')] = font
+    acroform[NameObject('/DA')] = createStringObject('/Helv 0 Tf 0 g')
+    acroform[NameObject('/Fields')] = fields
+    writer._root_object[NameObject('/AcroForm')] = writer._addObject(acroform)
+    with open(file_path, 'wb') as template_file:
+        writer.write(template_file)
+
+@pytest.mark.parametrize('generate_appearances', [False, True], ids=['need_appearances', 'appearances'])
+def test_field_with_several_widgets_is_populated(tmp_path, generate_appearances):
+    template_file = str(tmp_path / 'template.pdf')
+    write_shared_field_template(template_file)
+    pdf_filler = PdfFileFiller(template_file, generate_appearances=generate_appearances)
+    output_file = str(tmp_path / 'merged.pdf')
+    records = [{'id': 1, '1 Name': 'Smith, Ann', '1 Timezone': 'EST'}, {'id': 2, '1 Name': 'Jones, Bo', '1 Timezone': 'PST'}]
+    pdf_filler.merge_pdf_form_values(output_file, records, 0)
+
+    reader = PdfFileReader2(output_file, strict=False)
+    form_fields = reader.getFields()
+    assert reader.trailer['/Root']['/AcroForm']['/NeedAppearances'].value != generate_appearances
+    for pageNum, record in enumerate(records):
+        unique_id = '###' + str(record['id'])
+        assert form_fields['1 Name' + unique_id]['/V'] == record['1 Name']
+        assert form_fields['1 Timezone' + unique_id]['/V'] == record['1 Timezone']
+        #The dropdown field is converted to a text field
+        assert form_fields['1 Timezone' + unique_id]['/FT'] == '/Tx'
+
+        #Both widgets on the page belong to the renamed field of the record
+        widgets = [annotation.getObject() for annotation in reader.getPage(pageNum)['/Annots']]
+        assert [str(widget['/Parent']['/T']) for widget in widgets] == ['1 Name' + unique_id] * 2 + ['1 Timezone' + unique_id] * 2
+        if generate_appearances:
+            for widget in widgets:
+                assert ('(%s) Tj' % widget['/Parent']['/V']).encode('latin-1') in appearance_data(widget)
+        else:
+            assert all('/AP' not in widget for widget in widgets)
@@ -0,0 +1,16 @@
+import pytest
+
+from benchmarks.synthetic_workbook import write_user_workbook
+from sarf_automator import SARF_TEMPLATE_KEY, SarfAutomator
+
+@pytest.mark.parametrize('use_pandas', [True, False], ids=['pandas', 'columns'])
+def test_workbook_without_the_template_column_uses_its_template(tmp_path, sarf_template_path, use_pandas):
+    file_path = str(tmp_path / 'synthetic.xlsx')
+    write_user_workbook(file_path, 5)
+    automator = SarfAutomator(sarf_template_path, default_template='sarf_template.pdf', template_column='SARF Template')
+
+    workbooks = list(automator.iter_workbooks([file_path], 'CRM Users', 2, use_pandas=use_pandas))
+    assert len(workbooks) == 1
+    data_filename, cur_user_data = workbooks[0]
+    assert len(cur_user_data) == 5
+    assert all(SARF_TEMPLATE_KEY not in user_record for user_record in cur_user_data)
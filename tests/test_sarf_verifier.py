@@ -0,0 +1,219 @@
+import glob
+from io import BytesIO
+
+import openpyxl
+import pytest
+from PyPDF2.generic import (ArrayObject, BooleanObject, ByteStringObject, DictionaryObject, FloatObject, IndirectObject, NameObject, 
+    NullObject, NumberObject, createStringObject, readObject)
+
+from benchmarks.synthetic_workbook import USER_DATA_COLUMNS, write_user_workbook
+from pdf_filler import TEXT_FIELD, CHECKBOX_FIELD, RADIO_BUTTON_FIELD, PdfFileReader2
+from sarf_automator import SarfAutomator
+from sarf_verifier import UNIQUE_ID_SEPARATOR, SarfObjectReader, compare_to_records, parse_pdf_object, pdf_value, read_sarf_fields
+
+#Names and job titles with characters that are escaped in PDF strings (parentheses, backslashes, line breaks) or encoded as UTF-16
+ESCAPED_VALUES = [
+    ('Smith (Acting)', 'Officer (Temporary'),
+    ('Back\\slash', 'Desk \\ Specialist)'),
+    ('Line\nBreak', 'Tab\tCoordinator'),
+    ("O'Brien ((Nested))", '\\(Escaped\\)'),
+    ('Zoë Łukasz', 'Spécialiste – ☎')
+]
+
+@pytest.fixture
+def sarf_dir(tmp_path, sarf_template_path, monkeypatch):
+    #Working directory with a P&P file of users with escaped values
+    data_dir = tmp_path / 'P&P_Files'
+    data_dir.mkdir()
+    file_path = str(data_dir / 'synthetic.xlsx')
+    write_user_workbook(file_path, 12)
+
+    workbook = openpyxl.load_workbook(file_path)
+    sheet = workbook['CRM Users']
+    last_name_col = USER_DATA_COLUMNS.index('Last Name') + 1
+    job_title_col = USER_DATA_COLUMNS.index('Job Title') + 1
+    #Users start after the title rows, the column headers and the Example row
+    for row_num, (last_name, job_title) in enumerate(ESCAPED_VALUES, 5):
+        sheet.cell(row_num, last_name_col, last_name)
+        sheet.cell(row_num, job_title_col, job_title)
+    workbook.save(file_path)
+
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+def pypdf2_sarf_fields(pdf_file_path):
+    #Reads the populated form fields of each user like read_sarf_fields, but with PyPDF2 objects for the annotations of each page
+    reader = PdfFileReader2(pdf_file_path, strict=False)
+    sarf_fields = {}
+    for page in reader.pages:
+        for annotation in page.get('/Annots', []):
+            annotation = annotation.getObject()
+            field = annotation['/Parent'].getObject() if '/Parent' in annotation else annotation
+            field_name, separator, unique_id = str(field.get('/T', '')).rpartition(UNIQUE_ID_SEPARATOR)
+            if not separator:
+                continue
+            field_type = field.get('/FT')
+            if field_type == '/Tx':
+                kind = TEXT_FIELD
+            elif field_type == '/Btn':
+                kind = RADIO_BUTTON_FIELD if '/Kids' in field else CHECKBOX_FIELD
+            else:
+                kind = None
+            value = field.get('/V')
+            state = field.get('/AS')
+            sarf_fields.setdefault(unique_id, {})[field_name] = (kind, None if value is None else str(value), None if state is None else str(state))
+    return sarf_fields
+
+def pdf_bytes(obj):
+    #Returns a PyPDF2 object as written to a PDF file
+    stream = BytesIO()
+    obj.writeToStream(stream, None)
+    return stream.getvalue()
+
+def pdf_string(string):
+    #Returns a string as written to a PDF file by PyPDF2
+    return pdf_bytes(createStringObject(string))
+
+def generate_sarfs(sarf_template_path, **kwargs):
+    #Generates the SARF PDF files of the P&P files and returns the automator and the file paths of the SARFs
+    #(merged in memory, which writes the form fields of the SARF to its AcroForm)
+    automator = SarfAutomator(sarf_template_path, **kwargs)
+    automator.load_data('P&P_Files/', 'CRM Users', 2, use_pandas=False)
+    automator.run('CRM_SARF_', merge_in_memory=True)
+    automator.pdf_filler.close()
+    sarf_files = sorted(glob.glob('CRM_SARF_*.pdf'))
+    assert sarf_files
+    return automator, sarf_files
+
+@pytest.mark.parametrize('options', [
+    {},
+    {'compress_output': True},
+    {'generate_appearances': True},
+    {'compress_output': True, 'generate_appearances': True}
+], ids=['uncompressed', 'compressed', 'appearances', 'compressed_appearances'])
+def test_read_sarf_fields_matches_pypdf2(sarf_dir, sarf_template_path, options):
+    automator, sarf_files = generate_sarfs(sarf_template_path, **options)
+    for sarf_file in sarf_files:
+        sarf_fields = read_sarf_fields(sarf_file)
+        assert len(sarf_fields) == 12
+        assert sarf_fields == pypdf2_sarf_fields(sarf_file)
+
+        #The values also match the form fields PyPDF2 reads from the AcroForm of the SARF
+        form_fields = PdfFileReader2(sarf_file, strict=False).getFields()
+        for unique_id, user_fields in sarf_fields.items():
+            for field_name, (kind, value, state) in user_fields.items():
+                form_value = form_fields[field_name + UNIQUE_ID_SEPARATOR + unique_id].get('/V')
+                assert value == (None if form_value is None else str(form_value))
+
+    #Values with escaped characters are read back unchanged (last names are part of the full name fields)
+    values = [value for sarf_file in sarf_files for user_fields in read_sarf_fields(sarf_file).values()
+        for kind, value, state in user_fields.values() if value is not None]
+    for escaped_value in (value for pair in ESCAPED_VALUES for value in pair):
+        assert any(escaped_value in value for value in values), escaped_value
+    for sarf_file in sarf_files:
+        assert compare_to_records(sarf_file, automator.user_data[0]) == []
+
+def test_read_sarf_fields_of_flattened_sarf(sarf_dir, sarf_template_path):
+    automator, sarf_files = generate_sarfs(sarf_template_path, flatten=True)
+    for sarf_file in sarf_files:
+        sarf_fields = read_sarf_fields(sarf_file)
+        assert sarf_fields == pypdf2_sarf_fields(sarf_file)
+        #Only the page of the user with values the template font cannot encode is kept as a form (see TemplatePage.flatten)
+        assert len(sarf_fields) == 1
+        user_fields = next(iter(sarf_fields.values()))
+        assert user_fields['1 Job Title'][1] == ESCAPED_VALUES[-1][1]
+
+def test_missing_field_is_a_difference(sarf_dir, sarf_template_path):
+    automator, sarf_files = generate_sarfs(sarf_template_path)
+    user_records = automator.user_data[0]
+    unique_id = str(user_records[3]['id'])
+
+    #Rename the Job Title field of a user in place (the same length keeps the cross-reference table valid)
+    with open(sarf_files[0], 'rb') as sarf_file:
+        data = sarf_file.read()
+    field_name = pdf_string(f'1 Job Title###{unique_id}')
+    assert data.count(field_name) == 1
+    with open(sarf_files[0], 'wb') as sarf_file:
+        sarf_file.write(data.replace(field_name, pdf_string(f'1 Job Titlx###{unique_id}')))
+
+    expected = [{'id': unique_id, 'field': '1 Job Title', 'expected': (user_records[3]['1 Job Title'], None), 'actual': None}]
+    assert compare_to_records(sarf_files[0], user_records) == expected
+    assert automator.verify_sarfs('CRM_SARF_') == {sarf_files[0]: expected}
+
+def pdf_dictionary(**entries):
+    #Returns a PyPDF2 dictionary of the entries (keys are names)
+    return DictionaryObject({NameObject('/' + key): value for key, value in entries.items()})
+
+@pytest.mark.parametrize('obj', [
+    pdf_dictionary(),
+    ArrayObject(),
+    createStringObject('Smith (Acting) \\ ((Nested)) \n\t\r'),
+    createStringObject('Zo\xeb \u0141ukasz \u2013 \u260e'),
+    createStringObject(''),
+    ByteStringObject(bytes(range(256))),
+    NameObject('/Name#20With#20Spaces'),
+    NumberObject(0),
+    NumberObject(-12345),
+    FloatObject('1.5'),
+    FloatObject('-0.25'),
+    FloatObject('0.000001'),
+    BooleanObject(True),
+    BooleanObject(False),
+    NullObject(),
+    IndirectObject(12, 3, None),
+    pdf_dictionary(T=createStringObject('1 Job Title###7'), Kids=ArrayObject([IndirectObject(5, 0, None), IndirectObject(6, 0, None)]),
+        Rect=ArrayObject([FloatObject('0.5'), NumberObject(-1), NumberObject(612), FloatObject('792.25')]),
+        MK=pdf_dictionary(BG=ArrayObject([ArrayObject([NullObject()]), pdf_dictionary(N=BooleanObject(False))])),
+        V=ByteStringObject(b'\xfe\xff\x00(\x00)'))
+], ids=lambda obj: type(obj).__name__)
+def test_parse_pdf_object_matches_pypdf2(obj):
+    data = pdf_bytes(obj)
+    assert parse_pdf_object(data + b'\nendobj', 0) == (pdf_value(readObject(BytesIO(data + b'\nendobj'), None)), len(data))
+
+@pytest.mark.parametrize('data', [
+    b'<<\r/A 1\r>>',
+    b'(Line\\nBreak)',
+    b'(Smith \\(Acting\\))',
+    b'<4A4B>',
+    b'[ 1 % comment\n2 ]',
+    b'[ 1 2 >>',
+    b'<<\n/A\n>>',
+    b'<<\n1 2\n>>',
+    b'stream'
+])
+def test_parse_pdf_object_rejects_other_layouts(data):
+    #Objects not written by PdfFileWriter2 are read with PyPDF2 instead (see SarfObjectReader)
+    with pytest.raises(ValueError):
+        parse_pdf_object(data, 0)
+
+def test_parse_pdf_object_skips_other_keys():
+    obj = pdf_dictionary(T=createStringObject('Name'), AP=pdf_dictionary(N=ArrayObject([pdf_dictionary(), NumberObject(1)])), V=NumberObject(2))
+    data = pdf_bytes(obj)
+    assert parse_pdf_object(data, 0, frozenset(['/T', '/V'])) == ({'/T': 'Name', '/V': 2}, len(data))
+
+@pytest.mark.parametrize('options', [{}, {'compress_output': True}], ids=['uncompressed', 'compressed'])
+def test_objects_of_sarf_are_parsed_without_pypdf2(sarf_dir, sarf_template_path, options):
+    automator, sarf_files = generate_sarfs(sarf_template_path, **options)
+    reader = SarfObjectReader(sarf_files[0]).reader
+    references = [(idnum, 0) for idnum in reader.xref_objStm] + \
+        [(idnum, generation) for generation in reader.xref for idnum in reader.xref[generation] if (idnum, generation) != (0, 65535)]
+    assert len(references) > 100
+    for idnum, generation in references:
+        obj = reader.getObject(IndirectObject(idnum, generation, reader))
+        value = parse_pdf_object(*reader.object_data(idnum, generation))[0]
+        if hasattr(obj, 'getData'):
+            #PyPDF2 removes the length from the dictionary of a stream
+            del value['/Length']
+        assert value == pdf_value(obj)
+
+def test_read_sarf_fields_of_other_layout(sarf_dir, sarf_template_path):
+    automator, sarf_files = generate_sarfs(sarf_template_path)
+    sarf_fields = read_sarf_fields(sarf_files[0])
+
+    #Carriage returns instead of line breaks (the same length keeps the cross-reference table valid) are only read by PyPDF2
+    with open(sarf_files[0], 'rb') as sarf_file:
+        data = sarf_file.read()
+    assert data.count(b'<<\n') > 100
+    with open(sarf_files[0], 'wb') as sarf_file:
+        sarf_file.write(data.replace(b'<<\n', b'<<\r'))
+    assert read_sarf_fields(sarf_files[0]) == sarf_fields
@@ -0,0 +1,91 @@
+import asyncio
+import json
+import threading
+
+from benchmarks.synthetic_workbook import write_user_workbook
+from sarf_automator import SarfAutomator
+from sarf_verifier import read_sarf_fields
+from watch_service import SarfWatchService
+
+def test_metrics_only_report_the_last_workbook(tmp_path, sarf_template_path, monkeypatch):
+    data_dir = tmp_path / 'P&P_Files'
+    data_dir.mkdir()
+    write_user_workbook(str(data_dir / 'first.xlsx'), 7)
+    write_user_workbook(str(data_dir / 'second.xlsx'), 3)
+    monkeypatch.chdir(tmp_path)
+
+    automator = SarfAutomator(sarf_template_path)
+    metrics_json_path = str(tmp_path / 'metrics.json')
+    service = SarfWatchService(automator, 'P&P_Files/', 'CRM Users', 2, 'CRM_SARF_', metrics_paths=(metrics_json_path, None), use_pandas=False)
+    for file_path in service.user_data_filenames():
+        service.process_workbook(file_path)
+
+        with open(metrics_json_path) as metrics_file:
+            metrics = json.load(metrics_file)
+        assert metrics['records'] == (7 if file_path.endswith('first.xlsx') else 3)
+        assert metrics['stage_totals']['fill']['records'] == metrics['records']
+        assert {stage['file'] for stage in metrics['stages'] if stage['stage'] == 'read_workbook'} == {file_path}
+
+def test_workbooks_are_processed_concurrently(tmp_path, sarf_template_path, monkeypatch):
+    data_dir = tmp_path / 'P&P_Files'
+    data_dir.mkdir()
+    for num_users, bureau in [(4, 'Bureau A'), (5, 'Bureau B')]:
+        write_user_workbook(str(data_dir / f'{bureau}.xlsx'), num_users, bureau)
+    monkeypatch.chdir(tmp_path)
+
+    #Every Excel file is only read once another one is being read at the same time
+    barrier = threading.Barrier(2, timeout=30)
+    iter_workbooks = SarfAutomator.iter_workbooks
+    def concurrent_iter_workbooks(automator, *args, **kwargs):
+        barrier.wait()
+        return iter_workbooks(automator, *args, **kwargs)
+    monkeypatch.setattr(SarfAutomator, 'iter_workbooks', concurrent_iter_workbooks)
+
+    automator = SarfAutomator(sarf_template_path)
+    service = SarfWatchService(automator, 'P&P_Files/', 'CRM Users', 2, 'CRM_SARF_', use_pandas=False)
+    #Process the workbooks 2 at a time without the SARF worker processes
+    service.max_workers = 2
+
+    async def process_workbooks():
+        queue = asyncio.Queue()
+        for file_path in service.user_data_filenames():
+            service._queued.add(file_path)
+            queue.put_nowait((file_path, None))
+        worker = asyncio.ensure_future(service._process_queue(queue))
+        while service._queued:
+            await asyncio.sleep(0.05)
+        worker.cancel()
+    asyncio.run(asyncio.wait_for(process_workbooks(), 60))
+
+    #Each workbook was processed by its own SarfAutomator
+    assert len(service._idle_automators) == 2
+    assert sorted(service._processed) == ['P&P_Files/Bureau A.xlsx', 'P&P_Files/Bureau B.xlsx']
+    assert len(read_sarf_fields('CRM_SARF_Bureau A.pdf')) == 4
+    assert len(read_sarf_fields('CRM_SARF_Bureau B.pdf')) == 5
+
+def test_sarfs_of_the_same_name_wait_for_each_other(sarf_template_path):
+    service = SarfWatchService(SarfAutomator(sarf_template_path), 'P&P_Files/', 'CRM Users', 2, 'CRM_SARF_')
+    events = []
+    def generate(sarf_filenames, name):
+        with service._generating(sarf_filenames):
+            events.append(name + ' start')
+            started.set()
+            finish.wait(10)
+            events.append(name + ' end')
+
+    started = threading.Event()
+    finish = threading.Event()
+    first = threading.Thread(target=generate, args=({'CRM_SARF_A.pdf', 'CRM_SARF_A_ITS.pdf'}, 'first'))
+    first.start()
+    started.wait(10)
+    #A SARF of another name is generated at the same time, the same name waits
+    other = threading.Thread(target=generate, args=({'CRM_SARF_B.pdf'}, 'other'))
+    same = threading.Thread(target=generate, args=({'CRM_SARF_A_ITS.pdf'}, 'same'))
+    same.start()
+    other.start()
+    other.join(0.5)
+    assert events == ['first start', 'other start']
+    finish.set()
+    for thread in (first, other, same):
+        thread.join(10)
+    assert events.index('same start') > events.index('first end')
@@ -0,0 +1,97 @@
+import datetime
+
+import openpyxl
+import pytest
+
+from benchmarks.synthetic_workbook import USER_DATA_COLUMNS
+from field_mapper import string_columns, string_values
+from sarf_automator import SarfAutomator
+from workbook_reader import read_sheet, read_sheet_columns
+
+SHEET_NAME = 'CRM Users'
+
+#Values of the columns that pandas infers a type for, one list per column (None is a blank cell). The other columns get a text value per user
+MIXED_COLUMNS = {
+    #Whole numbers (read as ints)
+    'User Number': [101, 102, 103, 104, 105, 106],
+    #Numbers with a blank value and number strings (read as floats)
+    'Job Title': [1, 2.5, None, '7', '3.25', 4],
+    #Whole numbers stored as floats and a bool (1 and True are equal, pandas keeps the first)
+    'Office': [1.0, True, 2, 'Annex', 3.0, False],
+    #Text with pandas' missing value strings
+    'Bureau': ['Bureau A', 'NA', 'N/A', '', 'null', 'Bureau A'],
+    #Dates and times without blank values
+    'Time Zone': [datetime.datetime(2020, 1, 2), datetime.datetime(2020, 1, 2, 13, 45), datetime.datetime(2021, 12, 31, 0, 0, 1),
+        datetime.datetime(1999, 7, 4), datetime.datetime(2020, 1, 2), datetime.datetime(2030, 6, 15, 8)],
+    #Bools only
+    'Executive Contacts ': [True, False, True, True, False, False],
+    #Bools, text and a blank value
+    'Event Printing': [True, 'No', None, False, 'Yes', None],
+    #Large whole numbers, negative numbers and text
+    'User Type': [2**40, -3, 'CRM User', None, 0, 'CRM Contacts Only User']
+}
+
+def write_mixed_workbook(file_path, mixed_columns, example_values=None, header_row_num=2):
+    #Writes a P&P Excel file with title rows above the column headers, the Example row (with any example_values), one row per user and a
+    #trailing row without a name
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.title = SHEET_NAME
+    for row_num in range(0, header_row_num):
+        sheet.append([f'Title row {row_num + 1}'])
+    sheet.append(USER_DATA_COLUMNS)
+    example_values = example_values or {}
+    sheet.append([example_values.get(col, 'Example' if col == 'User Number' else f'Example {col}') for col in USER_DATA_COLUMNS])
+    num_users = len(next(iter(mixed_columns.values())))
+    for i in range(0, num_users):
+        row = []
+        for col in USER_DATA_COLUMNS:
+            if col in mixed_columns:
+                row.append(mixed_columns[col][i])
+            elif col in ('First Name', 'Last Name'):
+                row.append(f'{col} {i}')
+            else:
+                row.append(f'{col} {i}' if i % 3 else None)
+        sheet.append(row)
+    sheet.append([107] + [None] * (len(USER_DATA_COLUMNS) - 1))
+    workbook.save(file_path)
+
+def mapped_records(sarf_template_path, file_path, use_pandas):
+    #Returns the user records of an Excel file mapped to the SARF PDF fields (see SarfAutomator.iter_workbooks)
+    automator = SarfAutomator(sarf_template_path)
+    return [cur_user_data for data_filename, cur_user_data in automator.iter_workbooks([file_path], SHEET_NAME, 2, use_pandas=use_pandas)]
+
+def test_read_sheet_columns_converts_values_like_read_sheet(tmp_path):
+    file_path = str(tmp_path / 'mixed.xlsx')
+    write_mixed_workbook(file_path, MIXED_COLUMNS)
+
+    sheet_columns = read_sheet_columns(file_path, SHEET_NAME, 2, USER_DATA_COLUMNS)
+    assert sheet_columns is not None, 'The mixed columns should be read without pandas'
+    user_data = read_sheet(file_path, SHEET_NAME, 2, USER_DATA_COLUMNS)
+    assert list(sheet_columns) == list(user_data.columns)
+
+    expected = string_columns(user_data, USER_DATA_COLUMNS)
+    for col in USER_DATA_COLUMNS:
+        assert string_values(sheet_columns[col]) == expected[col].tolist(), col
+
+def test_read_sheet_columns_maps_to_the_same_records(tmp_path, sarf_template_path):
+    file_path = str(tmp_path / 'mixed.xlsx')
+    write_mixed_workbook(file_path, MIXED_COLUMNS)
+
+    records = mapped_records(sarf_template_path, file_path, use_pandas=False)
+    assert len(records[0]) == len(MIXED_COLUMNS['User Number'])
+    assert records == mapped_records(sarf_template_path, file_path, use_pandas=True)
+
+@pytest.mark.parametrize('col, example_value, values', [
+    #Dates with a blank value (pandas reads them as datetime64 with NaT)
+    ('Time Zone', datetime.datetime(2000, 1, 1), [datetime.datetime(2020, 1, 2), None, datetime.datetime(2021, 5, 6, 7, 8),
+        datetime.datetime(2020, 1, 2), None, datetime.datetime(2022, 2, 2)]),
+    #True/False strings (converted to bools differently by each pandas version)
+    ('Event Printing', 'TRUE', ['True', 'false', True, None, 'False', 'true'])
+])
+def test_unsupported_columns_fall_back_to_pandas(tmp_path, sarf_template_path, col, example_value, values):
+    file_path = str(tmp_path / 'fallback.xlsx')
+    write_mixed_workbook(file_path, dict(MIXED_COLUMNS, **{col: values}), {col: example_value})
+
+    assert read_sheet_columns(file_path, SHEET_NAME, 2, USER_DATA_COLUMNS) is None
+    assert mapped_records(sarf_template_path, file_path, use_pandas=False) == mapped_records(sarf_template_path, file_path, use_pandas=True)
@@ -0,0 +1,3 @@
+@echo off
+python "scripts/sarf_automator.py" --watch
+pause
\ No newline at end of file
@@ -0,0 +1,340 @@
+import asyncio
+import copy
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from metrics import RunMetrics
+
+class SarfWatchService():
+    """
+    Long-running service that watches the User Data file path and generates the SARF of each new or changed Excel file as soon as it lands.
+    The SARF templates stay compiled in memory (and the SARF worker processes stay running) between files, so a new SARF only costs
+    reading its Excel file and populating its pages. Files are only queued once their size and modification time have not changed
+    for debounce_seconds, so partially copied files are never read. Up to max_workers queued files are processed at a time, each with 
+    its own copy of the SarfAutomator (files that generate a SARF of the same name, e.g. of the same Bureau, wait for each other)
+
+    Attributes
+    ----------
+    automator: SarfAutomator
+        The SarfAutomator that generates the SARFs (with the SARF template compiled and the build manifest loaded)
+    user_data_path: str
+        Path of file directory that contains the completed user data Excel files
+    data_sheetname: str
+        Name of the Excel sheet that contains the user data in each of the Excel files
+    header_row_num: int
+        Row number (0-based) that contains the column headers of the user data
+    new_pdf_filename_prefix: str
+        The prefix of the new SARF PDF file names
+    max_workers: int
+        Number of Excel files processed at a time, and of SARF worker processes kept running to populate large SARFs (1 processes 
+        one file at a time and populates them in this process)
+    poll_interval: float
+        Number of seconds between scans of the User Data file path
+    debounce_seconds: float
+        Number of seconds the size and modification time of an Excel file must stay unchanged before it is processed
+    run_options: dict
+        Other keyword arguments of SarfAutomator.run (e.g. incremental, shard_size)
+    use_pandas: bool
+        Read the Excel files with pandas instead of the lightweight reader (see SarfAutomator.iter_workbooks)
+    metrics_paths: tuple
+        The file paths/names of the JSON and CSV metrics files written after each Excel file is processed, with the metrics of that file only 
+        (None values are not written)
+    worker_pool: ProcessPoolExecutor
+        The SARF worker processes (None with 1 worker)
+    """
+
+    def __init__(self, automator, user_data_path, data_sheetname, header_row_num=0, new_pdf_filename_prefix=None, max_workers=1, poll_interval=1.0,
+        debounce_seconds=2.0, run_options=None, metrics_paths=(None, None), use_pandas=True):
+        """
+        Parameters
+        ----------
+        automator: SarfAutomator
+            The SarfAutomator that generates the SARFs
+        user_data_path: str
+            Path of file directory that contains the completed user data Excel files
+        data_sheetname: str
+            Name of the Excel sheet that contains the user data in each of the Excel files
+        header_row_num: int, optional
+            Row number (0-based) that contains the column headers of the user data (defaults to 0)
+        new_pdf_filename_prefix: str, optional
+            The prefix of the new SARF PDF file names (defaults to None)
+        max_workers: int, optional
+            Number of Excel files processed at a time, and of SARF worker processes kept running to populate large SARFs 
+            (defaults to 1 - one file at a time, populated in this process)
+        poll_interval: float, optional
+            Number of seconds between scans of the User Data file path (defaults to 1.0)
+        debounce_seconds: float, optional
+            Number of seconds an Excel file must stay unchanged before it is processed (defaults to 2.0)
+        run_options: dict, optional
+            Other keyword arguments of SarfAutomator.run, e.g. {'incremental': True} (defaults to None)
+        metrics_paths: tuple, optional
+            The file paths/names of the JSON and CSV metrics files written after each Excel file is processed (defaults to (None, None) - not written)
+        use_pandas: bool, optional
+            Read the Excel files with pandas instead of the lightweight reader (defaults to True, the user data is the same - see read_sheet_columns)
+        """
+
+        self.automator = automator
+        self.user_data_path = user_data_path
+        self.data_sheetname = data_sheetname
+        self.header_row_num = header_row_num
+        self.new_pdf_filename_prefix = new_pdf_filename_prefix
+        self.max_workers = max_workers
+        self.poll_interval = poll_interval
+        self.debounce_seconds = debounce_seconds
+        self.run_options = run_options or {}
+        self.metrics_paths = metrics_paths
+        self.use_pandas = use_pandas
+        self.worker_pool = automator.create_worker_pool(max_workers) if max_workers > 1 else None
+
+        #Signature (size, modification time) of each Excel file when it was last processed
+        self._processed = {}
+        #Signature of each changed Excel file and when it was first seen with that signature
+        self._pending = {}
+        #Excel files queued or being processed
+        self._queued = set()
+        #SarfAutomators not processing an Excel file (copies of automator are made for concurrent files, see _copy_automator)
+        self._idle_automators = [automator]
+        #Guards the idle SarfAutomators and the metrics files
+        self._lock = threading.Lock()
+        #File names of the SARFs being generated, and the condition notified when they change
+        self._generating_sarfs = set()
+        self._sarfs_changed = threading.Condition()
+        self._template_signature = self._directory_signature(automator.sarf_template_path)
+
+    @staticmethod
+    def _file_signature(file_path):
+        #Returns the size and modification time of a file (None if it no longer exists)
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def _directory_signature(self, directory_path):
+        #Returns the names and signatures of the files in a directory
+        try:
+            file_names = sorted(os.listdir(directory_path))
+        except OSError:
+            return None
+        return tuple((file_name, self._file_signature(os.path.join(directory_path, file_name))) for file_name in file_names)
+
+    def user_data_filenames(self):
+        """
+        Returns the file paths/names of the Excel files (.xls or .xlsx) in the User Data file path, without the lock files
+        Excel creates next to open files (e.g. ~$file.xlsx)
+        """
+
+        try:
+            file_names = sorted(os.listdir(self.user_data_path))
+        except OSError:
+            return []
+        return [self.user_data_path + file_name for file_name in file_names
+            if file_name.lower().endswith(('.xls', '.xlsx')) and not file_name.startswith('~$')]
+
+    def scan(self):
+        """
+        Scans the User Data file path and returns the Excel files that are new or changed since they were last processed and have
+        not changed for debounce_seconds (and can be opened, e.g. are no longer being copied), with their signature
+        """
+
+        if not self._queued:
+            #Only replace the compiled SARF template while no Excel file is being processed
+            self._check_template()
+
+        now = time.monotonic()
+        ready_files = []
+        user_data_filenames = self.user_data_filenames()
+        for file_path in user_data_filenames:
+            signature = self._file_signature(file_path)
+            if signature is None or file_path in self._queued or self._processed.get(file_path) == signature:
+                continue
+            pending = self._pending.get(file_path)
+            if pending is None or pending[0] != signature:
+                #Wait for the file to stop changing
+                self._pending[file_path] = (signature, now)
+                continue
+            if now - pending[1] < self.debounce_seconds or not self._can_open(file_path):
+                continue
+            del self._pending[file_path]
+            ready_files.append((file_path, signature))
+
+        #Forget deleted files, so they are processed again if they are added back
+        for file_path in set(self._processed) - set(user_data_filenames):
+            del self._processed[file_path]
+        return ready_files
+
+    @staticmethod
+    def _can_open(file_path):
+        #Returns True if the file can be opened for reading (files still being copied are locked on Windows)
+        try:
+            with open(file_path, 'rb'):
+                return True
+        except OSError:
+            return False
+
+    def _check_template(self):
+        #Compiles the default SARF template again (and clears the cache of the others) if a template was replaced, and queues every Excel file again
+        template_signature = self._directory_signature(self.automator.sarf_template_path)
+        if template_signature == self._template_signature:
+            return
+        self._template_signature = template_signature
+        pdf_template_file_path = self.automator.pdf_filler.pdf_template_file_path
+        try:
+            self._load_template(self.automator)
+        except Exception as error:
+            print(f'***ERROR: SARF template could not be loaded - {error} - still using {pdf_template_file_path}***')
+            return
+        print(f'SARF template changed, reloaded {self.automator.pdf_filler.pdf_template_file_path}')
+        #The copies of automator are made again from the reloaded one
+        self._close_copies()
+        if self.worker_pool is not None:
+            self.worker_pool.shutdown()
+            self.worker_pool = self.automator.create_worker_pool(self.max_workers)
+        self._processed = {}
+
+    def _load_template(self, automator):
+        #Compiles the default SARF template of a SarfAutomator again, with the output options of automator
+        pdf_filler = self.automator.pdf_filler
+        automator.load_template(self.automator.sarf_template_path, pdf_filler.compress_output, pdf_filler.generate_appearances, pdf_filler.flatten, 
+            pdf_filler.write_threads, self.automator.default_template, self.automator.template_cache.max_size)
+
+    def _copy_automator(self):
+        #Returns a copy of automator for another concurrent Excel file, with its own compiled SARF templates, metrics and user data
+        #(the build manifest, workbook cache and field mappings are shared)
+        automator = copy.copy(self.automator)
+        automator.user_data = []
+        automator.metrics = RunMetrics()
+        automator.pdf_filler = None
+        self._load_template(automator)
+        return automator
+
+    def _close_copies(self):
+        #Stops the background writer threads of the copies of automator and forgets them (only called while no Excel file is processed)
+        with self._lock:
+            for automator in self._idle_automators:
+                if automator is not self.automator:
+                    automator.pdf_filler.close()
+            self._idle_automators = [self.automator]
+
+    @contextmanager
+    def _generating(self, sarf_filenames):
+        #Waits until no other Excel file is generating any of the SARFs, and marks them as being generated until the context exits
+        with self._sarfs_changed:
+            self._sarfs_changed.wait_for(lambda: not self._generating_sarfs & sarf_filenames)
+            self._generating_sarfs |= sarf_filenames
+        try:
+            yield
+        finally:
+            with self._sarfs_changed:
+                self._generating_sarfs -= sarf_filenames
+                self._sarfs_changed.notify_all()
+
+    def process_workbook(self, file_path, automator=None):
+        """
+        Reads an Excel file and generates its SARF (SARFs whose inputs have not changed are reused, see SarfAutomator.run).
+        The metrics of the SarfAutomator are reset first, so the metrics files only report this Excel file
+
+        Parameters
+        ----------
+        file_path: str
+            The file path/name of the Excel file
+        automator: SarfAutomator, optional
+            The SarfAutomator that generates the SARF, Excel files processed at the same time need separate ones 
+            (defaults to None - automator)
+        """
+
+        automator = automator or self.automator
+        automator.metrics.reset()
+        start_time = time.perf_counter()
+        try:
+            automator.user_data = [cur_user_data for data_filename, cur_user_data in
+                automator.iter_workbooks([file_path], self.data_sheetname, self.header_row_num, use_pandas=self.use_pandas)]
+            #Another Excel file may generate a SARF of the same name (e.g. of the same Bureau)
+            sarf_filenames = set(new_sarf_filename for cur_user_data in automator.user_data 
+                for new_sarf_filename, user_records in automator.sarf_shards(cur_user_data, self.new_pdf_filename_prefix))
+            with self._generating(sarf_filenames):
+                automator.run(self.new_pdf_filename_prefix, True, self.max_workers, worker_pool=self.worker_pool, **self.run_options)
+        finally:
+            automator.user_data = []
+        print(f'Processed {file_path} in {time.perf_counter() - start_time:.1f} seconds')
+
+        metrics_json_path, metrics_csv_path = self.metrics_paths
+        with self._lock:
+            if metrics_json_path:
+                automator.metrics.write_json(metrics_json_path)
+            if metrics_csv_path:
+                automator.metrics.write_csv(metrics_csv_path)
+
+    def _process_job(self, file_path):
+        #Processes an Excel file in a job thread with an idle SarfAutomator (a copy of automator is made if every one is busy)
+        with self._lock:
+            automator = self._idle_automators.pop() if self._idle_automators else None
+        if automator is None:
+            automator = self._copy_automator()
+        try:
+            self.process_workbook(file_path, automator)
+        finally:
+            with self._lock:
+                self._idle_automators.append(automator)
+
+    async def watch(self):
+        """
+        Scans the User Data file path every poll_interval seconds and queues each Excel file that is ready, while max_workers 
+        worker tasks process the queued files in background threads (runs until cancelled)
+        """
+
+        queue = asyncio.Queue()
+        worker = asyncio.ensure_future(self._process_queue(queue))
+        try:
+            while True:
+                for file_path, signature in self.scan():
+                    self._queued.add(file_path)
+                    queue.put_nowait((file_path, signature))
+                if worker.done():
+                    #Raise the error that stopped the worker task
+                    worker.result()
+                await asyncio.sleep(self.poll_interval)
+        finally:
+            worker.cancel()
+
+    async def _process_queue(self, queue):
+        #Processes up to max_workers queued Excel files at a time in background threads, so the folder keeps being scanned
+        loop = asyncio.get_event_loop()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as job_threads:
+            workers = [asyncio.ensure_future(self._process_jobs(queue, loop, job_threads)) for _ in range(0, self.max_workers)]
+            try:
+                await asyncio.gather(*workers)
+            finally:
+                for worker in workers:
+                    worker.cancel()
+
+    async def _process_jobs(self, queue, loop, job_threads):
+        #Processes the queued Excel files one at a time in a job thread (one of the max_workers worker tasks)
+        while True:
+            file_path, signature = await queue.get()
+            try:
+                await loop.run_in_executor(job_threads, self._process_job, file_path)
+            except Exception as error:
+                #Report the error and wait for the file to change instead of stopping the service
+                print(f'***ERROR: {file_path} could not be processed - {error}***')
+            finally:
+                self._processed[file_path] = signature
+                self._queued.discard(file_path)
+
+    def run_forever(self):
+        """
+        Runs the service until it is stopped (e.g. with Ctrl+C)
+        """
+
+        print(f'Watching {self.user_data_path} for new or changed P&P files (press Ctrl+C to stop)...')
+        try:
+            asyncio.run(self.watch())
+        except KeyboardInterrupt:
+            print('Stopped watching.')
+        finally:
+            self._close_copies()
+            if self.worker_pool is not None:
+                self.worker_pool.shutdown()
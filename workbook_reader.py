@@ -0,0 +1,268 @@
+import datetime
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+#Values read as blank (NaN) by pandas.read_excel (its default na_values)
+NA_VALUES = {'', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', 'N/A', 'NA', 'NULL', 'NaN', 'n/a', 'nan', 'null'}
+#Values only read as blank by some pandas versions
+VERSION_NA_VALUES = {'<NA>', 'None'}
+#Strings pandas.read_excel reads as whole numbers or as floats (surrounding whitespace is ignored)
+INT_PATTERN = re.compile(r'[ \t\n\r\f\v]*[-+]?[0-9]+[ \t\n\r\f\v]*\Z')
+FLOAT_PATTERN = re.compile(r'[ \t\n\r\f\v]*[-+]?([0-9]+(\.[0-9]+)?|\.[0-9]+)([eE][-+]?[0-9]+)?[ \t\n\r\f\v]*\Z')
+
+class SheetNotFoundError(ValueError):
+    #Raised when the user data sheet cannot be found in an Excel file
+    pass
+
+def read_sheet(file_path, sheet_name, header_row_num=0, columns=None):
+    """
+    Reads a single sheet of an Excel file into a DataFrame, keeping only the specified columns.
+    .xlsx files are streamed row by row with a read-only openpyxl workbook (other sheets are never parsed),
+    other formats fall back to pandas.read_excel
+
+    Parameters
+    ----------
+    file_path: str
+        The file path/name of the Excel file
+    sheet_name: str
+        Name of the Excel sheet to read
+    header_row_num: int, optional
+        Row number (0-based) that contains the column headers (defaults to 0)
+    columns: list, optional
+        List of the column names to read (defaults to None - all columns). Columns not found in the sheet are ignored
+
+    Returns
+    -------
+    DataFrame
+        The data of the sheet, with values converted the same way as pandas.read_excel
+
+    Raises
+    ------
+    SheetNotFoundError
+        If the sheet cannot be found in the Excel file
+    """
+
+    import pandas as pd
+    from pandas.io.parsers import TextParser
+
+    if file_path.lower().endswith('.xlsx'):
+        try:
+            import openpyxl
+        except ImportError:
+            openpyxl = None
+        if openpyxl is not None:
+            data = _read_xlsx_rows(openpyxl, file_path, sheet_name, header_row_num, columns)
+            if data is None:
+                return pd.DataFrame()
+            #Parse the rows with the same parser as pandas.read_excel so the column types match
+            parser = TextParser(data, header=0)
+            try:
+                return parser.read()
+            finally:
+                parser.close()
+
+    with pd.ExcelFile(file_path) as excel_file:
+        if sheet_name not in excel_file.sheet_names:
+            raise SheetNotFoundError(f"Sheet name: '{sheet_name}' could not be found in file: '{file_path}' - please confirm sheet name and try again.")
+        usecols = None if columns is None else lambda col: col in columns
+        return excel_file.parse(sheet_name, skiprows=header_row_num, usecols=usecols)
+
+def read_sheets(file_paths, sheet_name, header_row_num=0, columns=None, max_workers=1, max_in_flight=None, reader=None):
+    """
+    Generator that reads the same sheet of each Excel file (see read_sheet) and yields the DataFrames in the order of the file paths.
+    With more than 1 worker, the files are read ahead by a process pool
+
+    Parameters
+    ----------
+    file_paths: list
+        List of the file paths/names of the Excel files
+    sheet_name: str
+        Name of the Excel sheet to read
+    header_row_num: int, optional
+        Row number (0-based) that contains the column headers (defaults to 0)
+    columns: list, optional
+        List of the column names to read (defaults to None - all columns)
+    max_workers: int, optional
+        Number of worker processes used to read the files (defaults to 1 - read one at a time when requested)
+    max_in_flight: int, optional
+        Maximum number of files read ahead of (and including) the last yielded DataFrame by the worker processes 
+        (defaults to None - all files are read ahead)
+    reader: function, optional
+        The function used to read each sheet, e.g. read_sheet_columns (defaults to None - read_sheet)
+
+    Yields
+    ------
+    DataFrame
+        The data of the sheet of each Excel file (the value returned by reader)
+    """
+
+    reader = reader or read_sheet
+    if max_workers <= 1 or len(file_paths) <= 1:
+        for file_path in file_paths:
+            yield reader(file_path, sheet_name, header_row_num, columns)
+        return
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for file_path in file_paths:
+            pending.append(executor.submit(reader, file_path, sheet_name, header_row_num, columns))
+            if max_in_flight and len(pending) >= max_in_flight:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def read_sheet_columns(file_path, sheet_name, header_row_num=0, columns=None):
+    """
+    Reads a single sheet of an .xlsx file into a dictionary of the column names and the list of their values without pandas 
+    (much faster to start for small files). The values are converted the same way as read_sheet (e.g. a column of whole numbers 
+    with a blank value is read as floats), with None for blank values
+
+    Parameters
+    ----------
+    file_path: str
+        The file path/name of the Excel file
+    sheet_name: str
+        Name of the Excel sheet to read
+    header_row_num: int, optional
+        Row number (0-based) that contains the column headers (defaults to 0)
+    columns: list, optional
+        List of the column names to read (defaults to None - all columns). Columns not found in the sheet are ignored
+
+    Returns
+    -------
+    dict
+        Dictionary of the column names and the list of their values (None if the file cannot be read the same way as read_sheet 
+        without pandas, e.g. it is not an .xlsx file or has a column of dates with blank values - use read_sheet instead)
+
+    Raises
+    ------
+    SheetNotFoundError
+        If the sheet cannot be found in the Excel file
+    """
+
+    if not file_path.lower().endswith('.xlsx'):
+        return None
+    try:
+        import openpyxl
+    except ImportError:
+        return None
+
+    data = _read_xlsx_rows(openpyxl, file_path, sheet_name, header_row_num, columns)
+    if data is None:
+        return {}
+    header = data[0]
+    if len(set(header)) < len(header):
+        #pandas renames duplicate columns
+        return None
+    rows = data[1:]
+    if len(header) == 1:
+        #Remove the blank lines of a single column (as the pandas parser does)
+        rows = [row for row in rows if not isinstance(row[0], str) or row[0].strip()]
+
+    sheet_columns = {}
+    for i, col in enumerate(header):
+        col_values = _convert_column([row[i] for row in rows])
+        if col_values is None:
+            return None
+        sheet_columns[col] = col_values
+    return sheet_columns
+
+def _convert_column(values):
+    #Converts the values of a column the same way as the pandas parser, with None for blank values (None if pandas converts the values differently)
+    #A column of numbers (or number strings) becomes ints, or floats if any value is blank or a float. Other columns keep their values
+    if any(isinstance(value, str) and value in VERSION_NA_VALUES for value in values):
+        return None
+    values = [None if isinstance(value, str) and value in NA_VALUES else value for value in values]
+    has_blanks = None in values
+
+    numbers = []
+    is_float = has_blanks
+    for value in values:
+        if value is None:
+            numbers.append(None)
+        elif isinstance(value, (bool, int)):
+            if not -2**63 <= value < 2**63:
+                return None
+            numbers.append(value)
+        elif isinstance(value, float):
+            is_float = True
+            numbers.append(value)
+        elif isinstance(value, str) and INT_PATTERN.match(value):
+            number = int(value)
+            if not -2**63 <= number < 2**63:
+                return None
+            numbers.append(number)
+        elif isinstance(value, str) and FLOAT_PATTERN.match(value):
+            number = float(value)
+            if len(value.split('e')[0].split('E')[0].strip(' \t\n\r\f\v+-.0').replace('.', '')) > 15 or number in (float('inf'), float('-inf')):
+                #pandas may round long decimals differently
+                return None
+            is_float = True
+            numbers.append(number)
+        else:
+            if isinstance(value, str):
+                try:
+                    float(value)
+                except ValueError:
+                    break
+                #Other number formats (e.g. 'inf', '1.') may or may not be read as numbers
+                return None
+            break
+    else:
+        if not has_blanks and values and all(isinstance(value, bool) for value in values):
+            return values
+        if is_float:
+            return [None if number is None else float(number) for number in numbers]
+        return [int(number) for number in numbers]
+
+    present_values = [value for value in values if value is not None]
+    if present_values and all(isinstance(value, (bool, str)) and str(value).lower() in ('true', 'false') for value in present_values):
+        #Columns of True/False strings are converted to bools (differently by each pandas version)
+        return None
+    if present_values and all(isinstance(value, datetime.date) for value in present_values) and \
+        any(isinstance(value, datetime.datetime) for value in present_values):
+        if has_blanks or not all(isinstance(value, datetime.datetime) and value.tzinfo is None for value in present_values):
+            #pandas converts columns of dates to datetime64 values (blank values become NaT)
+            return None
+
+    #pandas reuses the first of any equal values (e.g. 1 and True)
+    first_values = {}
+    return [first_values.setdefault(value, value) if value is not None else None for value in values]
+
+def _read_xlsx_rows(openpyxl, file_path, sheet_name, header_row_num, columns):
+    #Reads the header and rows of a sheet of an .xlsx file with a read-only (streaming) openpyxl workbook (None if the sheet is empty)
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        if sheet_name not in workbook.sheetnames:
+            raise SheetNotFoundError(f"Sheet name: '{sheet_name}' could not be found in file: '{file_path}' - please confirm sheet name and try again.")
+
+        rows = workbook[sheet_name].iter_rows(min_row=header_row_num + 1, values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return None
+
+        #Index of each column to keep
+        if columns is None:
+            col_indexes = list(range(0, len(header)))
+        else:
+            col_indexes = [i for i, col in enumerate(header) if col in columns]
+
+        data = [[_convert_cell(header[i]) for i in col_indexes]]
+        for row in rows:
+            data.append([_convert_cell(row[i]) if i < len(row) else '' for i in col_indexes])
+    finally:
+        workbook.close()
+
+    #Trim trailing empty rows (as pandas.read_excel does)
+    while len(data) > 1 and all(value == '' for value in data[-1]):
+        data.pop()
+    return data
+
+def _convert_cell(value):
+    #Converts an openpyxl cell value the same way as the pandas openpyxl reader (blank cells are '' and whole floats are ints)
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value